@@ -0,0 +1,21 @@
+import sys
+from argparse import ArgumentParser
+
+from ebihpc.archive import Archive
+
+
+def main():
+    parser = ArgumentParser(description="Archive finished jobs in a "
+                                        "columnar format")
+    parser.add_argument("database", help="job database")
+    parser.add_argument("archive", help="archive directory")
+    args = parser.parse_args()
+
+    archive = Archive(args.archive)
+    for day in archive.update(args.database):
+        sys.stderr.write(f"{day}: {archive.days[day]['jobs']:,} jobs "
+                         f"archived\n")
+
+
+if __name__ == "__main__":
+    main()
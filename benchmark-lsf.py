@@ -0,0 +1,88 @@
+import io
+import json
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+from ebihpc import lsf
+
+
+def main():
+    parser = ArgumentParser(description="Measure the cost of parsing bjobs "
+                                        "output on a synthetic dump")
+    parser.add_argument("--records", type=int, default=500000,
+                        help="number of jobs, default: 500000")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed, default: 0")
+    args = parser.parse_args()
+
+    data = make_dump(args.records, args.seed)
+    print(f"{args.records:,} records, {len(data) / 1024 ** 2:.0f} MB")
+
+    t0 = time.perf_counter()
+    records = list(lsf.read_records(io.BytesIO(data)))
+    t1 = time.perf_counter()
+    for rec in records:
+        lsf.parse_record(rec)
+    t2 = time.perf_counter()
+
+    n = len(records)
+    print(f"{'decode':<10}{(t1 - t0) / n * 1e6:>8.2f} µs/record")
+    print(f"{'parse':<10}{(t2 - t1) / n * 1e6:>8.2f} µs/record")
+    print(f"{'total':<10}{(t2 - t0) / n * 1e6:>8.2f} µs/record")
+
+    info = lsf._parse_date.cache_info()
+    print(f"times: {info.hits:,} cached, {info.misses:,} parsed")
+
+
+def make_dump(num_records: int, seed: int) -> bytes:
+    # bjobs -a output: jobs submitted over a few days, most of them finished
+    rnd = random.Random(seed)
+    now = datetime.now().replace(second=0, microsecond=0)
+    users = [f"user{i}" for i in range(500)]
+    queues = ["standard", "short", "long", "bigmem", "gpu"]
+
+    records = []
+    for i in range(num_records):
+        submit = now - timedelta(minutes=rnd.randint(60, 3 * 24 * 60))
+        start = submit + timedelta(minutes=rnd.choice([0, 0, 1, 5, 30]))
+        finish = start + timedelta(minutes=rnd.choice([0, 1, 5, 60, 600]))
+        if finish > now:
+            status, finish = "RUN", None
+        else:
+            status = rnd.choice(["DONE", "DONE", "DONE", "EXIT"])
+
+        records.append({
+            "JOBID": str(1000000 + i),
+            "JOBINDEX": "0",
+            "JOB_NAME": f"job-{rnd.randint(0, 10000)}",
+            "STAT": status,
+            "USER": rnd.choice(users),
+            "QUEUE": rnd.choice(queues),
+            "SLOTS": str(rnd.choice([1, 1, 2, 4, 8, 16])),
+            "MEMLIMIT": rnd.choice(["", "4 Gbytes", "8 Gbytes", "16 Gbytes",
+                                    "500 Mbytes", "1 Tbytes"]),
+            "MAX_MEM": (f"{rnd.randint(1, 4000)} Mbytes"
+                        if rnd.random() < .5
+                        else f"{rnd.randint(1, 4000) / 100:.2f} Gbytes"),
+            "FROM_HOST": f"login-{rnd.randint(1, 4)}",
+            "EXEC_HOST": f"node-{rnd.randint(1, 2000)}",
+            "SUBMIT_TIME": f"{submit:%b %e %H:%M}",
+            "START_TIME": f"{start:%b %e %H:%M}",
+            "FINISH_TIME": f"{finish:%b %e %H:%M} L" if finish else "",
+            "CPU_EFFICIENCY": f"{rnd.uniform(0, 100):.2f}%",
+            "MEM_EFFICIENCY": f"{rnd.uniform(0, 100):.2f}%",
+            "CPU_USED": f"{rnd.uniform(0, 1e5):.1f} second(s)"
+        })
+
+    dump = {
+        "COMMAND": "bjobs",
+        "JOBS": num_records,
+        "RECORDS": records
+    }
+    return json.dumps(dump, indent=2).encode("utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import math
 from argparse import ArgumentParser
 from datetime import datetime, timedelta
 
-from ebihpc import const, jobdb, usagedb
+from ebihpc import const, intervals, jobdb, usagedb
 
 
 DT_REPR = "%Y-%m-%d %H:%M:%S"
@@ -12,6 +12,14 @@ DT_REPR = "%Y-%m-%d %H:%M:%S"
 def main():
     parser = ArgumentParser(description="Create monthly report")
     parser.add_argument("--verbose", action="store_true", help="show progress")
+    parser.add_argument("--engine", choices=["python", "numpy"],
+                        default="python",
+                        help="jobs processing engine, default: python")
+    parser.add_argument("--batch-size", type=int, default=1000000,
+                        help="number of jobs processed at once by the numpy "
+                             "engine, default: 1000000")
+    parser.add_argument("--archive", metavar="DIR",
+                        help="read finished jobs from a columnar archive")
     parser.add_argument("input", help="job database")
     parser.add_argument("month", metavar="current|previous|YYYY-MM")
     parser.add_argument("output", help="usage database")
@@ -39,21 +47,50 @@ def main():
 
     logging.info(f"Creating report for {from_time:%B %Y}")
 
-    con = jobdb.connect(args.input)
-    last_jobs_update = jobdb.get_latest_update_time(con)
+    if args.engine == "numpy":
+        from ebihpc import vectorized
+        user_data, num_jobs = vectorized.report_jobs(args.input, from_time,
+                                                     to_time, args.batch_size,
+                                                     args.archive)
+    else:
+        user_data, num_jobs = report_jobs(args.input, from_time, to_time,
+                                          args.archive)
+
+    logging.debug(f"{num_jobs:>20,}")
+
+    total_co2e = sum((u["co2e"] for u in user_data.values()))
+
+    for i, user in enumerate(sorted(user_data.values(),
+                                    key=lambda u: -u["co2e"])):
+        user["rank"] = i + 1
+        user["totalCo2e"] = total_co2e
+
+    usagedb.update_reports(args.output, from_time, user_data)
+    logging.info("Done")
+
+
+def report_jobs(database: str, from_time: datetime, to_time: datetime,
+                archive_dir: str | None = None) -> tuple[dict[str, dict], int]:
+    con = jobdb.connect(database)
+    # No job polled (e.g. only archived jobs): no running job to stop
+    last_jobs_update = jobdb.get_latest_update_time(con) or to_time
     con.close()
 
     user_data = {}
     num_jobs = 0
-    for job in jobdb.find_jobs(args.input, from_time, to_time):
+    for job in jobdb.find_jobs(database, from_time, to_time,
+                               archive_dir=archive_dir):
         num_jobs += 1
 
         if num_jobs % 1e6 == 0:
             logging.debug(f"{num_jobs:>20,}")
 
-        cpu_eff = min(job.cpu_efficiency, 100)
-
-        cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+        if job.cpu_efficiency is not None:
+            cpu_eff = min(job.cpu_efficiency, 100)
+            cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+        else:
+            # Unknown CPU efficiency: assume all cores are used
+            cores_power = job.slots * const.CPU_POWER
         if "gpu" in job.queue:
             # Unknown GPU number and GPU efficiency: assume 1
             cores_power += 1 * 1 * const.GPU_POWER
@@ -74,14 +111,8 @@ def main():
         energy_kw = (cores_power + mem_power) / 1000
         co2e, cost = const.calc_footprint(energy_kw, runtime_min / 60,
                                           start_time)
-        minutes = 0
-        for dt in usagedb.range_dt(start_time,
-                                   finish_time,
-                                   timedelta(minutes=1)):
-            if dt >= to_time:
-                break
-            elif from_time <= dt:
-                minutes += 1
+        minutes = intervals.count(start_time, finish_time, from_time,
+                                  to_time)
 
         try:
             data = user_data[job.user]
@@ -112,23 +143,13 @@ def main():
             else:
                 data["jobs"]["exit"] += 1
 
-        data["co2e"] += co2e / runtime_min * minutes
-        data["cost"] += cost / runtime_min * minutes
+        if runtime_min > 0:
+            # Running jobs started after the last poll have no runtime
+            data["co2e"] += co2e / runtime_min * minutes
+            data["cost"] += cost / runtime_min * minutes
         data["cputime"] += job.cpu_time or 0
 
-    con.close()
-
-    logging.debug(f"{num_jobs:>20,}")
-
-    total_co2e = sum((u["co2e"] for u in user_data.values()))
-
-    for i, user in enumerate(sorted(user_data.values(),
-                                    key=lambda u: -u["co2e"])):
-        user["rank"] = i + 1
-        user["totalCo2e"] = total_co2e
-
-    usagedb.update_reports(args.output, from_time, user_data)
-    logging.info("Done")
+    return user_data, num_jobs
 
 
 if __name__ == '__main__':
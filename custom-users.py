@@ -1,13 +1,19 @@
 import json
+import sys
 from argparse import ArgumentParser
 
-from ebihpc import usagedb
+from ebihpc import ebisearch, usagedb
 
 
 def main():
     parser = ArgumentParser(description="Update users metadata")
     parser.add_argument("database", help="usage database")
     parser.add_argument("users", help="users JSON file")
+    parser.add_argument("--search-url", default=ebisearch.URL, metavar="URL",
+                        help="EBI Search endpoint of users metadata")
+    parser.add_argument("--search-cache", metavar="FILE",
+                        help="cache of EBI Search responses, read if "
+                             "EBI Search cannot be reached")
     parser.add_argument("login", help="login of user to update")
     args = parser.parse_args()
 
@@ -32,6 +38,21 @@ def main():
         _print("Database", user.name, user.position, user.teams, user.sponsor,
                user.photo_url)
 
+    try:
+        payloads, _, _ = ebisearch.search_many([login], args.search_url)
+    except OSError as exc:
+        # e.g. network or HTTP error: metadata can still be entered
+        sys.stderr.write(f"EBI Search failed: {exc}\n")
+        payload = get_cached(args.search_cache, args.search_url, login)
+        title = "EBI Search (cached)"
+    else:
+        payload = payloads[login]
+        title = "EBI Search"
+
+    if payload is not None:
+        name, position, teams, photo_url = ebisearch.parse(login, payload)
+        _print(title, name, position, teams, None, photo_url)
+
     if login in js_users:
         user = js_users[login]
         _print("JSON", user["name"], user["position"], user["teams"],
@@ -71,6 +92,18 @@ def main():
         print("Aborted")
 
 
+def get_cached(cache: str | None, url: str, login: str) -> str | None:
+    # Last response of EBI Search, even if expired
+    if cache is None:
+        return None
+
+    con = ebisearch.connect_cache(cache)
+    row = con.execute("SELECT payload FROM response "
+                      "WHERE url = ? AND login = ?", [url, login]).fetchone()
+    con.close()
+    return row[0] if row else None
+
+
 def parse_str(s: str, default: str | None) -> str | None:
     s = s.strip()
     if s.lower() == "n/a":
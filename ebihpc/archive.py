@@ -0,0 +1,324 @@
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from . import jobdb
+from .model import Job, parse_time, split_scheduler, to_epoch
+
+
+# Days are archived once no job finishing during the day is expected anymore
+CLOSE_DELAY = timedelta(days=1)
+
+# Dictionary-encoded columns, -1 for None
+STRINGS = ["scheduler", "name", "status", "user", "queue", "from_host",
+           "exec_host"]
+INTEGERS = ["id", "index", "slots"]
+# None stored as NaN
+FLOATS = ["cpu_efficiency", "cpu_time", "mem_lim", "mem_max",
+          "mem_efficiency"]
+# Seconds since 1970-01-01 00:00:00 (naive, like stored times), -1 for None
+TIMES = ["submit_time", "start_time", "finish_time", "update_time"]
+
+# Index of columns in rows of the job table
+COLUMNS = {
+    "scheduler": 1,
+    "id": 2,
+    "index": 3,
+    "name": 4,
+    "status": 5,
+    "user": 6,
+    "queue": 7,
+    "slots": 8,
+    "cpu_efficiency": 9,
+    "cpu_time": 10,
+    "mem_lim": 11,
+    "mem_max": 12,
+    "mem_efficiency": 13,
+    "from_host": 14,
+    "exec_host": 15,
+    "submit_time": 16,
+    "start_time": 17,
+    "finish_time": 18,
+    "update_time": 19
+}
+
+
+class Archive:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest = os.path.join(directory, "manifest.json")
+
+        try:
+            with open(self.manifest, "rt") as fh:
+                self.days = json.load(fh)
+        except FileNotFoundError:
+            self.days = {}
+
+    @property
+    def until(self) -> datetime | None:
+        # Jobs finished before this time are archived
+        if self.days:
+            day = datetime.strptime(max(self.days), "%Y-%m-%d")
+            return day + timedelta(days=1)
+
+        return None
+
+    def update(self, database: str) -> list[str]:
+        con = jobdb.connect(database)
+        last_jobs_update = jobdb.get_latest_update_time(con)
+        if last_jobs_update is None:
+            # No job (e.g. new database): no day is over
+            con.close()
+            return []
+
+        day = self.until
+        if day is None:
+            value, = con.execute("SELECT MIN(finish_time) "
+                                 "FROM job").fetchone()
+            if value is None:
+                con.close()
+                return []
+
+            dt = parse_time(value)
+            day = datetime(dt.year, dt.month, dt.day)
+
+        # Archived days with jobs written since (e.g. loaded from accounting
+        # files) are written again
+        days = self.find_changed(con)
+        for name in days:
+            self.write_day(con, datetime.strptime(name, "%Y-%m-%d"))
+
+        while day + timedelta(days=1) + CLOSE_DELAY <= last_jobs_update:
+            self.write_day(con, day)
+            days.append(day.strftime("%Y-%m-%d"))
+            day += timedelta(days=1)
+
+        con.close()
+        return days
+
+    def find_changed(self, con: sqlite3.Connection) -> list[str]:
+        # Archived days of jobs written after the day was
+        if not self.days:
+            return []
+
+        update_times = {name: self._get_update_time(name)
+                        for name in self.days}
+        days = set()
+        for finish_time, update_time in con.execute(
+            """
+            SELECT finish_time, update_time
+            FROM job
+            WHERE update_time > ? AND finish_time < ?
+            """,
+            [jobdb.to_param(con, min(update_times.values())),
+             jobdb.to_param(con, self.until)]
+        ):
+            name = parse_time(finish_time).strftime("%Y-%m-%d")
+            if (name in update_times
+                    and parse_time(update_time) > update_times[name]):
+                days.add(name)
+
+        return sorted(days)
+
+    def _get_update_time(self, name: str) -> datetime:
+        # Jobs written until this time are archived
+        try:
+            return parse_time(self.days[name]["update_time"])
+        except KeyError:
+            # Archived by earlier versions: once the day was closed
+            day = datetime.strptime(name, "%Y-%m-%d")
+            return day + timedelta(days=1) + CLOSE_DELAY
+
+    def write_day(self, con: sqlite3.Connection, day: datetime):
+        value, = con.execute("SELECT MAX(update_time) FROM job").fetchone()
+        update_time = parse_time(value)
+
+        columns = {key: [] for key in COLUMNS}
+        for row in con.execute(
+            """
+            SELECT *
+            FROM job
+            WHERE finish_time >= ? AND finish_time < ?
+            """,
+            [jobdb.to_param(con, day),
+             jobdb.to_param(con, day + timedelta(days=1))]
+        ):
+            for key, i in COLUMNS.items():
+                columns[key].append(row[i])
+
+        name = day.strftime("%Y-%m-%d")
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        dictionaries = {}
+        for key in STRINGS:
+            values = np.array(columns[key], dtype=object)
+            found = np.array([v is not None for v in columns[key]],
+                             dtype=bool)
+            values, found_codes = np.unique(values[found].astype(str),
+                                            return_inverse=True)
+            codes = np.full(len(found), -1, dtype=np.int32)
+            codes[found] = found_codes
+            dictionaries[key] = values.tolist()
+            np.save(os.path.join(tmp_path, f"{key}.npy"), codes)
+
+        for key in INTEGERS:
+            np.save(os.path.join(tmp_path, f"{key}.npy"),
+                    np.array(columns[key], dtype=np.int64))
+
+        for key in FLOATS:
+            np.save(os.path.join(tmp_path, f"{key}.npy"),
+                    np.array(columns[key], dtype=np.float64))
+
+        for key in TIMES:
+            np.save(os.path.join(tmp_path, f"{key}.npy"),
+                    to_seconds(columns[key]))
+
+        with open(os.path.join(tmp_path, "dictionaries.json"), "wt") as fh:
+            json.dump(dictionaries, fh)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+        starts = to_seconds(columns["start_time"])
+        starts = starts[starts >= 0]
+        self.days[name] = {
+            "jobs": len(columns["id"]),
+            "min_start_time": int(starts.min()) if starts.size else None,
+            "update_time": to_epoch(update_time)
+        }
+        with open(self.manifest + ".tmp", "wt") as fh:
+            json.dump(self.days, fh, indent=4, sort_keys=True)
+
+        os.replace(self.manifest + ".tmp", self.manifest)
+
+    def iter_days(self, from_dt: datetime, to_dt: datetime,
+                  user: str | None = None,
+                  submitted: tuple[datetime, datetime] | None = None):
+        from_ts = to_seconds(from_dt)
+        to_ts = to_seconds(to_dt)
+        from_day = from_dt.strftime("%Y-%m-%d")
+
+        for name, info in sorted(self.days.items()):
+            if name < from_day:
+                # All jobs finished before the interval
+                continue
+            elif (info["min_start_time"] is None
+                    or info["min_start_time"] >= to_ts):
+                # All jobs started after the interval
+                continue
+
+            jobs = self.read_day(name)
+            start_time = jobs["start_time"]
+            finish_time = jobs["finish_time"]
+            mask = (start_time >= 0) & (
+                ((start_time >= from_ts) & (start_time < to_ts))
+                | ((finish_time >= from_ts) & (finish_time < to_ts))
+                | ((start_time < from_ts) & (finish_time >= to_ts))
+            )
+            if user:
+                mask &= jobs["user"] == user
+            if submitted:
+                submit_time = jobs["submit_time"]
+                mask &= ((submit_time >= to_seconds(submitted[0]))
+                         & (submit_time < to_seconds(submitted[1])))
+
+            if mask.any():
+                yield {key: values[mask] for key, values in jobs.items()}
+
+    def read_day(self, name: str) -> dict[str, np.ndarray]:
+        path = os.path.join(self.directory, name)
+        with open(os.path.join(path, "dictionaries.json"), "rt") as fh:
+            dictionaries = json.load(fh)
+
+        jobs = {}
+        for key in COLUMNS:
+            values = np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")
+            if key in dictionaries:
+                # Code -1: last value, None (days written by earlier
+                # versions have None in their dictionaries instead)
+                values = np.array(dictionaries[key] + [None],
+                                  dtype=object)[values]
+
+            jobs[key] = values
+
+        return jobs
+
+    def load(self, from_dt: datetime, to_dt: datetime,
+             user: str | None = None,
+             submitted: tuple[datetime, datetime] | None = None
+             ) -> dict[str, np.ndarray]:
+        days = list(self.iter_days(from_dt, to_dt, user, submitted))
+        if days:
+            return {key: np.concatenate([d[key] for d in days])
+                    for key in COLUMNS}
+
+        jobs = {}
+        for key in COLUMNS:
+            if key in STRINGS:
+                jobs[key] = np.array([], dtype=object)
+            elif key in FLOATS:
+                jobs[key] = np.array([], dtype=np.float64)
+            else:
+                jobs[key] = np.array([], dtype=np.int64)
+
+        return jobs
+
+    def find_jobs(self, from_dt: datetime, to_dt: datetime,
+                  user: str | None = None,
+                  submitted: tuple[datetime, datetime] | None = None):
+        for jobs in self.iter_days(from_dt, to_dt, user, submitted):
+            values = {}
+            for key in COLUMNS:
+                if key in TIMES:
+                    values[key] = to_datetimes(jobs[key])
+                else:
+                    values[key] = np.asarray(jobs[key]).tolist()
+
+            for i in range(len(values["id"])):
+                scheduler, cluster = split_scheduler(values["scheduler"][i])
+                yield Job(scheduler=scheduler,
+                          id=values["id"][i],
+                          index=values["index"][i],
+                          name=values["name"][i],
+                          status=values["status"][i],
+                          user=values["user"][i],
+                          queue=values["queue"][i],
+                          slots=values["slots"][i],
+                          cpu_efficiency=_none(values["cpu_efficiency"][i]),
+                          cpu_time=_none(values["cpu_time"][i]),
+                          mem_lim=_int(values["mem_lim"][i]),
+                          mem_max=_int(values["mem_max"][i]),
+                          mem_efficiency=_none(values["mem_efficiency"][i]),
+                          from_host=values["from_host"][i],
+                          exec_host=values["exec_host"][i],
+                          submit_time=values["submit_time"][i],
+                          start_time=values["start_time"][i],
+                          finish_time=values["finish_time"][i],
+                          update_time=values["update_time"][i],
+                          cluster=cluster)
+
+
+def to_seconds(values) -> np.ndarray:
+    values = np.asarray(values, dtype="datetime64[s]")
+    seconds = values.astype(np.int64)
+    seconds[np.isnat(values)] = -1
+    return seconds
+
+
+def to_datetimes(seconds: np.ndarray) -> list[datetime | None]:
+    values = np.asarray(seconds).astype("datetime64[s]").tolist()
+    return [v if s >= 0 else None for v, s in zip(values, seconds)]
+
+
+def _none(value: float) -> float | None:
+    return None if value != value else value
+
+
+def _int(value: float) -> int | None:
+    return None if value != value else int(value)
@@ -0,0 +1,276 @@
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+
+URL = "https://www.ebi.ac.uk/ebisearch/ws/rest/ebiweb_people/"
+FIELDS = "email,full_name,photo,positions"
+# Max number of entries per page
+PAGE_SIZE = 100
+# Seconds before cached responses are fetched again
+TTL = 7 * 24 * 3600
+
+
+def search(login: str, url: str = URL, etag: str | None = None,
+           modified: str | None = None,
+           max_attempts: int = 5) -> tuple[str | None, str | None, str | None]:
+    # Returns the response (None if not modified), its ETag and Last-Modified
+    params = urlencode({
+        "query": login,
+        "size": PAGE_SIZE,
+        "format": "JSON",
+        "fields": FIELDS
+    })
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    return _get(f"{url}?{params}", headers, max_attempts)
+
+
+def search_many(logins: list[str], url: str = URL, etag: str | None = None,
+                modified: str | None = None, max_attempts: int = 5
+                ) -> tuple[dict[str, str] | None, str | None, str | None]:
+    # Looks up users by email, many per request. Returns a response per login,
+    # as search() would, with only the entry of the user (if found), or None
+    # if not modified. The ETag and Last-Modified returned are those of the
+    # first page (with the number of hits), for this exact list: if the first
+    # page is not modified, following pages are assumed not modified either.
+    query = " OR ".join(f'email:"{login}@ebi.ac.uk"' for login in logins)
+    entries = {}
+    start = 0
+    while True:
+        params = urlencode({
+            "query": query,
+            "start": start,
+            "size": PAGE_SIZE,
+            "format": "JSON",
+            "fields": FIELDS
+        })
+
+        headers = {}
+        if start == 0:
+            if etag:
+                headers["If-None-Match"] = etag
+            if modified:
+                headers["If-Modified-Since"] = modified
+
+        payload, page_etag, page_modified = _get(f"{url}?{params}", headers,
+                                                 max_attempts)
+        if start == 0:
+            if payload is None:
+                return None, page_etag, page_modified
+
+            etag, modified = page_etag, page_modified
+
+        data = json.loads(payload)
+        for entry in data["entries"]:
+            emails = entry["fields"]["email"]
+            if emails:
+                entries.setdefault(emails[0], entry)
+
+        start += PAGE_SIZE
+        if not data["entries"] or start >= data.get("hitCount", 0):
+            break
+
+    payloads = {}
+    for login in logins:
+        try:
+            entry = entries[f"{login}@ebi.ac.uk"]
+        except KeyError:
+            payloads[login] = json.dumps({"entries": []})
+        else:
+            payloads[login] = json.dumps({"entries": [entry]})
+
+    return payloads, etag, modified
+
+
+def _get(url: str, headers: dict[str, str],
+         max_attempts: int) -> tuple[str | None, str | None, str | None]:
+    attempts = 0
+    while True:
+        try:
+            with urlopen(Request(url, headers=headers)) as res:
+                if res.status != 200:
+                    # e.g. 204: no entries to read
+                    raise HTTPError(url, res.status, res.reason, res.headers,
+                                    None)
+
+                payload = res.read().decode("utf-8")
+                return (payload, res.headers.get("ETag"),
+                        res.headers.get("Last-Modified"))
+        except HTTPError as exc:
+            if exc.code == 304:
+                return (None, headers.get("If-None-Match"),
+                        headers.get("If-Modified-Since"))
+            elif exc.code < 500 and exc.code != 429:
+                # Not a transient error: not requested again
+                raise
+
+            attempts += 1
+            if attempts < max_attempts:
+                time.sleep(0.5)
+            else:
+                raise
+
+
+def parse(login: str,
+          payload: str) -> tuple[str | None, str | None, list[str], str | None]:
+    data = json.loads(payload)
+
+    for entry in data["entries"]:
+        obj = entry["fields"]
+
+        email = obj["email"][0] if obj["email"] else None
+        full_name = obj["full_name"][0] if obj["full_name"] else None
+        teams = []
+        position = None
+
+        for e in obj["positions"]:
+            if "Staff Association Representative" in e:
+                continue
+
+            values = e.split("|")
+            value = values[0].strip()
+            if not position and value:
+                position = value
+
+            value = values[1].strip()
+            if value:
+                teams.append(value)
+
+        photo_url = obj["photo"][0] if obj["photo"] else None
+
+        if email == f"{login}@ebi.ac.uk":
+            return full_name, position, teams, photo_url
+
+    return None, None, [], None
+
+
+def connect_cache(path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(path)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS response (
+            url TEXT NOT NULL,
+            login TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            etag TEXT,
+            modified TEXT,
+            expire_time INTEGER NOT NULL,
+            CONSTRAINT pk_response PRIMARY KEY (url, login)
+        )
+        """
+    )
+    return con
+
+
+def update_users(users: list, url: str = URL, cache: str | None = None,
+                 ttl: int = TTL, workers: int = 8, batch_size: int = 50):
+    # Updates users metadata, with up to `workers` concurrent requests,
+    # each for up to `batch_size` users. Cached responses are used until they
+    # expire, then fetched again, conditionally if the server sent an ETag or
+    # Last-Modified. In batches, these apply to the whole request: users of
+    # a batch are revalidated together, if they are all looked up again.
+    con = connect_cache(cache) if cache else None
+    now = int(time.time())
+
+    payloads = {}
+    stale = {}
+    for user in users:
+        if user.login in payloads or user.login in stale:
+            continue
+        elif con is None:
+            stale[user.login] = (None, None, None)
+            continue
+
+        row = con.execute(
+            """
+            SELECT payload, etag, modified, expire_time
+            FROM response
+            WHERE url = ? AND login = ?
+            """,
+            [url, user.login]
+        ).fetchone()
+        if row is None:
+            stale[user.login] = (None, None, None)
+        elif row[3] <= now:
+            stale[user.login] = row[:3]
+        else:
+            payloads[user.login] = row[0]
+
+    logging.debug(f"EBI Search: {len(payloads):,} cached users, "
+                  f"{len(stale):,} to fetch")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        fs = {}
+        if batch_size > 1:
+            for logins, etag, modified in _get_batches(stale, batch_size):
+                f = executor.submit(search_many, logins, url, etag, modified)
+                fs[f] = logins
+        else:
+            for login, (payload, etag, modified) in stale.items():
+                f = executor.submit(search, login, url, etag, modified)
+                fs[f] = login
+
+        for f in as_completed(fs):
+            key = fs[f]
+            if isinstance(key, list):
+                batch_payloads, etag, modified = f.result()
+                results = {login: (batch_payloads[login]
+                                   if batch_payloads else None,
+                                   etag, modified)
+                           for login in key}
+            else:
+                results = {key: f.result()}
+
+            for login, (payload, etag, modified) in results.items():
+                if payload is None:
+                    # Not modified
+                    payload = stale[login][0]
+
+                payloads[login] = payload
+                if con is not None:
+                    con.execute(
+                        "INSERT OR REPLACE INTO response "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [url, login, payload, etag, modified, now + ttl]
+                    )
+
+    if con is not None:
+        con.commit()
+        con.close()
+
+    for user in users:
+        user.set_info(*parse(user.login, payloads[user.login]))
+
+
+def _get_batches(stale: dict[str, tuple], batch_size: int):
+    # Users cached from the same request (same ETag/Last-Modified) are
+    # looked up together again, in the same order, so the request can be
+    # revalidated. Others are looked up in new batches.
+    groups = {}
+    for login, (_, etag, modified) in stale.items():
+        if etag or modified:
+            groups.setdefault((etag, modified), []).append(login)
+
+    logins = []
+    for (etag, modified), group in groups.items():
+        if len(group) <= batch_size:
+            yield sorted(group), etag, modified
+        else:
+            logins += group
+
+    logins += [login for login, (_, etag, modified) in stale.items()
+               if not etag and not modified]
+    logins.sort()
+    for i in range(0, len(logins), batch_size):
+        yield logins[i:i + batch_size], None, None
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Hashable, Sequence
+
+
+def span(start: datetime, stop: datetime, origin: datetime, size: int,
+         step: timedelta = timedelta(minutes=1)) -> tuple[int, int]:
+    if start < origin:
+        # Move start to the first step at or after origin
+        start += -((origin - start) // -step) * step
+
+    first = min(-((start - origin) // -step), size)
+    last = min(max(-((stop - origin) // -step), first), size)
+    return first, last
+
+
+def count(start: datetime, stop: datetime, origin: datetime, end: datetime,
+          step: timedelta = timedelta(minutes=1)) -> int:
+    # Steps from start (start, start + step, ..., before stop) within
+    # [origin, end), i.e. not aligned on origin, unlike span()
+    first = max(-((origin - start) // -step), 0)
+    last = -((min(stop, end) - start) // -step)
+    return max(last - first, 0)
+
+
+class Accumulator:
+    def __init__(self, size: int, width: int = 1):
+        self.size = size
+        self.width = width
+        self.changes: dict[Hashable, dict[int, list]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.changes
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def add(self, key: Hashable, start: int, stop: int,
+            values: Sequence[int | float]):
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return
+
+        try:
+            changes = self.changes[key]
+        except KeyError:
+            changes = self.changes[key] = {}
+
+        self._update(changes, start, values, 1)
+        if stop < self.size:
+            self._update(changes, stop, values, -1)
+
+    def _update(self, changes: dict[int, list], index: int,
+                values: Sequence[int | float], sign: int):
+        try:
+            current = changes[index]
+        except KeyError:
+            changes[index] = [sign * v for v in values]
+        else:
+            for i, v in enumerate(values):
+                current[i] += sign * v
+
+    def totals(self, key: Hashable) -> list[list[int | float]]:
+        # One list of per-step totals for each value
+        diffs = [[0] * self.size for _ in range(self.width)]
+        for index, values in self.changes.get(key, {}).items():
+            for diff, v in zip(diffs, values):
+                diff[index] = v
+
+        return [list(accumulate(diff)) for diff in diffs]
+
+    def sum(self, key: Hashable) -> list[int | float]:
+        # Sum of per-step totals over all steps, for each value
+        sums = [0] * self.width
+        for index, values in self.changes.get(key, {}).items():
+            for i, v in enumerate(values):
+                sums[i] += v * (self.size - index)
+
+        return sums
@@ -1,15 +1,71 @@
 import sqlite3
 from datetime import datetime, timedelta
-from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 
-from .model import Job, UnixUser, DT_REPR
+from .model import Job, UnixUser, DT_REPR, parse_time, to_epoch
+
+
+# 0: times stored as DT_REPR strings, 1: times stored as integers (see EPOCH)
+SCHEMA_VERSION = 1
+
+JOB_INDEXES = {
+    "job_user": "user",
+    "job_starttime": "start_time",
+    "job_endtime": "finish_time",
+    "job_startendtime": "start_time, finish_time",
+    "job_updatetime": "update_time"
+}
 
 
 def connect(database: str) -> sqlite3.Connection:
     con = sqlite3.connect(database)
+    if not _table_exists(con, "job"):
+        con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    time_type = "INTEGER" if get_version(con) >= 1 else "TEXT"
+    _create_job_table(con, "job", time_type)
+    _create_job_indexes(con, "job")
+    if not _table_exists(con, "job_span"):
+        con.execute("BEGIN IMMEDIATE")
+        if not _table_exists(con, "job_span"):
+            _create_job_spans(con)
+
+        con.commit()
+
+    _create_job_table(con, "incomplete", time_type, finished=False)
     con.execute(
         """
-        CREATE TABLE IF NOT EXISTS job (
+        CREATE TABLE IF NOT EXISTS user (
+            login TEXT NOT NULL PRIMARY KEY,
+            unix_group TEXT NOT NULL,
+            unix_groups TEXT NOT NULL
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT NOT NULL PRIMARY KEY,
+            value
+        )
+        """
+    )
+    return con
+
+
+def _table_exists(con: sqlite3.Connection, name: str) -> bool:
+    row = con.execute("SELECT 1 FROM sqlite_master "
+                      "WHERE type = 'table' AND name = ?", [name]).fetchone()
+    return row is not None
+
+
+def _create_job_table(con: sqlite3.Connection, name: str, time_type: str,
+                      finished: bool = True):
+    finish_null = " NOT NULL" if finished else ""
+    con.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
             id TEXT NOT NULL PRIMARY KEY,
             scheduler TEXT NOT NULL,
             jobid INTEGER NOT NULL,
@@ -26,79 +82,107 @@ def connect(database: str) -> sqlite3.Connection:
             mem_efficiency REAL,
             from_host TEXT NOT NULL,
             exec_host TEXT,
-            submit_time TEXT NOT NULL,
-            start_time TEXT,
-            finish_time TEXT NOT NULL,
-            update_time TEXT NULL NULL
+            submit_time {time_type} NOT NULL,
+            start_time {time_type},
+            finish_time {time_type}{finish_null},
+            update_time {time_type} NULL NULL
         )
         """
     )
+
+
+def _create_job_indexes(con: sqlite3.Connection, table: str):
+    for name, columns in JOB_INDEXES.items():
+        con.execute(f"CREATE INDEX IF NOT EXISTS {name} "
+                    f"ON {table} ({columns})")
+
+
+def _create_job_spans(con: sqlite3.Connection):
+    # R*Tree of the time spans of started jobs, to find jobs overlapping
+    # an interval. Spans are in seconds (as 32-bit floats, rounded outwards)
+    # so only for candidates: exact times are compared on the job table.
+    start = _seconds("NEW.start_time")
+    finish = _seconds("NEW.finish_time")
     con.execute(
         """
-        CREATE INDEX IF NOT EXISTS job_user
-        ON job (user)
+        CREATE VIRTUAL TABLE job_span
+        USING rtree(id, min_time, max_time)
         """
     )
+    # Jobs replaced by INSERT OR REPLACE get a new rowid
     con.execute(
         """
-        CREATE INDEX IF NOT EXISTS job_starttime
-        ON job (start_time)
+        CREATE TRIGGER job_span_replace
+        BEFORE INSERT ON job
+        BEGIN
+            DELETE FROM job_span
+            WHERE id = (SELECT rowid FROM job WHERE id = NEW.id);
+        END
         """
     )
     con.execute(
-        """
-        CREATE INDEX IF NOT EXISTS job_endtime
-        ON job (finish_time)
+        f"""
+        CREATE TRIGGER job_span_insert
+        AFTER INSERT ON job
+        WHEN NEW.start_time IS NOT NULL
+        BEGIN
+            INSERT INTO job_span
+            VALUES (NEW.rowid, min({start}, {finish}), max({start}, {finish}));
+        END
         """
     )
     con.execute(
-        """
-        CREATE INDEX IF NOT EXISTS job_startendtime
-        ON job (start_time, finish_time)
+        f"""
+        CREATE TRIGGER job_span_update
+        AFTER UPDATE OF start_time, finish_time ON job
+        BEGIN
+            DELETE FROM job_span WHERE id = OLD.rowid;
+            INSERT INTO job_span
+            SELECT NEW.rowid, min({start}, {finish}), max({start}, {finish})
+            WHERE NEW.start_time IS NOT NULL;
+        END
         """
     )
     con.execute(
         """
-        CREATE INDEX IF NOT EXISTS job_updatetime
-        ON job (update_time)
-        """
-    )
-    con.execute(
-        """
-        CREATE TABLE IF NOT EXISTS incomplete (
-            id TEXT NOT NULL PRIMARY KEY,
-            scheduler TEXT NOT NULL,
-            jobid INTEGER NOT NULL,
-            jobindex INTEGER NOT NULL,
-            name TEXT NOT NUll,
-            status TEXT NOT NULL,
-            user TEXT NOT NULL,
-            queue TEXT NOT NULL,
-            slots INTEGER NOT NULL,
-            cpu_efficiency REAL,
-            cpu_time REAL,
-            mem_lim INTEGER,
-            mem_max INTEGER,
-            mem_efficiency REAL,
-            from_host TEXT NOT NULL,
-            exec_host TEXT,
-            submit_time TEXT NOT NULL,
-            start_time TEXT,
-            finish_time TEXT,
-            update_time TEXT NULL NULL
-        )
+        CREATE TRIGGER job_span_delete
+        AFTER DELETE ON job
+        BEGIN
+            DELETE FROM job_span WHERE id = OLD.rowid;
+        END
         """
     )
+
+    start = _seconds("start_time")
+    finish = _seconds("finish_time")
     con.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user (
-            login TEXT NOT NULL PRIMARY KEY,
-            unix_group TEXT NOT NULL,
-            unix_groups TEXT NOT NULL
-        )
+        f"""
+        INSERT INTO job_span
+        SELECT rowid, min({start}, {finish}), max({start}, {finish})
+        FROM job
+        WHERE start_time IS NOT NULL
         """
     )
-    return con
+
+
+def _seconds(column: str) -> str:
+    # SQL expression of a stored time in seconds, whatever the schema version
+    return (f"(CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(strftime('%s', {column}) AS INTEGER) "
+            f"ELSE {column} END)")
+
+
+def get_version(con: sqlite3.Connection) -> int:
+    version, = con.execute("PRAGMA user_version").fetchone()
+    return version
+
+
+def to_param(con: sqlite3.Connection, dt: datetime) -> str | int:
+    # Query parameter comparable to the stored times
+    if get_version(con) >= 1:
+        return to_epoch(dt)
+
+    return dt.strftime(DT_REPR)
 
 
 def get_incomplete(con: sqlite3.Connection):
@@ -115,27 +199,121 @@ def get_users(con: sqlite3.Connection) -> dict[str, UnixUser]:
     return users
 
 
-def update_jobs(con: sqlite3.Connection, jobs: list[Job]):
+def update_jobs(con: sqlite3.Connection, jobs: list[Job],
+                fingerprints: dict[str, int] | None = None) -> int:
+    # Only writes jobs that changed. `fingerprints` (state of jobs last
+    # written) may be kept between calls to avoid reading the stored jobs.
+    return _write_changed(con, "job", jobs, fingerprints)
+
+
+def update_incompletes(con: sqlite3.Connection, jobs: list[Job],
+                       fingerprints: dict[str, int] | None = None) -> int:
+    # As update_jobs(); see also remove_incompletes()
+    return _write_changed(con, "incomplete", jobs, fingerprints)
+
+
+def remove_incompletes(con: sqlite3.Connection, keep: set[str],
+                       fingerprints: dict[str, int] | None = None,
+                       skip: set[str] | None = None) -> int:
+    # Deletes incomplete jobs other than `keep` (e.g. now finished), except
+    # jobs of the stored schedulers in `skip` (e.g. clusters not fully read)
+    con.execute("BEGIN IMMEDIATE")
+    keep = set(keep)
+    ids = []
+    for row_id, scheduler in con.execute("SELECT id, scheduler "
+                                         "FROM incomplete"):
+        if row_id in keep:
+            continue
+        elif skip and scheduler in skip:
+            keep.add(row_id)
+        else:
+            ids.append(row_id)
+
+    con.executemany("DELETE FROM incomplete WHERE id = ?",
+                    [(row_id,) for row_id in ids])
+    con.commit()
+
+    if fingerprints is not None:
+        for row_id in fingerprints.keys() - keep:
+            del fingerprints[row_id]
+
+    return len(ids)
+
+
+def _write_changed(con: sqlite3.Connection, table: str, jobs: list[Job],
+                   fingerprints: dict[str, int] | None) -> int:
+    if fingerprints is None:
+        fingerprints = {}
+
+    # Lock first so the schema cannot be migrated between reading
+    # its version and writing
+    con.execute("BEGIN IMMEDIATE")
+    epoch = get_version(con) >= 1
+    rows = [job.to_tuple(epoch) for job in jobs]
+
+    stored = {}
+    ids = []
+    for row in rows:
+        try:
+            stored[row[0]] = fingerprints[row[0]]
+        except KeyError:
+            ids.append(row[0])
+
+    for i in range(0, len(ids), 500):
+        params = ids[i:i + 500]
+        for row in con.execute(
+            f"""
+            SELECT *
+            FROM {table}
+            WHERE id IN ({','.join('?' * len(params))})
+            """,
+            params
+        ):
+            stored[row[0]] = _fingerprint(row)
+
+    changed = [row for row in rows if stored.get(row[0]) != _fingerprint(row)]
     con.executemany(
-        """
-        INSERT OR REPLACE INTO job
+        f"""
+        INSERT OR REPLACE INTO {table}
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (job.to_tuple() for job in jobs)
+        changed
     )
     con.commit()
 
+    fingerprints.update((row[0], _fingerprint(row)) for row in rows)
+    return len(changed)
 
-def update_incompletes(con: sqlite3.Connection, jobs: list[Job]):
-    con.execute("DELETE FROM incomplete")
-    con.executemany(
+
+def insert_jobs(con: sqlite3.Connection, jobs: list[Job]) -> int:
+    # Only writes jobs not stored yet (e.g. backfilled from accounting files)
+    con.execute("BEGIN IMMEDIATE")
+    epoch = get_version(con) >= 1
+    # No row selected (job stored): no row inserted, so no trigger either
+    cur = con.executemany(
         """
-        INSERT INTO incomplete
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO job
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM job WHERE id = ?)
         """,
-        (job.to_tuple() for job in jobs)
+        [job.to_tuple(epoch) + (job.accession,) for job in jobs]
     )
     con.commit()
+    return cur.rowcount
+
+
+def _fingerprint(row: tuple) -> int:
+    # State of a job, whenever it was written (last column: update_time).
+    # hash() of str is salted per process: fine as fingerprints are only
+    # compared within a process, never stored.
+    return hash(row[:-1])
+
+
+def update_poll_time(con: sqlite3.Connection, dt: datetime):
+    # Jobs not written since are still up to date at this time
+    con.execute("INSERT OR REPLACE INTO metadata VALUES ('poll_time', ?)",
+                [to_param(con, dt)])
+    con.commit()
 
 
 def update_users(con: sqlite3.Connection, users: list[UnixUser]):
@@ -149,18 +327,34 @@ def update_users(con: sqlite3.Connection, users: list[UnixUser]):
     con.commit()
 
 
-def get_latest_update_time(con: sqlite3.Connection) -> datetime:
-    date_str, = con.execute("SELECT MAX(update_time) FROM job").fetchone()
-    return datetime.strptime(date_str, DT_REPR)
+def get_poll_time(con: sqlite3.Connection) -> datetime | None:
+    # Start of the last poll that read all jobs
+    row = con.execute("SELECT value FROM metadata "
+                      "WHERE key = 'poll_time'").fetchone()
+    return parse_time(row[0]) if row is not None else None
 
 
-def _find_jobs(database: str, from_dt: datetime, to_dt: datetime,
-               user: str | None = None):
+def get_latest_update_time(con: sqlite3.Connection) -> datetime | None:
+    # None if no job was ever polled (e.g. new database)
+    value, = con.execute("SELECT MAX(update_time) FROM job").fetchone()
+    latest = parse_time(value)
+
+    poll_time = get_poll_time(con)
+    if poll_time is not None and (latest is None or poll_time > latest):
+        latest = poll_time
+
+    return latest
+
+
+def find_rows(database: str, from_dt: datetime, to_dt: datetime,
+              user: str | None = None, finished_since: datetime | None = None,
+              submitted: tuple[datetime, datetime] | None = None):
     con = connect(database)
-    from_time = from_dt.strftime(DT_REPR)
-    to_time = to_dt.strftime(DT_REPR)
+    from_time = to_param(con, from_dt)
+    to_time = to_param(con, to_dt)
 
-    job_params = [from_time, to_time, from_time, to_time, from_time, to_time]
+    job_params = [to_epoch(to_dt), to_epoch(from_dt),
+                  from_time, to_time, from_time, to_time, from_time, to_time]
     inc_params = [to_time]
 
     if user:
@@ -170,11 +364,28 @@ def _find_jobs(database: str, from_dt: datetime, to_dt: datetime,
     else:
         user_filter = ""
 
+    if finished_since:
+        # Jobs finished earlier are read from elsewhere (e.g. an archive)
+        finish_filter = "AND finish_time >= ?"
+        job_params.append(to_param(con, finished_since))
+    else:
+        finish_filter = ""
+
+    if submitted:
+        submit_filter = "AND submit_time >= ? AND submit_time < ?"
+        submit_params = [to_param(con, dt) for dt in submitted]
+    else:
+        submit_filter = ""
+        submit_params = []
+
     for row in con.execute(
         f"""
-        SELECT *
-        FROM job
-        WHERE start_time IS NOT NULL
+        SELECT job.*
+        FROM job_span
+        CROSS JOIN job ON job.rowid = job_span.id
+        WHERE job_span.min_time <= ?
+          AND job_span.max_time >= ?
+          AND start_time IS NOT NULL
           AND (
             (start_time >= ? AND start_time < ?)
             OR
@@ -183,10 +394,12 @@ def _find_jobs(database: str, from_dt: datetime, to_dt: datetime,
             (start_time < ? AND finish_time >= ?)
           )
           {user_filter}
+          {finish_filter}
+          {submit_filter}
         """,
-        job_params
+        job_params + submit_params
     ):
-        yield Job.from_tuple(row)
+        yield row
 
     for row in con.execute(
         f"""
@@ -195,37 +408,254 @@ def _find_jobs(database: str, from_dt: datetime, to_dt: datetime,
         WHERE start_time IS NOT NULL
           AND start_time < ?
           {user_filter}
+          {submit_filter}
         """,
-        inc_params
+        inc_params + submit_params
     ):
-        yield Job.from_tuple(row)
+        yield row
 
     con.close()
 
 
-def _collect_jobs(*args):
-    return list(_find_jobs(*args))
+def find_updated(con: sqlite3.Connection, since: datetime):
+    # Started jobs (finished or not) inserted/updated after a given time
+    for table in ["job", "incomplete"]:
+        for row in con.execute(
+            f"""
+            SELECT *
+            FROM {table}
+            WHERE update_time > ?
+              AND start_time IS NOT NULL
+            """,
+            [to_param(con, since)]
+        ):
+            yield Job.from_tuple(row)
+
+
+def find_running(con: sqlite3.Connection, since: datetime):
+    # Running jobs not updated after a given time: unchanged since, they
+    # only ran longer (see find_updated())
+    for row in con.execute(
+        """
+        SELECT *
+        FROM incomplete
+        WHERE update_time <= ?
+          AND start_time IS NOT NULL
+        """,
+        [to_param(con, since)]
+    ):
+        yield Job.from_tuple(row)
+
+
+def _find_jobs(database: str, from_dt: datetime, to_dt: datetime,
+               user: str | None = None, archive_dir: str | None = None,
+               submitted: tuple[datetime, datetime] | None = None):
+    if archive_dir:
+        from .archive import Archive
+
+        archive = Archive(archive_dir)
+        yield from archive.find_jobs(from_dt, to_dt, user, submitted)
+        finished_since = archive.until
+    else:
+        finished_since = None
+
+    for row in find_rows(database, from_dt, to_dt, user, finished_since,
+                         submitted):
+        yield Job.from_tuple(row)
+
+
+def _collect_jobs(database: str, from_dt: datetime, to_dt: datetime,
+                  user: str | None, archive_dir: str | None,
+                  submitted: tuple[datetime, datetime] | None,
+                  range_from: datetime) -> list[Job]:
+    # Jobs owned by the chunk, i.e. started during the chunk (or before the
+    # whole range for the first chunk): each job is returned by one chunk
+    jobs = []
+    for job in _find_jobs(database, from_dt, to_dt, user, archive_dir,
+                          submitted):
+        if from_dt <= max(job.start_time, range_from) < to_dt:
+            jobs.append(job)
+
+    return jobs
+
+
+def _find_jobs_parallel(database: str, from_dt: datetime, to_dt: datetime,
+                        user: str | None, workers: int,
+                        archive_dir: str | None,
+                        submitted: tuple[datetime, datetime] | None):
+    chunks = []
+    start = from_dt
+    while start < to_dt:
+        stop = min(to_dt, start + timedelta(days=1))
+        chunks.append((start, stop))
+        start = stop
+
+    chunks = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            # Bounded number of chunks in memory
+            for start, stop in islice(chunks, 2 * workers - len(pending)):
+                pending.add(executor.submit(_collect_jobs, database, start,
+                                            stop, user, archive_dir,
+                                            submitted, from_dt))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                yield from f.result()
 
 
 def find_jobs(database: str, from_dt: datetime, to_dt: datetime,
-              user: str | None = None, workers: int = 1):
+              user: str | None = None, workers: int = 1,
+              archive_dir: str | None = None,
+              submitted: tuple[datetime, datetime] | None = None):
+    # submitted: only jobs submitted in this interval
     if workers > 1:
-        jobs = {}
-        with ProcessPoolExecutor(max_workers=workers) as executor:
-            fs = []
-            start = from_dt
-            stop = min(to_dt, start + timedelta(days=1))
-
-            while start < to_dt:
-                f = executor.submit(_collect_jobs, database, start, stop, user)
-                fs.append(f)
-                start = stop
-                stop = min(to_dt, start + timedelta(days=1))
-
-            for f in as_completed(fs):
-                for job in f.result():
-                    jobs[job.accession] = job
-
-            return list(jobs.values())
+        return _find_jobs_parallel(database, from_dt, to_dt, user, workers,
+                                   archive_dir, submitted)
     else:
-        return _find_jobs(database, from_dt, to_dt, user)
+        return _find_jobs(database, from_dt, to_dt, user, archive_dir,
+                          submitted)
+
+
+def count_jobs(con: sqlite3.Connection, from_dt: datetime,
+               to_dt: datetime) -> int:
+    # Estimated number of jobs running between two times
+    count, = con.execute(
+        """
+        SELECT COUNT(*)
+        FROM job_span
+        WHERE min_time < ? AND max_time >= ?
+        """,
+        [to_epoch(to_dt), to_epoch(from_dt)]
+    ).fetchone()
+    running, = con.execute(
+        """
+        SELECT COUNT(*)
+        FROM incomplete
+        WHERE start_time IS NOT NULL
+          AND start_time < ?
+        """,
+        [to_param(con, to_dt)]
+    ).fetchone()
+    return count + running
+
+
+def migrate(database: str, batch_size: int = 100000):
+    # Convert stored times to integers (schema version 1). Rows are copied
+    # in short transactions so that the job tracker can keep writing:
+    # inserted/replaced rows get a new, higher, rowid and are copied later.
+    con = connect(database)
+    if get_version(con) >= 1:
+        con.close()
+        return
+
+    con.execute("BEGIN IMMEDIATE")
+    if not _table_exists(con, "job_new"):
+        # Indexes stay on the job table (names are unique), and are created
+        # on the new table once swapped
+        _create_job_table(con, "job_new", "INTEGER")
+        con.execute("CREATE TABLE migration (last_rowid INTEGER NOT NULL)")
+        con.execute("INSERT INTO migration VALUES (0)")
+
+    while True:
+        last_rowid, = con.execute("SELECT last_rowid "
+                                  "FROM migration").fetchone()
+        max_rowid, = con.execute("SELECT MAX(rowid) FROM job").fetchone()
+        max_rowid = max_rowid or 0
+        if max_rowid - last_rowid <= batch_size:
+            # Last rows: copied with the tables swap
+            break
+
+        _copy_rows(con, "job", "job_new", last_rowid, last_rowid + batch_size)
+        con.execute("UPDATE migration SET last_rowid = ?",
+                    [last_rowid + batch_size])
+        con.commit()
+        yield last_rowid + batch_size, max_rowid
+        con.execute("BEGIN IMMEDIATE")
+
+    _copy_rows(con, "job", "job_new", last_rowid, max_rowid)
+    _create_job_table(con, "incomplete_new", "INTEGER", finished=False)
+    _copy_rows(con, "incomplete", "incomplete_new")
+    con.execute("DROP TABLE job")
+    con.execute("DROP TABLE job_span")
+    con.execute("DROP TABLE incomplete")
+    con.execute("DROP TABLE migration")
+    con.execute("ALTER TABLE job_new RENAME TO job")
+    _create_job_indexes(con, "job")
+    _create_job_spans(con)
+    con.execute("ALTER TABLE incomplete_new RENAME TO incomplete")
+    con.execute("PRAGMA user_version = 1")
+    con.commit()
+    con.close()
+    yield max_rowid, max_rowid
+
+
+def name_cluster(database: str, cluster: str, batch_size: int = 100000):
+    # Jobs tracked without cluster become jobs of `cluster` (identifier and
+    # stored scheduler, see Job.accession), in short transactions as in
+    # migrate(). Jobs already written again under their new identifier
+    # (e.g. by track-jobs.py --clusters) are kept, not their former rows.
+    con = connect(database)
+    for table in ["job", "incomplete"]:
+        max_rowid, = con.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()
+        max_rowid = max_rowid or 0
+        for last_rowid in range(0, max_rowid, batch_size):
+            params = [cluster, cluster, last_rowid, last_rowid + batch_size]
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(
+                f"""
+                UPDATE OR IGNORE {table}
+                SET id = substr(id, 1, instr(id, '-' || scheduler || '-')
+                                       + length(scheduler) + 1)
+                         || ? || '-'
+                         || substr(id, instr(id, '-' || scheduler || '-')
+                                       + length(scheduler) + 2),
+                    scheduler = scheduler || '@' || ?
+                WHERE instr(scheduler, '@') = 0
+                  AND rowid > ? AND rowid <= ?
+                """,
+                params
+            )
+            con.execute(
+                f"""
+                DELETE FROM {table}
+                WHERE instr(scheduler, '@') = 0
+                  AND rowid > ? AND rowid <= ?
+                """,
+                params[2:]
+            )
+            con.commit()
+            yield table, min(last_rowid + batch_size, max_rowid), max_rowid
+
+    con.close()
+
+
+def _copy_rows(con: sqlite3.Connection, src: str, dst: str,
+               from_rowid: int | None = None, to_rowid: int | None = None):
+    if from_rowid is not None:
+        rowid_filter = "WHERE rowid > ? AND rowid <= ?"
+        params = [from_rowid, to_rowid]
+    else:
+        rowid_filter = ""
+        params = []
+
+    # strftime('%s', ...) reads times as UTC, i.e. naive
+    con.execute(
+        f"""
+        INSERT OR REPLACE INTO {dst}
+        SELECT id, scheduler, jobid, jobindex, name, status, user, queue,
+               slots, cpu_efficiency, cpu_time, mem_lim, mem_max,
+               mem_efficiency, from_host, exec_host,
+               CAST(strftime('%s', submit_time) AS INTEGER),
+               CAST(strftime('%s', start_time) AS INTEGER),
+               CAST(strftime('%s', finish_time) AS INTEGER),
+               CAST(strftime('%s', update_time) AS INTEGER)
+        FROM {src}
+        {rowid_filter}
+        """,
+        params
+    )
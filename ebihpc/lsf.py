@@ -1,104 +1,196 @@
+import codecs
+import gzip
 import json
+import logging
+import os
 import re
 import subprocess as sp
 import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from tempfile import TemporaryFile
+from typing import IO, Iterator
 
 from . import model
 
 
-REG_MEM_G = re.compile(r"(\d+(?:\.\d+)?) G(?:bytes)?")
-REG_MEM_M = re.compile(r"(\d+) M(?:bytes)?")
-REG_MEM_T = re.compile(r"(\d+(?:\.\d+)?) T(?:bytes)?")
-REG_DATE = re.compile(r"([A-Z][a-z]{2})\s{1,2}(\d{1,2}) (\d\d:\d\d)(?: [ELX])?")
-
-
-def get_jobs() -> list[model.Job]:
-    fields = [
-        "jobid",
-        "jobindex",
-        "job_name",
-        "stat",
-        "user",
-        "queue",
-        "slots",
-        "memlimit",
-        "max_mem",
-        "from_host",
-        "exec_host",
-        "submit_time",
-        "start_time",
-        "finish_time",
-        "cpu_efficiency",
-        "mem_efficiency",
-        "cpu_used"
-    ]
-    args = ["bjobs", "-u", "all", "-a", "-json", "-o", " ".join(fields)]
+REG_MEM = re.compile(r"(\d+(?:\.\d+)?) ([MGT])(?:bytes)?")
+REG_DATE = re.compile(r"([A-Z][a-z]{2})\s{1,2}(\d{1,2}) (\d\d):(\d\d)(?: [ELX])?")
+REG_CPU = re.compile(r"(\d+\.\d+) second")
+MEM_UNITS = {"M": 1, "G": 1024, "T": 1024 * 1024}
+MONTHS = {m: i + 1 for i, m in enumerate(["Jan", "Feb", "Mar", "Apr", "May",
+                                          "Jun", "Jul", "Aug", "Sep", "Oct",
+                                          "Nov", "Dec"])}
+# Distinct values of fields cached by parsers (times have a minute resolution)
+CACHE_SIZE = 1 << 16
 
+
+FIELDS = [
+    "jobid",
+    "jobindex",
+    "job_name",
+    "stat",
+    "user",
+    "queue",
+    "slots",
+    "memlimit",
+    "max_mem",
+    "from_host",
+    "exec_host",
+    "submit_time",
+    "start_time",
+    "finish_time",
+    "cpu_efficiency",
+    "mem_efficiency",
+    "cpu_used"
+]
+# Bytes read from bjobs at once
+CHUNK_SIZE = 1 << 16
+# Calls of a command failing before any output, and seconds between them
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5
+
+# Start of a record: event type and version
+REG_ACCT_RECORD = re.compile(rb'"[A-Z_]+" "')
+# jStatus of JOB_FINISH records
+ACCT_STATUS = {32: "EXIT", 64: "DONE"}
+# Bytes of (uncompressed) accounting file parsed by a worker at once
+ACCT_CHUNK_SIZE = 1 << 26
+
+
+def get_jobs(env: dict[str, str] | None = None) -> list[model.Job]:
+    return list(iter_jobs(env))
+
+
+def iter_jobs(env: dict[str, str] | None = None) -> Iterator[model.Job]:
+    # Jobs parsed as bjobs outputs them, without loading the whole output.
+    # env: extra environment variables, e.g. LSF_ENVDIR of another cluster
+    args = ["bjobs", "-u", "all", "-a", "-json", "-o", " ".join(FIELDS)]
+    env = {**os.environ, **env} if env else None
+
+    attempts = 0
     while True:
-        try:
-            p = sp.run(args, check=True, stdout=sp.PIPE, stderr=sp.PIPE)
-        except sp.CalledProcessError as e:
-            sys.stderr.write(f"Command {args} failed: {e.stderr}\n")
-            time.sleep(5)
-        else:
-            out = p.stdout.decode("utf-8", "ignore")
+        # stderr in a file: a full pipe would block bjobs
+        with TemporaryFile() as err:
+            p = sp.Popen(args, stdout=sp.PIPE, stderr=err, env=env)
+            num_jobs = 0
+            try:
+                for rec in read_records(p.stdout):
+                    num_jobs += 1
+                    yield parse_record(rec)
+
+                p.stdout.read()
+                returncode = p.wait()
+            finally:
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+                p.stdout.close()
+
+            err.seek(0)
+            stderr = err.read().decode("utf-8", "ignore")
+
+        attempts += 1
+        if returncode == 0:
             break
+        elif num_jobs or attempts >= MAX_ATTEMPTS:
+            # Jobs already returned (cannot start again), or still failing
+            raise sp.CalledProcessError(returncode, args, stderr=stderr)
 
-    bjobs = json.loads(out.strip())
+        sys.stderr.write(f"Command {args} failed: {stderr}\n")
+        time.sleep(RETRY_DELAY)
 
-    jobs = []
-    for rec in bjobs["RECORDS"]:
-        m = re.match(r"(\d+\.\d+) second", rec["CPU_USED"])
-        cpu_time = float(m.group(1)) if m else None
-
-        j = model.Job(
-            scheduler="lsf",
-            id=int(rec["JOBID"]),
-            index=int(rec["JOBINDEX"]),
-            name=rec["JOB_NAME"],
-            status=rec["STAT"],
-            user=rec["USER"],
-            queue=rec["QUEUE"],
-            slots=int(rec["SLOTS"]) if rec["SLOTS"] else 1,
-            cpu_efficiency=parse_percent(rec["CPU_EFFICIENCY"]),
-            mem_lim=parse_memory(rec["MEMLIMIT"]),
-            mem_max=parse_memory(rec["MAX_MEM"]),
-            mem_efficiency=parse_percent(rec["MEM_EFFICIENCY"]),
-            from_host=rec["FROM_HOST"],
-            exec_host=rec["EXEC_HOST"] or None,
-            submit_time=parse_time(rec["SUBMIT_TIME"]),
-            start_time=parse_time(rec["START_TIME"]),
-            finish_time=(parse_time(rec["FINISH_TIME"])
-                         if rec["STAT"] in ("DONE", "EXIT") else None),
-            cpu_time=cpu_time,
-        )
-        jobs.append(j)
 
-    return jobs
+def read_records(fh: IO[bytes]) -> Iterator[dict]:
+    # Objects of the RECORDS array of bjobs' JSON output
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+    buffer = ""
+    pos = None
+    eof = False
+
+    while True:
+        if pos is None:
+            # Start of the array not found yet
+            i = buffer.find('"RECORDS"')
+            if i >= 0:
+                j = buffer.find("[", i)
+                if j >= 0:
+                    pos = j + 1
+        else:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos < len(buffer):
+                if buffer[pos] == "]":
+                    return
+
+                try:
+                    rec, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield rec
+                    continue
+
+        if eof:
+            return
+
+        chunk = fh.read(CHUNK_SIZE)
+        eof = not chunk
+        if pos is not None:
+            buffer = buffer[pos:]
+            pos = 0
+        buffer += text_decoder.decode(chunk, final=eof)
+
+
+def parse_record(rec: dict) -> model.Job:
+    m = REG_CPU.match(rec["CPU_USED"])
+    cpu_time = float(m.group(1)) if m else None
+
+    return model.Job(
+        scheduler="lsf",
+        id=int(rec["JOBID"]),
+        index=int(rec["JOBINDEX"]),
+        name=rec["JOB_NAME"],
+        status=rec["STAT"],
+        user=rec["USER"],
+        queue=rec["QUEUE"],
+        slots=int(rec["SLOTS"]) if rec["SLOTS"] else 1,
+        cpu_efficiency=parse_percent(rec["CPU_EFFICIENCY"]),
+        mem_lim=parse_memory(rec["MEMLIMIT"]),
+        mem_max=parse_memory(rec["MAX_MEM"]),
+        mem_efficiency=parse_percent(rec["MEM_EFFICIENCY"]),
+        from_host=rec["FROM_HOST"],
+        exec_host=rec["EXEC_HOST"] or None,
+        submit_time=parse_time(rec["SUBMIT_TIME"]),
+        start_time=parse_time(rec["START_TIME"]),
+        finish_time=(parse_time(rec["FINISH_TIME"])
+                     if rec["STAT"] in ("DONE", "EXIT") else None),
+        cpu_time=cpu_time,
+    )
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def parse_percent(string: str) -> float | None:
     string = string.strip().replace("%", "")
     return float(string) if string else None
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def parse_memory(string: str) -> int | None:
     if not string:
         return None
 
-    m = REG_MEM_T.fullmatch(string)
+    m = REG_MEM.fullmatch(string)
     if m:
-        return int(float(m.group(1)) * 1024 * 1024)
-
-    m = REG_MEM_G.fullmatch(string)
-    if m:
-        return int(float(m.group(1)) * 1024)
-
-    m = REG_MEM_M.fullmatch(string)
-    if m:
-        return int(m.group(1))
+        value, unit = m.groups()
+        return int(float(value) * MEM_UNITS[unit])
 
     raise NotImplementedError(string)
 
@@ -107,21 +199,191 @@ def parse_time(string) -> datetime | None:
     if not string:
         return None
 
+    # Times have no year: assume the last year in which they are past
+    now = datetime.now()
+    dt = _parse_date(string, now.year)
+    if dt > now:
+        dt = _parse_date(string, now.year - 1)
+
+    return dt
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_date(string: str, year: int) -> datetime:
     m = REG_DATE.fullmatch(string)
     if m:
-        now = datetime.now()
+        month, day, hour, minute = m.groups()
+        return datetime(year, MONTHS[month], int(day), int(hour), int(minute))
+
+    raise NotImplementedError(string)
 
-        month, day, _time = m.groups()
-        if len(day) == 1:
-            day = f"0{day}"
 
-        date_string = f"{now.year} {month} {day} {_time}"
-        dt = datetime.strptime(date_string, "%Y %b %d %H:%M")
+def iter_acct_jobs(paths: list[str], workers: int = 1,
+                   chunk_size: int = ACCT_CHUNK_SIZE) -> Iterator[model.Job]:
+    # Finished jobs of LSF accounting files (lsb.acct, rotated or gzipped),
+    # in the order of the files. Uncompressed files are split in chunks
+    # parsed in parallel; gzipped files are parsed by one worker each.
+    chunks = []
+    for path in paths:
+        if path.endswith(".gz"):
+            chunks.append((path, 0, None))
+            continue
 
-        if dt > now:
-            date_string = f"{now.year - 1} {month} {day} {_time}"
-            dt = datetime.strptime(date_string, "%Y %b %d %H:%M")
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_size):
+            chunks.append((path, start, start + chunk_size))
 
-        return dt
+    chunks = iter(chunks)
+    workers = max(1, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while True:
+            # Bounded number of chunks in memory
+            for path, start, stop in islice(chunks,
+                                            2 * workers - len(pending)):
+                pending.append(executor.submit(_load_acct_chunk, path, start,
+                                               stop))
 
-    raise NotImplementedError(string)
+            if not pending:
+                break
+
+            yield from pending.popleft().result()
+
+
+def _load_acct_chunk(path: str, start: int,
+                     stop: int | None) -> list[model.Job]:
+    jobs = []
+    for offset, fields in read_acct(path, start, stop):
+        if fields[0] != "JOB_FINISH":
+            continue
+
+        try:
+            job = parse_acct_record(fields)
+        except (IndexError, KeyError, ValueError):
+            logging.warning(f"{path}: invalid record at byte {offset}")
+        else:
+            jobs.append(job)
+
+    return jobs
+
+
+def read_acct(path: str, start: int = 0,
+              stop: int | None = None) -> Iterator[tuple[int, list[str]]]:
+    # Records (with their offset) starting between two offsets of the file
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as fh:
+        offset = start
+        line = None
+        if start > 0:
+            # Lines of records starting before `start` (possibly on several
+            # lines) are parsed by the previous chunk
+            fh.seek(start - 1)
+            offset += len(fh.readline()) - 1
+            for line in iter(fh.readline, b""):
+                if REG_ACCT_RECORD.match(line):
+                    break
+
+                offset += len(line)
+            else:
+                return
+
+        while stop is None or offset < stop:
+            if line is None:
+                line = fh.readline()
+            if not line:
+                break
+
+            record_offset = offset
+            offset += len(line)
+            while line.count(b'"') % 2:
+                # Newline in a quoted string
+                more = fh.readline()
+                if not more:
+                    break
+
+                offset += len(more)
+                line += more
+
+            fields = _split_acct(line.decode("utf-8", "replace"))
+            line = None
+            if fields:
+                yield record_offset, fields
+
+
+def _split_acct(text: str) -> list[str]:
+    # Space-separated fields, strings quoted ("" for a quote): odd parts
+    # are quoted, and adjacent ones (nothing between) are the same string
+    parts = text.split('"')
+    fields = parts[0].split()
+    value = None
+    for i in range(1, len(parts), 2):
+        value = parts[i] if value is None else f'{value}"{parts[i]}'
+        if i + 1 < len(parts) and parts[i + 1]:
+            fields.append(value)
+            value = None
+            fields.extend(parts[i + 1].split())
+
+    if value is not None:
+        fields.append(value)
+
+    return fields
+
+
+def parse_acct_record(fields: list[str]) -> model.Job:
+    # JOB_FINISH record (see lsb.acct(5)), times truncated to the minute
+    # as reported by bjobs, so jobs have the same accession
+    i = 23 + int(fields[22])
+    num_hosts = int(fields[i])
+    exec_hosts = {}
+    for host in fields[i + 1:i + 1 + num_hosts]:
+        exec_hosts[host] = exec_hosts.get(host, 0) + 1
+
+    i += 1 + num_hosts
+    slots = int(fields[6])
+    start_time = _parse_acct_time(fields[10])
+    finish_time = _parse_acct_time(fields[9])
+
+    # Resource usage: -1 if unavailable
+    utime = float(fields[i + 4])
+    stime = float(fields[i + 5])
+    if utime >= 0 or stime >= 0:
+        cpu_time = max(utime, 0) + max(stime, 0)
+    else:
+        cpu_time = None
+
+    run_time = int(fields[9]) - int(fields[10])
+    if cpu_time is not None and start_time is not None and run_time > 0:
+        cpu_efficiency = round(cpu_time / (run_time * slots) * 100, 2)
+    else:
+        cpu_efficiency = None
+
+    max_mem = float(fields[i + 30])  # KB
+    return model.Job(
+        scheduler="lsf",
+        id=int(fields[3]),
+        index=int(fields[i + 29]),
+        name=fields[i + 2],
+        status=ACCT_STATUS[int(fields[i])],
+        user=fields[11],
+        queue=fields[12],
+        slots=slots,
+        cpu_efficiency=cpu_efficiency,
+        mem_lim=None,
+        mem_max=int(max_mem / 1024) if max_mem >= 0 else None,
+        mem_efficiency=None,
+        from_host=fields[16],
+        exec_host=":".join(f"{n}*{host}" if n > 1 else host
+                           for host, n in exec_hosts.items()) or None,
+        submit_time=_parse_acct_time(fields[7]),
+        start_time=start_time,
+        finish_time=finish_time,
+        cpu_time=cpu_time,
+    )
+
+
+def _parse_acct_time(value: str) -> datetime | None:
+    ts = int(value)
+    if ts <= 0:
+        return None
+
+    return datetime.fromtimestamp(ts - ts % 60)
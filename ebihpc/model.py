@@ -1,17 +1,18 @@
+import grp
 import json
-import re
-import subprocess as sp
-import time
+import os
+import pwd
 from dataclasses import asdict, dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any
-from urllib.parse import urlencode
-from urllib.request import urlopen
-from urllib.error import HTTPError
 from uuid import uuid4
 
+from . import ebisearch
+
 
 DT_REPR = "%Y-%m-%d %H:%M:%S"
+# Stored times are naive: integer times are seconds since this (naive) date
+EPOCH = datetime(1970, 1, 1)
 
 
 @dataclass
@@ -24,7 +25,7 @@ class Job:
     user: str
     queue: str
     slots: int
-    cpu_efficiency: float
+    cpu_efficiency: float | None
     mem_lim: int | None
     mem_max: int | None
     mem_efficiency: float
@@ -34,21 +35,23 @@ class Job:
     start_time: datetime | None
     finish_time: datetime | None
     cpu_time: float | None
-    update_time: datetime = datetime.now()
+    update_time: datetime = field(default_factory=datetime.now)
+    # Name of the cluster, if several are tracked
+    cluster: str | None = None
 
     @property
     def accession(self) -> str:
         ts = self.submit_time.timestamp()
+        if self.cluster:
+            return (f"{ts:.0f}-{self.scheduler}-{self.cluster}-"
+                    f"{self.id}-{self.index}")
+
         return f"{ts:.0f}-{self.scheduler}-{self.id}-{self.index}"
 
     @property
     def ok(self) -> bool:
         if self.finish_time is not None:
-            if self.scheduler == "lsf":
-                if self.status.lower() == "done":
-                    return True
-            else:
-                raise NotImplementedError(self.scheduler)
+            return is_done(self.scheduler, self.status)
 
         return False
 
@@ -83,10 +86,11 @@ class Job:
 
         return d
 
-    def to_tuple(self) -> tuple:
+    def to_tuple(self, epoch: bool = False) -> tuple:
+        fmt = to_epoch if epoch else lambda dt: dt.strftime(DT_REPR)
         return (
             self.accession,
-            self.scheduler,
+            join_scheduler(self.scheduler, self.cluster),
             self.id,
             self.index,
             self.name,
@@ -101,15 +105,16 @@ class Job:
             self.mem_efficiency,
             self.from_host,
             self.exec_host,
-            self.submit_time.strftime(DT_REPR),
-            self.start_time.strftime(DT_REPR) if self.start_time else None,
-            self.finish_time.strftime(DT_REPR) if self.finish_time else None,
-            self.update_time.strftime(DT_REPR)
+            fmt(self.submit_time),
+            fmt(self.start_time) if self.start_time else None,
+            fmt(self.finish_time) if self.finish_time else None,
+            fmt(self.update_time)
         )
 
     @staticmethod
     def from_tuple(obj: tuple):
-        return Job(scheduler=obj[1],
+        scheduler, cluster = split_scheduler(obj[1])
+        return Job(scheduler=scheduler,
                    id=obj[2],
                    index=obj[3],
                    name=obj[4],
@@ -124,12 +129,45 @@ class Job:
                    mem_efficiency=obj[13],
                    from_host=obj[14],
                    exec_host=obj[15],
-                   submit_time=datetime.strptime(obj[16], DT_REPR),
-                   start_time=(datetime.strptime(obj[17], DT_REPR)
-                               if obj[17] else None),
-                   finish_time=(datetime.strptime(obj[18], DT_REPR)
-                                if obj[18] else None),
-                   update_time=datetime.strptime(obj[19], DT_REPR))
+                   submit_time=parse_time(obj[16]),
+                   start_time=parse_time(obj[17]),
+                   finish_time=parse_time(obj[18]),
+                   update_time=parse_time(obj[19]),
+                   cluster=cluster)
+
+
+def join_scheduler(scheduler: str, cluster: str | None) -> str:
+    # Stored scheduler of jobs of a named cluster: <scheduler>@<cluster>
+    return f"{scheduler}@{cluster}" if cluster else scheduler
+
+
+def split_scheduler(value: str) -> tuple[str, str | None]:
+    scheduler, _, cluster = value.partition("@")
+    return scheduler, cluster or None
+
+
+def to_epoch(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+def parse_time(value: str | int | None) -> datetime | None:
+    # Stored times are either strings or integers (see EPOCH)
+    if value is None or value == "":
+        return None
+    elif isinstance(value, int):
+        return EPOCH + timedelta(seconds=value)
+
+    return datetime.strptime(value, DT_REPR)
+
+
+def is_done(scheduler: str, status: str) -> bool:
+    scheduler, _ = split_scheduler(scheduler)
+    if scheduler == "lsf":
+        return status.lower() == "done"
+    elif scheduler == "slurm":
+        return status.upper() == "COMPLETED"
+
+    raise NotImplementedError(scheduler)
 
 
 @dataclass
@@ -144,24 +182,49 @@ class UnixUser:
     @staticmethod
     def get_groups(name) -> tuple:
         try:
-            out = sp.check_output(["id", name],
-                                  stderr=sp.DEVNULL,
-                                  encoding="utf-8")
-        except sp.CalledProcessError:
-            return None, None
+            return _USERS_GROUPS[name]
+        except KeyError:
+            pass
+
+        try:
+            gid = pwd.getpwnam(name).pw_gid
+        except KeyError:
+            group = groups = None
+        else:
+            group = _get_group_name(gid)
+            # All groups, including those of directories not enumerated
+            # by getgrall() (e.g. LDAP)
+            groups = ",".join(sorted({_get_group_name(g)
+                                      for g in os.getgrouplist(name, gid)}
+                                     | {group}))
+
+        _USERS_GROUPS[name] = group, groups
+        return group, groups
+
+
+# Process-wide caches of the group database
+_USERS_GROUPS = {}
+_GROUP_NAMES = None
 
-        # e.g. 100(admin)
-        pattern = r"\d+\(([^\)]+)\)"
 
-        match = re.search(r"gid=(\S+)", out).group(1)
-        group = re.match(pattern, match).group(1)
+def _get_group_name(gid: int) -> str:
+    global _GROUP_NAMES
+    if _GROUP_NAMES is None:
+        # Names of groups loaded at once, rather than one lookup each
+        _GROUP_NAMES = {g.gr_gid: g.gr_name for g in grp.getgrall()}
 
-        match = re.search(r"groups=(\S+)", out).group(1)
-        groups = set()
-        for grp in re.findall(pattern, match):
-            groups.add(grp)
+    try:
+        return _GROUP_NAMES[gid]
+    except KeyError:
+        pass
 
-        return group, ",".join(sorted(groups))
+    try:
+        name = grp.getgrgid(gid).gr_name
+    except KeyError:
+        name = str(gid)
+
+    _GROUP_NAMES[gid] = name
+    return name
 
 
 @dataclass()
@@ -178,24 +241,10 @@ class User(UnixUser):
             self.uuid = uuid4().hex
 
     def update(self, max_attempts: int = 5):
-        attempts = 0
-
-        name = position = photo_url = teams = None
-
-        while True:
-            try:
-                name, position, teams, photo_url = self.get_info(self.login)
-            except HTTPError as exc:
-                # TODO check for HTTP status
-                attempts += 1
-                if attempts < max_attempts:
-                    time.sleep(0.5)
-                    continue
-                else:
-                    raise
-            else:
-                break
+        self.set_info(*self.get_info(self.login, max_attempts))
 
+    def set_info(self, name: str | None, position: str | None,
+                 teams: list[str], photo_url: str | None):
         if name is None:
             return
 
@@ -208,47 +257,11 @@ class User(UnixUser):
             self.photo_url = photo_url
 
     @staticmethod
-    def get_info(name) -> tuple[str | None, str | None, list[str], str | None]:
-        params = urlencode({
-            "query": name,
-            "size": 100,
-            "format": "JSON",
-            "fields": "email,full_name,photo,positions"
-        })
-
-        url = f"https://www.ebi.ac.uk/ebisearch/ws/rest/ebiweb_people/?{params}"
-        with urlopen(url) as req:
-            payload = req.read().decode("utf-8")
-
-        data = json.loads(payload)
-
-        for entry in data["entries"]:
-            obj = entry["fields"]
-
-            email = obj["email"][0] if obj["email"] else None
-            full_name = obj["full_name"][0] if obj["full_name"] else None
-            teams = []
-            position = None
-
-            for e in obj["positions"]:
-                if "Staff Association Representative" in e:
-                    continue
-
-                values = e.split("|")
-                value = values[0].strip()
-                if not position and value:
-                    position = value
-
-                value = values[1].strip()
-                if value:
-                    teams.append(value)
-
-            photo_url = obj["photo"][0] if obj["photo"] else None
-
-            if email == f"{name}@ebi.ac.uk":
-                return full_name, position, teams, photo_url
-
-        return None, None, [], None
+    def get_info(name,
+                 max_attempts: int = 5
+                 ) -> tuple[str | None, str | None, list[str], str | None]:
+        payload, _, _ = ebisearch.search(name, max_attempts=max_attempts)
+        return ebisearch.parse(name, payload)
 
     def to_tuple(self) -> tuple:
         return (
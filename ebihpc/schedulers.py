@@ -0,0 +1,138 @@
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from . import lsf
+from . import model
+from . import slurm
+
+
+# Jobs passed at once from a polling thread to the writer
+BATCH_SIZE = 1000
+
+
+@dataclass
+class Cluster:
+    # name: None for a single, unnamed, cluster (accessions without cluster)
+    name: str | None
+    scheduler: str
+    # Extra environment variables of scheduler commands
+    env: dict[str, str] = field(default_factory=dict)
+    # Slurm only: hours read by one sacct call
+    window: float = slurm.WINDOW / timedelta(hours=1)
+
+
+def _iter_lsf(cluster: Cluster,
+              since: datetime | None) -> Iterator[model.Job]:
+    # bjobs lists recently finished jobs: `since` is not needed
+    return lsf.iter_jobs(cluster.env)
+
+
+def _iter_slurm(cluster: Cluster,
+                since: datetime | None) -> Iterator[model.Job]:
+    return slurm.iter_jobs(since, timedelta(hours=cluster.window),
+                           cluster.name, cluster.env)
+
+
+# Adapters: jobs pending, running, or finished since a given time
+SCHEDULERS: dict[str, Callable[[Cluster, datetime | None],
+                               Iterator[model.Job]]] = {
+    "lsf": _iter_lsf,
+    "slurm": _iter_slurm
+}
+
+
+def load_clusters(path: str) -> list[Cluster]:
+    with open(path, "rt") as fh:
+        clusters = [Cluster(**obj) for obj in json.load(fh)]
+
+    names = set()
+    for cluster in clusters:
+        if cluster.scheduler not in SCHEDULERS:
+            raise NotImplementedError(cluster.scheduler)
+        elif not cluster.name or "@" in cluster.name:
+            raise ValueError(f"invalid cluster name: {cluster.name!r}")
+        elif cluster.name in names:
+            raise ValueError(f"duplicate cluster name: {cluster.name}")
+
+        names.add(cluster.name)
+
+    return clusters
+
+
+def iter_cluster_jobs(cluster: Cluster,
+                      since: datetime | None = None) -> Iterator[model.Job]:
+    for job in SCHEDULERS[cluster.scheduler](cluster, since):
+        job.cluster = cluster.name
+        yield job
+
+
+def iter_jobs(clusters: list[Cluster], since: datetime | None = None,
+              failed: set[str] | None = None) -> Iterator[model.Job]:
+    # Jobs of several clusters, polled concurrently (one thread each:
+    # scheduler commands run in their own process). Errors of a cluster are
+    # logged, and its stored scheduler (see model.join_scheduler) added to
+    # `failed`: its jobs may not all have been returned.
+    if failed is None:
+        failed = set()
+
+    if len(clusters) == 1:
+        cluster = clusters[0]
+        try:
+            yield from iter_cluster_jobs(cluster, since)
+        except Exception as exc:
+            _fail(cluster, exc, failed)
+        return
+
+    batches = queue.Queue(maxsize=2 * len(clusters))
+    stop = threading.Event()
+
+    def produce(cluster: Cluster):
+        try:
+            batch = []
+            for job in iter_cluster_jobs(cluster, since):
+                batch.append(job)
+                if len(batch) == BATCH_SIZE:
+                    if stop.is_set():
+                        return
+
+                    batches.put(batch)
+                    batch = []
+
+            batches.put(batch)
+        except Exception as exc:
+            _fail(cluster, exc, failed)
+        finally:
+            # End of the cluster's jobs (or error)
+            batches.put(None)
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        for cluster in clusters:
+            executor.submit(produce, cluster)
+
+        running = len(clusters)
+        try:
+            while running:
+                batch = batches.get()
+                if batch is None:
+                    running -= 1
+                else:
+                    yield from batch
+        finally:
+            # Stopped early: unblock threads still polling
+            stop.set()
+            while running:
+                if batches.get() is None:
+                    running -= 1
+
+
+def _fail(cluster: Cluster, exc: Exception, failed: set[str]):
+    name = model.join_scheduler(cluster.scheduler, cluster.name)
+    failed.add(name)
+    sys.stderr.write(f"{datetime.now():%Y-%m-%d %H:%M:%S}: "
+                     f"{name}: failed: {exc}\n")
@@ -0,0 +1,234 @@
+import os
+import re
+import subprocess as sp
+import sys
+import time
+from datetime import datetime, timedelta
+from tempfile import TemporaryFile
+from typing import IO, Iterator
+
+from . import model
+
+
+FIELDS = [
+    "JobID",
+    "JobName",
+    "State",
+    "User",
+    "Partition",
+    "AllocCPUS",
+    "NNodes",
+    "ReqMem",
+    "MaxRSS",
+    "NodeList",
+    "Submit",
+    "Start",
+    "End",
+    "ElapsedRaw",
+    "TotalCPU"
+]
+# Jobs read by the first poll (no previous poll)
+LOOKBACK = timedelta(days=1)
+# States of jobs not finished yet
+ACTIVE_STATES = {"PENDING", "RUNNING", "REQUEUED", "RESIZING", "SUSPENDED"}
+# Interval of one sacct call: heavy clusters are read in several calls
+WINDOW = timedelta(hours=6)
+# Calls of a command failing before any output, and seconds between them
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5
+
+# 1234, 1234_5 (array task), 1234+1 (heterogeneous job component)
+REG_JOBID = re.compile(r"(\d+)(?:_(\d+))?(?:\+(\d+))?")
+# Per-CPU (c) or per-node (n) units of older versions
+REG_MEM = re.compile(r"(\d+(?:\.\d+)?)([KMGT]?)([cn]?)")
+# [DD-[HH:]]MM:SS[.mmm]
+REG_CPU = re.compile(r"(?:(?:(\d+)-)?(\d+):)?(\d+):(\d+(?:\.\d+)?)")
+MEM_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+
+def get_jobs(since: datetime | None = None, window: timedelta = WINDOW,
+             cluster: str | None = None,
+             env: dict[str, str] | None = None) -> list[model.Job]:
+    return list(iter_jobs(since, window, cluster, env))
+
+
+def iter_jobs(since: datetime | None = None, window: timedelta = WINDOW,
+              cluster: str | None = None,
+              env: dict[str, str] | None = None) -> Iterator[model.Job]:
+    # Jobs pending, running, or that ended since a given time, read by
+    # intervals of `window` so that sacct never dumps the whole period.
+    # Jobs running during several intervals are only returned once.
+    # cluster: name of the cluster in Slurm (default: local cluster)
+    # env: extra environment variables, e.g. SLURM_CONF
+    now = datetime.now().replace(microsecond=0)
+    start = since.replace(microsecond=0) if since else now - LOOKBACK
+    seen = set()
+    while True:
+        stop = min(start + window, now)
+        for job_id, job in _iter_window(start, stop, cluster, env):
+            if job_id not in seen:
+                seen.add(job_id)
+                yield job
+
+        if stop >= now:
+            break
+
+        start = stop
+
+
+def _iter_window(start: datetime, stop: datetime, cluster: str | None,
+                 env: dict[str, str] | None
+                 ) -> Iterator[tuple[str, model.Job]]:
+    args = ["sacct", "--allusers", "--parsable2", "--noheader",
+            "--format", ",".join(FIELDS),
+            "--starttime", start.strftime("%Y-%m-%dT%H:%M:%S"),
+            "--endtime", stop.strftime("%Y-%m-%dT%H:%M:%S")]
+    if cluster:
+        args += ["--clusters", cluster]
+
+    env = {**os.environ, **env} if env else None
+
+    attempts = 0
+    while True:
+        # stderr in a file: a full pipe would block sacct
+        with TemporaryFile() as err:
+            p = sp.Popen(args, stdout=sp.PIPE, stderr=err, env=env)
+            num_jobs = 0
+            try:
+                for row in read_rows(p.stdout):
+                    num_jobs += 1
+                    yield row[0][0], parse_rows(row)
+
+                p.stdout.read()
+                returncode = p.wait()
+            finally:
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+                p.stdout.close()
+
+            err.seek(0)
+            stderr = err.read().decode("utf-8", "ignore")
+
+        attempts += 1
+        if returncode == 0:
+            break
+        elif num_jobs or attempts >= MAX_ATTEMPTS:
+            # Jobs already returned (cannot start again), or still failing
+            raise sp.CalledProcessError(returncode, args, stderr=stderr)
+
+        sys.stderr.write(f"Command {args} failed: {stderr}\n")
+        time.sleep(RETRY_DELAY)
+
+
+def read_rows(fh: IO[bytes]) -> Iterator[list[list[str]]]:
+    # Rows of sacct's output grouped by job: the allocation, then its steps
+    # (1234.batch, 1234.0, ...). Pending array tasks listed as a range
+    # (1234_[5-10]) are skipped.
+    rows = []
+    for line in fh:
+        row = line.decode("utf-8", "replace").rstrip("\n").split("|")
+        if len(row) != len(FIELDS):
+            continue
+
+        job_id, _, step = row[0].partition(".")
+        if not step:
+            if rows:
+                yield rows
+
+            rows = [row] if REG_JOBID.fullmatch(job_id) else []
+        elif rows and rows[0][0] == job_id:
+            rows.append(row)
+
+    if rows:
+        yield rows
+
+
+def parse_rows(rows: list[list[str]]) -> model.Job:
+    (job_id, name, state, user, partition, cpus, nodes, req_mem, _,
+     node_list, submit, start, end, elapsed, total_cpu) = rows[0]
+
+    m = REG_JOBID.fullmatch(job_id)
+    array_id, array_index, component = m.groups()
+
+    slots = int(cpus) or 1
+    mem_lim = parse_memory(req_mem, slots, int(nodes)) or None
+    # Memory used by steps (not reported for the allocation itself)
+    mem_max = None
+    for row in rows[1:]:
+        value = parse_memory(row[8])
+        if value is not None and (mem_max is None or value > mem_max):
+            mem_max = value
+
+    # e.g. CANCELLED by 1234
+    status = state.split(" ")[0]
+    finish_time = parse_time(end) if status not in ACTIVE_STATES else None
+
+    cpu_time = parse_cputime(total_cpu)
+    run_time = int(elapsed) if elapsed else 0
+    if cpu_time is not None and run_time > 0:
+        cpu_efficiency = round(cpu_time / (run_time * slots) * 100, 2)
+    else:
+        cpu_efficiency = None
+
+    if mem_lim and mem_max is not None:
+        mem_efficiency = round(mem_max / mem_lim * 100, 2)
+    else:
+        mem_efficiency = None
+
+    return model.Job(
+        scheduler="slurm",
+        id=int(array_id),
+        index=int(array_index or component or 0),
+        name=name,
+        status=status,
+        user=user,
+        queue=partition,
+        slots=slots,
+        cpu_efficiency=cpu_efficiency,
+        mem_lim=mem_lim,
+        mem_max=mem_max,
+        mem_efficiency=mem_efficiency,
+        from_host="",
+        exec_host=(node_list
+                   if node_list and node_list != "None assigned" else None),
+        submit_time=parse_time(submit),
+        start_time=parse_time(start),
+        finish_time=finish_time,
+        cpu_time=cpu_time,
+    )
+
+
+def parse_memory(string: str, cpus: int = 1, nodes: int = 1) -> int | None:
+    # In MB
+    m = REG_MEM.fullmatch(string)
+    if not m:
+        return None
+
+    value, unit, per = m.groups()
+    # Bytes if no unit
+    mem = float(value) * MEM_UNITS.get(unit, 1 / 1024 / 1024)
+    if per == "c":
+        mem *= cpus
+    elif per == "n":
+        mem *= nodes
+
+    return int(mem)
+
+
+def parse_time(string: str) -> datetime | None:
+    try:
+        return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        # Unknown, None
+        return None
+
+
+def parse_cputime(string: str) -> float | None:
+    m = REG_CPU.fullmatch(string)
+    if not m:
+        return None
+
+    days, hours, minutes, seconds = m.groups()
+    return (int(days or 0) * 86400 + int(hours or 0) * 3600
+            + int(minutes) * 60 + float(seconds))
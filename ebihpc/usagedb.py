@@ -4,16 +4,29 @@ import logging
 import math
 import pickle
 import sqlite3
+import struct
+import zlib
 from datetime import datetime, timedelta
+from itertools import chain
 from tempfile import mkstemp
 
-from . import const, jobdb
+from . import const, intervals, jobdb
 from .model import Job, UnixUser, User, DT_REPR
 
 
 DT_FMT = "%Y%m%d%H%M"
 RUNTIMES = [60, 600, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600,
             48 * 3600, 72 * 3600, 7 * 24 * 3600]
+# Finished jobs are kept in the ledger as long as they may be updated again
+LEDGER_RETENTION = timedelta(days=1)
+
+# Periods and metrics of rollup tables
+ROLLUPS = ["hour", "day", "week", "month"]
+ROLLUP_METRICS = ["jobs", "co2e", "cost", "cputime"]
+
+# Binary usage rows: version, flags, then packed values (see encode_*())
+ENCODING_VERSION = 1
+COMPRESSED = 1
 
 
 def connect(database: str) -> sqlite3.Connection:
@@ -49,6 +62,22 @@ def connect(database: str) -> sqlite3.Connection:
         )
         """
     )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ledger (
+            id TEXT PRIMARY KEY NOT NULL,
+            job TEXT NOT NULL
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_index (
+            login TEXT PRIMARY KEY NOT NULL,
+            id INTEGER UNIQUE NOT NULL
+        )
+        """
+    )
     con.execute(
         """
         CREATE TABLE IF NOT EXISTS report (
@@ -92,6 +121,36 @@ def get_users(con: sqlite3.Connection,
     return users
 
 
+def get_user_ids(con: sqlite3.Connection, logins: list[str],
+                 commit: bool = True) -> dict[str, int]:
+    # Stable user indices, used as keys in binary usage rows.
+    # commit: False to add new users in the current transaction
+    user2index = dict(con.execute("SELECT login, id FROM user_index"))
+    new_logins = [login for login in logins if login not in user2index]
+    if new_logins:
+        next_id = max(user2index.values(), default=-1) + 1
+        params = []
+        for i, login in enumerate(new_logins):
+            user2index[login] = next_id + i
+            params.append((login, next_id + i))
+
+        con.executemany("INSERT INTO user_index VALUES (?, ?)", params)
+        if commit:
+            con.commit()
+
+    return user2index
+
+
+def get_user_logins(con: sqlite3.Connection) -> dict[int, str]:
+    try:
+        rows = con.execute("SELECT login, id FROM user_index").fetchall()
+    except sqlite3.OperationalError:
+        # Database without binary rows (not opened with connect())
+        return {}
+
+    return {i: login for login, i in rows}
+
+
 def get_latest_update_time(con: sqlite3.Connection, datatype: str) -> datetime:
     if datatype not in ["jobs", "usage"]:
         raise ValueError(datatype)
@@ -111,59 +170,399 @@ def bump_update_times(con: sqlite3.Connection, jobs_update_time: datetime):
     con.commit()
 
 
+def has_ledger(con: sqlite3.Connection) -> bool:
+    row = con.execute("SELECT value FROM metadata "
+                      "WHERE key = 'ledger'").fetchone()
+    return row is not None
+
+
+def reset_ledger(con: sqlite3.Connection, database: str):
+    jcon = jobdb.connect(database)
+    last_jobs_update = jobdb.get_latest_update_time(jcon)
+    con.execute("DELETE FROM ledger")
+    if last_jobs_update is not None:
+        since = last_jobs_update - LEDGER_RETENTION
+        jobs = chain(jobdb.find_updated(jcon, since),
+                     jobdb.find_running(jcon, since))
+        _update_ledger(con, jobs, last_jobs_update)
+    jcon.close()
+    con.commit()
+
+
+def _update_ledger(con: sqlite3.Connection, jobs, last_jobs_update: datetime):
+    # Jobs are stored with the time until which usage was processed: running
+    # jobs were counted as a fraction of a job (and of their CPU time) based
+    # on their runtime until then
+    until = last_jobs_update.strftime(DT_REPR)
+    con.executemany("INSERT OR REPLACE INTO ledger VALUES (?, ?)",
+                    ((job.accession, json.dumps([*job.to_tuple(), until]))
+                     for job in jobs))
+
+    # Forget finished jobs unlikely to be updated again (index 18:
+    # finish_time, 19: update_time). Running jobs are only written when
+    # they change, so their update time may be old.
+    dt = last_jobs_update - LEDGER_RETENTION
+    con.execute("DELETE FROM ledger WHERE json_extract(job, '$[18]') IS NOT NULL "
+                "AND json_extract(job, '$[19]') < ?",
+                [dt.strftime(DT_REPR)])
+    con.execute("INSERT OR REPLACE INTO metadata VALUES ('ledger', ?)",
+                [last_jobs_update.strftime(DT_REPR)])
+
+
+def name_cluster(con: sqlite3.Connection, cluster: str) -> int:
+    # As jobdb.name_cluster(), for jobs of the ledger, so their next update
+    # replaces their former usage
+    rows = []
+    for row_id, data in con.execute("SELECT id, job FROM ledger").fetchall():
+        values = json.loads(data)
+        job = Job.from_tuple(values)
+        if job.cluster is None:
+            job.cluster = cluster
+            # Keep the time usage was processed until (see _update_ledger())
+            rows.append((row_id, job, values[20:]))
+
+    con.executemany("DELETE FROM ledger WHERE id = ?",
+                    [(row_id,) for row_id, _, _ in rows])
+    con.executemany("INSERT OR REPLACE INTO ledger VALUES (?, ?)",
+                    [(job.accession, json.dumps([*job.to_tuple(), *extra]))
+                     for _, job, extra in rows])
+    con.commit()
+    return len(rows)
+
+
 def update_users(con: sqlite3.Connection, users: list[User]):
     sql = "INSERT OR REPLACE INTO user VALUES (?, ?, ?, ?, ?, ?, ?)"
     con.executemany(sql, (u.to_tuple() for u in users))
     con.commit()
 
 
-def update_usage(con: sqlite3.Connection, file: str):
-    sql = "INSERT OR REPLACE INTO usage VALUES (?, ?, ?)"
-    con.executemany(sql, _parse_output(file))
+def get_team_weights(con: sqlite3.Connection) -> dict[str, dict[str, float]]:
+    # Sparse user x team matrix: usage of users split equally between teams
+    weights = {}
+    for login, teams in con.execute("SELECT login, teams FROM user"):
+        teams = json.loads(teams)
+        user_weights = weights[login] = {}
+        for team in teams:
+            try:
+                user_weights[team] += 1 / len(teams)
+            except KeyError:
+                user_weights[team] = 1 / len(teams)
+
+    return weights
+
+
+def project_teams(users_values: dict[str, list[float]],
+                  weights: dict[str, dict[str, float]]
+                  ) -> dict[str, list[float]]:
+    # Values of teams from values of users (same metrics)
+    teams_values = {}
+    for login, values in users_values.items():
+        for team, weight in weights.get(login, {}).items():
+            try:
+                team_values = teams_values[team]
+            except KeyError:
+                teams_values[team] = [v * weight for v in values]
+            else:
+                for i, v in enumerate(values):
+                    team_values[i] += v * weight
+
+    return teams_values
+
+
+def update_usage(con: sqlite3.Connection, output: str | list[tuple]):
+    # Output of process_jobs(): a file, or already encoded rows
+    if isinstance(output, str):
+        _write_usage(con, _parse_output(output))
+    else:
+        _write_usage(con, output)
+
     con.commit()
 
 
+def _write_usage(con: sqlite3.Connection, rows):
+    user_usage = has_user_usage(con)
+    rollups = has_rollups(con)
+    if not user_usage and not rollups:
+        con.executemany("INSERT OR REPLACE INTO usage VALUES (?, ?, ?)",
+                        rows)
+        return
+
+    rows = list(rows)
+    if rollups:
+        # Rows about to be replaced
+        old_rows = []
+        keys = [key for key, _, _ in rows]
+        for i in range(0, len(keys), 500):
+            params = keys[i:i + 500]
+            old_rows += con.execute(
+                f"""
+                SELECT *
+                FROM usage
+                WHERE time IN ({','.join('?' * len(params))})
+                """,
+                params
+            ).fetchall()
+
+    con.executemany("INSERT OR REPLACE INTO usage VALUES (?, ?, ?)", rows)
+
+    new_rows = _decode_rows(con, rows)
+    if user_usage:
+        _update_user_usage(con, new_rows)
+    if rollups:
+        _update_rollups(con, _decode_rows(con, old_rows), new_rows)
+
+
+def _decode_rows(con: sqlite3.Connection,
+                 rows: list[tuple]) -> list[tuple[str, dict]]:
+    index2user = get_user_logins(con)
+    return [(key, decode_users_data(users_data, index2user))
+            for key, users_data, _ in rows]
+
+
+def has_user_usage(con: sqlite3.Connection) -> bool:
+    row = con.execute("SELECT 1 FROM sqlite_master "
+                      "WHERE type = 'table' AND name = 'user_usage'").fetchone()
+    return row is not None
+
+
+def create_user_usage(con: sqlite3.Connection):
+    # Usage per user and interval, kept up to date with the usage table
+    if has_user_usage(con):
+        return
+
+    con.execute(
+        """
+        CREATE TABLE user_usage (
+            time TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            jobs REAL NOT NULL,
+            cores REAL NOT NULL,
+            memory REAL NOT NULL,
+            co2e REAL NOT NULL,
+            cost REAL NOT NULL,
+            cputime REAL NOT NULL,
+            CONSTRAINT pk_user_usage PRIMARY KEY (time, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    # Covers the queries of one or a few users
+    con.execute("CREATE INDEX user_usage_user "
+                "ON user_usage (user_id, time, co2e)")
+
+    cur = con.execute("SELECT * FROM usage ORDER BY time")
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+
+        _update_user_usage(con, _decode_rows(con, rows))
+
+    con.commit()
+
+
+def _update_user_usage(con: sqlite3.Connection, rows: list[tuple[str, dict]]):
+    logins = {login for _, users_data in rows for login in users_data}
+    # Committed with usage rows
+    user2index = get_user_ids(con, sorted(logins), commit=False)
+
+    con.executemany("DELETE FROM user_usage WHERE time = ?",
+                    [(key,) for key, _ in rows])
+    con.executemany(
+        "INSERT INTO user_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ((key, user2index[login], obj["jobs"], obj["cores"], obj["memory"],
+          obj["co2e"], obj["cost"], obj["cputime"])
+         for key, users_data in rows
+         for login, obj in users_data.items())
+    )
+
+
+def floor_period(dt: datetime, period: str) -> datetime:
+    if period == "hour":
+        return datetime(dt.year, dt.month, dt.day, dt.hour)
+    elif period == "day":
+        return datetime(dt.year, dt.month, dt.day)
+    elif period == "week":
+        # ISO week: starts on Monday
+        day = datetime(dt.year, dt.month, dt.day)
+        return day - timedelta(days=day.weekday())
+    elif period == "month":
+        return datetime(dt.year, dt.month, 1)
+
+    raise ValueError(period)
+
+
+def ceil_period(dt: datetime, period: str) -> datetime:
+    start = floor_period(dt, period)
+    if start == dt:
+        return dt
+    elif period == "hour":
+        return start + timedelta(hours=1)
+    elif period == "day":
+        return start + timedelta(days=1)
+    elif period == "week":
+        return start + timedelta(days=7)
+    elif start.month < 12:
+        return datetime(start.year, start.month + 1, 1)
+    else:
+        return datetime(start.year + 1, 1, 1)
+
+
+def has_rollups(con: sqlite3.Connection) -> bool:
+    row = con.execute("SELECT 1 FROM sqlite_master "
+                      "WHERE type = 'table' AND name = 'user_rollup'").fetchone()
+    return row is not None
+
+
+def create_rollups(con: sqlite3.Connection):
+    # Usage per user, summed over hours, days, weeks and months, kept up
+    # to date with the usage table. Peaks (cores, memory) are not rolled
+    # up: they could not be updated when intervals are. Usage of teams is
+    # projected from users when read, with the current teams of users.
+    if has_rollups(con):
+        columns = [row[1] for row in
+                   con.execute("PRAGMA table_info(user_rollup)")]
+        if "num_intervals" in columns:
+            return
+
+        # Rollups of earlier versions: created again
+        con.execute("DROP TABLE user_rollup")
+        con.execute("DROP TABLE IF EXISTS team_rollup")
+
+    con.execute(
+        """
+        CREATE TABLE user_rollup (
+            period TEXT NOT NULL,
+            time TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            num_intervals INTEGER NOT NULL,
+            jobs REAL NOT NULL,
+            co2e REAL NOT NULL,
+            cost REAL NOT NULL,
+            cputime REAL NOT NULL,
+            CONSTRAINT pk_user_rollup PRIMARY KEY (period, time, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    con.execute("CREATE INDEX user_rollup_user "
+                "ON user_rollup (period, user_id, time, co2e)")
+
+    cur = con.execute("SELECT * FROM usage ORDER BY time")
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+
+        _update_rollups(con, [], _decode_rows(con, rows))
+
+    con.commit()
+
+
+def _update_rollups(con: sqlite3.Connection, old_rows: list[tuple[str, dict]],
+                    new_rows: list[tuple[str, dict]]):
+    # Deltas: number of 15-minute intervals with usage of the user, then
+    # metrics
+    deltas = {}
+    for sign, rows in [(-1, old_rows), (1, new_rows)]:
+        for key, users_data in rows:
+            dt = datetime.strptime(key, DT_FMT)
+            periods = [(p, floor_period(dt, p).strftime(DT_FMT))
+                       for p in ROLLUPS]
+            for login, obj in users_data.items():
+                values = [sign] + [sign * obj[name]
+                                   for name in ROLLUP_METRICS]
+                for period in periods:
+                    try:
+                        users_deltas = deltas[period]
+                    except KeyError:
+                        users_deltas = deltas[period] = {}
+
+                    try:
+                        delta = users_deltas[login]
+                    except KeyError:
+                        users_deltas[login] = list(values)
+                    else:
+                        for i, v in enumerate(values):
+                            delta[i] += v
+
+    if not deltas:
+        return
+
+    logins = {login for users_deltas in deltas.values()
+              for login in users_deltas}
+    user2index = get_user_ids(con, sorted(logins), commit=False)
+
+    updates = ", ".join(f"{name} = {name} + excluded.{name}"
+                        for name in ["num_intervals"] + ROLLUP_METRICS)
+    con.executemany(
+        f"""
+        INSERT INTO user_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (period, time, user_id) DO UPDATE SET {updates}
+        """,
+        ((period, time, user2index[login], *values)
+         for (period, time), users_deltas in deltas.items()
+         for login, values in users_deltas.items())
+    )
+
+    # Intervals replaced by intervals without usage of a user
+    con.executemany(
+        """
+        DELETE FROM user_rollup
+        WHERE period = ? AND time = ? AND user_id = ? AND num_intervals = 0
+        """,
+        ((period, time, user2index[login])
+         for (period, time), users_deltas in deltas.items()
+         for login in users_deltas)
+    )
+
+
 def _parse_output(file: str):
     with open(file, "rb") as fh:
         while True:
             try:
-                key, data, other_data = pickle.load(fh)
+                yield pickle.load(fh)
             except EOFError:
                 break
-            else:
-                yield key, json.dumps(data), json.dumps(other_data)
+
+
+def encode_intervals(intervals, user2index: dict[str, int],
+                     encoding: str = "json"):
+    for key, data, other_data in intervals:
+        if encoding == "json":
+            yield key, json.dumps(data), json.dumps(other_data)
+        elif encoding == "binary":
+            yield (key, encode_users_data(data, user2index),
+                   encode_jobs_data(other_data))
+        else:
+            raise ValueError(encoding)
 
 
 def update_reports(database: str, dt: datetime, data: dict[str, dict]):
     month = dt.strftime("%Y-%m")
 
     con = connect(database)
-    user2teams = {u.login: u.teams for u in get_users(con)}
 
     params = []
-    teams = {}
+    users_values = {}
     for uname, user_data in data.items():
         params.append((uname, month, json.dumps(user_data)))
+        users_values[uname] = [user_data["jobs"]["total"],
+                               user_data["cputime"],
+                               user_data["co2e"],
+                               user_data["cost"]]
+
+    teams = []
+    for team, values in project_teams(users_values,
+                                      get_team_weights(con)).items():
+        jobs, cputime, co2e, cost = values
+        teams.append({
+            "team": team,
+            "jobs": jobs,
+            "cputime": cputime,
+            "co2e": co2e,
+            "cost": cost,
+        })
 
-        user_teams = user2teams.get(uname, [])
-        for team in user_teams:
-            try:
-                t = teams[team]
-            except KeyError:
-                t = teams[team] = {
-                    "team": team,
-                    "jobs": 0,
-                    "cputime": 0,
-                    "co2e": 0,
-                    "cost": 0,
-                }
-
-            t["jobs"] += user_data["jobs"]["total"] / len(user_teams)
-            t["cputime"] += user_data["cputime"] / len(user_teams)
-            t["co2e"] += user_data["co2e"] / len(user_teams)
-            t["cost"] += user_data["cost"] / len(user_teams)
-
-    params.append(("_", month, json.dumps(list(teams.values()))))
+    params.append(("_", month, json.dumps(teams)))
     con.executemany("INSERT OR REPLACE INTO report VALUES (?, ?, ?)", params)
     con.commit()
     con.close()
@@ -176,82 +575,241 @@ def range_dt(start: datetime, stop: datetime, step: timedelta):
 
 
 def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
-                 user2index: dict[str, int]) -> tuple[str, int]:
-    # Stats in intervals of one minute
-    job_intervals = list(range_dt(from_dt, to_dt, timedelta(minutes=1)))
-    users_data = []
-    for _ in job_intervals:
-        obj = []
-        for _ in user2index:
-            obj.append({
-                "jobs": 0,
-                "cores": 0,
-                "memory": 0,
-                "co2e": 0,
-                "cost": 0,
-                "cputime": 0
-            })
+                 user2index: dict[str, int], archive_dir: str | None = None,
+                 transport: str = "file",
+                 window: tuple[datetime, datetime] | None = None,
+                 encoding: str = "json") -> tuple[str | list[tuple], int]:
+    # window: processing a slice of this window (e.g. a day), with the same
+    # results as when processing the whole window
+    con = jobdb.connect(database)
+    # No job polled (e.g. only archived jobs): no running job to stop
+    last_jobs_update = jobdb.get_latest_update_time(con) or to_dt
+    con.close()
 
-        users_data.append(obj)
+    if window and window[0] < from_dt:
+        # Jobs of one minute or less that finished just before the slice
+        # run until one minute later
+        jobs = jobdb.find_jobs(database, from_dt - timedelta(minutes=1),
+                               to_dt, archive_dir=archive_dir)
+    else:
+        jobs = jobdb.find_jobs(database, from_dt, to_dt,
+                               archive_dir=archive_dir)
 
-    # Stats in intervals of 15 minutes
+    if window and window[1] > to_dt:
+        jobs = chain(jobs, _find_later_jobs(database, from_dt, to_dt,
+                                            window[1], archive_dir))
+
+    usage = _process(jobs, from_dt, to_dt, last_jobs_update, user2index,
+                     window[1] if window else None)
+    users_data, users_extra_data, jobs_data, num_jobs = usage
+
+    # Merge one-minute intervals data in 15-minute intervals
     final_intervals = list(range_dt(from_dt, to_dt, timedelta(minutes=15)))
-    jobs_data = []
-    users_extra_data = []
-    for _ in final_intervals:
-        obj = []
-        for _ in user2index:
-            obj.append({
-                "submitted": 0,
-                "done": 0,
-                "failed": {
-                    "total": 0,
-                    "memlim": 0
-                },
-                "memeff": [0] * 5,
-                "cpueff": [0] * 5,
-            })
-
-        users_extra_data.append(obj)
-
-        jobs_data.append({
-            "done": {
-                "total": 0,
+    output = write_intervals(_merge_intervals(final_intervals, users_data,
+                                              users_extra_data, jobs_data,
+                                              user2index),
+                             transport, user2index, encoding)
+    return output, num_jobs
+
+
+def _find_later_jobs(database: str, from_dt: datetime, to_dt: datetime,
+                     window_end: datetime, archive_dir: str | None = None):
+    # Jobs submitted during a slice but started later in the window:
+    # they count as submitted during the slice
+    for job in jobdb.find_jobs(database, to_dt, window_end,
+                               archive_dir=archive_dir,
+                               submitted=(from_dt, to_dt)):
+        if job.start_time >= to_dt:
+            yield job
+
+
+def _new_user_extra() -> dict:
+    return {
+        "submitted": 0,
+        "done": 0,
+        "failed": {
+            "total": 0,
+            "memlim": 0
+        },
+        "memeff": [0] * 5,
+        "cpueff": [0] * 5,
+    }
+
+
+def _new_jobs_data() -> dict:
+    return {
+        "done": {
+            "total": 0,
+            "co2e": 0,
+            "runtimes": [0] * (len(RUNTIMES) + 1),
+            "cpueff": [0] * 100,
+            "memeff": {
+                "dist": [0] * 100,
                 "co2e": 0,
-                "runtimes": [0] * (len(RUNTIMES) + 1),
-                "cpueff": [0] * 100,
-                "memeff": {
-                    "dist": [0] * 100,
-                    "co2e": 0,
-                    "cost": 0
-                },
+                "cost": 0
             },
-            "failed": {
+        },
+        "failed": {
+            "total": 0,
+            "co2e": 0,
+            "cost": 0,
+            "memlim": 0,
+            "more1h": {
                 "total": 0,
-                "co2e": 0,
-                "cost": 0,
-                "memlim": 0,
-                "more1h": {
-                    "total": 0,
-                    "co2e": 0
-                },
-            }
-        })
+                "co2e": 0
+            },
+        }
+    }
+
+
+def _layout(template: dict, floats: set[str]) -> str:
+    # struct format of the values of a dict (see _flatten())
+    fmt = ""
+    for key, value in template.items():
+        if isinstance(value, dict):
+            fmt += _layout(value, floats)
+        elif isinstance(value, list):
+            fmt += "i" * len(value)
+        else:
+            fmt += "d" if key in floats else "i"
+
+    return fmt
+
+
+def _flatten(template: dict, obj: dict) -> list:
+    values = []
+    for key, value in template.items():
+        if isinstance(value, dict):
+            values += _flatten(value, obj[key])
+        elif isinstance(value, list):
+            values += obj[key]
+        else:
+            values.append(obj[key])
+
+    return values
+
+
+def _unflatten(template: dict, values) -> dict:
+    obj = {}
+    for key, value in template.items():
+        if isinstance(value, dict):
+            obj[key] = _unflatten(value, values)
+        elif isinstance(value, list):
+            obj[key] = [next(values) for _ in value]
+        else:
+            obj[key] = next(values)
+
+    return obj
+
+
+def _new_user_data() -> dict:
+    obj = {
+        "jobs": 0,
+        "cores": 0,
+        "memory": 0,
+        "co2e": 0,
+        "cost": 0,
+        "cputime": 0
+    }
+    obj.update(_new_user_extra())
+    return obj
+
+
+# User index, then user's data
+USER_STRUCT = struct.Struct("<I" + _layout(_new_user_data(), {
+    "jobs", "cores", "memory", "co2e", "cost", "cputime"
+}))
+JOBS_STRUCT = struct.Struct("<" + _layout(_new_jobs_data(), {"co2e", "cost"}))
+
+
+def _pack(payload: bytes, compress: bool) -> bytes:
+    if compress:
+        return bytes([ENCODING_VERSION, COMPRESSED]) + zlib.compress(payload)
+
+    return bytes([ENCODING_VERSION, 0]) + payload
+
+
+def _unpack(data: bytes) -> bytes:
+    version, flags = data[0], data[1]
+    if version != ENCODING_VERSION:
+        raise ValueError(f"unsupported usage encoding: {version}")
+    elif flags & COMPRESSED:
+        return zlib.decompress(data[2:])
+
+    return data[2:]
+
+
+def _is_json(data: str | bytes) -> bool:
+    return isinstance(data, str) or data[:1] == b"{"
+
+
+def encode_users_data(data: dict[str, dict], user2index: dict[str, int],
+                      compress: bool = True) -> bytes:
+    template = _new_user_data()
+    payload = b"".join(USER_STRUCT.pack(user2index[login],
+                                        *_flatten(template, obj))
+                       for login, obj in data.items())
+    return _pack(payload, compress)
+
+
+def decode_users_data(data: str | bytes,
+                      index2user: dict[int, str]) -> dict[str, dict]:
+    # JSON (text) or binary rows
+    if _is_json(data):
+        return json.loads(data)
+
+    users_data = {}
+    template = _new_user_data()
+    for i, *values in USER_STRUCT.iter_unpack(_unpack(data)):
+        users_data[index2user[i]] = _unflatten(template, iter(values))
+
+    return users_data
 
-    con = jobdb.connect(database)
-    last_jobs_update = jobdb.get_latest_update_time(con)
-    con.close()
+
+def encode_jobs_data(data: dict, compress: bool = True) -> bytes:
+    return _pack(JOBS_STRUCT.pack(*_flatten(_new_jobs_data(), data)),
+                 compress)
+
+
+def decode_jobs_data(data: str | bytes) -> dict:
+    if _is_json(data):
+        return json.loads(data)
+
+    values = JOBS_STRUCT.unpack(_unpack(data))
+    return _unflatten(_new_jobs_data(), iter(values))
+
+
+def _process(jobs, from_dt: datetime, to_dt: datetime,
+             last_jobs_update: datetime, user2index: dict[str, int],
+             window_end: datetime | None = None,
+             counted: dict[str, datetime] | None = None):
+    # Stats in intervals of one minute: jobs, cores, memory, co2e, cost,
+    # cputime, and number of running jobs.
+    # counted: running jobs counted as a fraction of a job (and of their CPU
+    # time) as they were at a given time, see process_updates()
+    num_minutes = len(list(range_dt(from_dt, to_dt, timedelta(minutes=1))))
+    users_data = intervals.Accumulator(num_minutes, 7)
+
+    # Stats in intervals of 15 minutes (users' stats created when needed)
+    final_intervals = list(range_dt(from_dt, to_dt, timedelta(minutes=15)))
+    jobs_data = [_new_jobs_data() for _ in final_intervals]
+    users_extra_data = {}
 
     num_jobs = 0
     label = f"{from_dt:%Y-%m-%d} - {to_dt:%Y-%m-%d}"
-    for job in jobdb.find_jobs(database, from_dt, to_dt):
+    for job in jobs:
         num_jobs += 1
 
         if num_jobs % 1e5 == 0:
             logging.debug(f"{label}: {num_jobs:>20,}")
 
-        cpu_eff = min(job.cpu_efficiency, 100)
-        cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+        cpu_eff = job.cpu_efficiency
+        if cpu_eff is not None:
+            cpu_eff = min(cpu_eff, 100)
+            cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+        else:
+            # Unknown CPU efficiency: assume all cores are used
+            cores_power = job.slots * const.CPU_POWER
         if "gpu" in job.queue:
             # Unknown GPU number and GPU efficiency: assume 1
             cores_power += 1 * 1 * const.GPU_POWER
@@ -263,7 +821,7 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
         start_time = job.start_time
         finish_time = job.finish_time
         if finish_time is None:
-            finish_time = min(last_jobs_update, to_dt)
+            finish_time = min(last_jobs_update, window_end or to_dt)
         elif start_time == finish_time:
             # One minute or less
             finish_time += timedelta(minutes=1)
@@ -275,28 +833,56 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
                                           start_time)
         cpu_time = job.cpu_time or 0
 
-        # Move start_time to beginning of interval of interest
-        while start_time < from_dt:
-            start_time += timedelta(minutes=1)
-
-        # Update user data for every interval of 15min during which the job ran
-        i = bisect.bisect_left(job_intervals, start_time)
+        # Update user data for every interval of 1min during which the job ran
         j = user2index[job.user]
-        while i < len(job_intervals) and job_intervals[i] < finish_time:
-            user_data = users_data[i][j]
-            user_data["jobs"] += 1 / runtime_min
-            user_data["cores"] += job.slots
-            user_data["memory"] += mem_gb
-            user_data["co2e"] += co2e / runtime_min
-            user_data["cost"] += cost / runtime_min
-            user_data["cputime"] += cpu_time / runtime_min
-            i += 1
+        first, last = intervals.span(start_time, finish_time, from_dt,
+                                     num_minutes)
+        counted_until = None
+        if job.finish_time is None and counted:
+            counted_until = counted.get(job.accession)
+
+        if runtime_min <= 0:
+            # Running job started at the last poll: nothing to add
+            pass
+        elif counted_until is None:
+            users_data.add(job.user, first, last, [
+                1 / runtime_min,
+                job.slots,
+                mem_gb,
+                co2e / runtime_min,
+                cost / runtime_min,
+                cpu_time / runtime_min,
+                1
+            ])
+        else:
+            users_data.add(job.user, first, last, [
+                0,
+                job.slots,
+                mem_gb,
+                co2e / runtime_min,
+                cost / runtime_min,
+                0,
+                1
+            ])
+
+            counted_min = (counted_until - start_time).total_seconds() / 60
+            if counted_min > 0:
+                first, last = intervals.span(start_time, counted_until,
+                                             from_dt, num_minutes)
+                users_data.add(job.user, first, last, [
+                    1 / counted_min, 0, 0, 0, 0, cpu_time / counted_min, 0
+                ])
 
         if job.submit_time >= from_dt:
             i = bisect.bisect_right(final_intervals, job.submit_time) - 1
             if i >= 0:
                 # Record job as submitted in this interval
-                users_extra_data[i][j]["submitted"] += 1
+                try:
+                    user_data = users_extra_data[(i, j)]
+                except KeyError:
+                    user_data = users_extra_data[(i, j)] = _new_user_extra()
+
+                user_data["submitted"] += 1
 
         if job.finish_time and finish_time < to_dt:
             # Record job as completed in this interval
@@ -307,7 +893,11 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
                 co2e, cost = const.calc_footprint(energy_kw, runtime / 3600,
                                                   job.start_time)
 
-                user_data = users_extra_data[i][j]
+                try:
+                    user_data = users_extra_data[(i, j)]
+                except KeyError:
+                    user_data = users_extra_data[(i, j)] = _new_user_extra()
+
                 job_data = jobs_data[i]
                 if job.ok:
                     user_data["done"] += 1
@@ -328,7 +918,9 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
                         else:
                             user_data["memeff"][4] += 1
 
-                    if cpu_eff < 20:
+                    if cpu_eff is None:
+                        pass
+                    elif cpu_eff < 20:
                         user_data["cpueff"][0] += 1
                     elif cpu_eff < 40:
                         user_data["cpueff"][1] += 1
@@ -345,8 +937,9 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
                         j = min(math.floor(mem_eff), 99)
                         job_data["done"]["memeff"]["dist"][j] += 1
 
-                    j = min(math.floor(cpu_eff), 99)
-                    job_data["done"]["cpueff"][j] += 1
+                    if cpu_eff is not None:
+                        j = min(math.floor(cpu_eff), 99)
+                        job_data["done"]["cpueff"][j] += 1
 
                     x = get_runtime_index(runtime)
                     job_data["done"]["runtimes"][x] += 1
@@ -378,40 +971,243 @@ def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
                         user_data["failed"]["memlim"] += 1
                         job_data["failed"]["memlim"] += 1
 
-    # Merge one-minute intervals data in 15-minute intervals
-    fd, output = mkstemp()
-    with open(fd, "wb") as fh:
-        users = sorted(user2index.keys(), key=lambda k: user2index[k])
+    return users_data, users_extra_data, jobs_data, num_jobs
+
+
+def _merge_intervals(final_intervals: list[datetime],
+                     users_data: intervals.Accumulator,
+                     users_extra_data: dict, jobs_data: list,
+                     user2index: dict[str, int]):
+    data = [{} for _ in final_intervals]
+    for uname in sorted(users_data, key=lambda k: user2index[k]):
+        j = user2index[uname]
+        values = users_data.totals(uname)
+        jobs, cores, memory, co2e, cost, cputime, running = values
+
+        for i in range(len(final_intervals)):
+            obj = None
+            for k in range(i * 15, min((i + 1) * 15, users_data.size)):
+                if not running[k]:
+                    continue
+                elif obj is None:
+                    obj = data[i][uname] = {
+                        "jobs": 0,
+                        "cores": 0,
+                        "memory": 0,
+                        "co2e": 0,
+                        "cost": 0,
+                        "cputime": 0
+                    }
+                    try:
+                        obj.update(users_extra_data[(i, j)])
+                    except KeyError:
+                        obj.update(_new_user_extra())
+
+                obj["jobs"] += jobs[k]
+                obj["cores"] = max(obj["cores"], cores[k])
+                obj["memory"] = max(obj["memory"], memory[k])
+                obj["co2e"] += co2e[k]
+                obj["cost"] += cost[k]
+                obj["cputime"] += cputime[k]
+
+    for i, dt in enumerate(final_intervals):
+        yield dt.strftime(DT_FMT), data[i], jobs_data[i]
+
+
+def process_updates(con: sqlite3.Connection, database: str,
+                    user2index: dict[str, int],
+                    encoding: str = "json") -> tuple[datetime, int]:
+    since = get_latest_update_time(con, "jobs")
+
+    jcon = jobdb.connect(database)
+    last_jobs_update = jobdb.get_latest_update_time(jcon)
+    if last_jobs_update is None:
+        # No job (e.g. new database): nothing updated
+        jcon.close()
+        return since, 0
+
+    jobs = list(jobdb.find_updated(jcon, since))
+    running = list(jobdb.find_running(jcon, since))
+    jcon.close()
+
+    # State of these jobs the last time usage was updated, and time at which
+    # running jobs were counted as a fraction of a job (see _update_ledger())
+    old_jobs = []
+    counted = {}
+    updated = {job.accession for job in jobs}
+    accessions = [job.accession for job in jobs + running]
+    for i in range(0, len(accessions), 500):
+        params = accessions[i:i + 500]
+        for data, in con.execute(
+            f"""
+            SELECT job
+            FROM ledger
+            WHERE id IN ({','.join('?' * len(params))})
+            """,
+            params
+        ):
+            values = json.loads(data)
+            job = Job.from_tuple(values)
+            if job.finish_time is None and len(values) > 20:
+                counted[job.accession] = datetime.strptime(values[20],
+                                                           DT_REPR)
+            if job.accession in updated:
+                old_jobs.append(job)
+
+    if jobs or (running and last_jobs_update > since):
+        # Running jobs not updated only ran from `since` to the last poll:
+        # they do not extend the interval before `since`. Their fraction of
+        # a job (the inverse of their runtime) is not updated until they
+        # change: it is the same in old and new states.
+        for job in running:
+            counted.setdefault(job.accession, since)
+
+        step = timedelta(minutes=15)
+        start_time = min([since] + [job.start_time
+                                    for job in jobs + old_jobs])
+        finish_time = max([last_jobs_update] +
+                          [job.finish_time for job in jobs if job.finish_time])
+        from_dt = _floor(start_time, step)
+        to_dt = _floor(finish_time, step) + step
+
+        new = _process(jobs + running, from_dt, to_dt, last_jobs_update,
+                       user2index,
+                       counted={job.accession: counted[job.accession]
+                                for job in running})
+        old = _process(old_jobs + running, from_dt, to_dt, since, user2index,
+                       counted=counted)
+        _apply_deltas(con, from_dt, to_dt, since, new, old, user2index,
+                      encoding)
+
+    _update_ledger(con, jobs, last_jobs_update)
+    con.commit()
+    return last_jobs_update, len(jobs)
+
+
+def _floor(dt: datetime, step: timedelta) -> datetime:
+    return dt - (dt - datetime(dt.year, dt.month, dt.day)) % step
+
+
+def _apply_deltas(con: sqlite3.Connection, from_dt: datetime,
+                  to_dt: datetime, since: datetime, new: tuple, old: tuple,
+                  user2index: dict[str, int], encoding: str):
+    new_users_data, new_extra_data, new_jobs_data, _ = new
+    old_users_data, old_extra_data, old_jobs_data, _ = old
+    final_intervals = list(range_dt(from_dt, to_dt, timedelta(minutes=15)))
+
+    # Before this minute, updated jobs already contributed to usage
+    watermark, _ = intervals.span(since, since, from_dt, new_users_data.size)
+
+    index2user = {i: login for login, i in user2index.items()}
+    rows = {}
+    for key, users_data, jobs_data in con.execute(
+        """
+        SELECT time, users_data, jobs_data
+        FROM usage
+        WHERE time >= ? AND time < ?
+        """,
+        [from_dt.strftime(DT_FMT), to_dt.strftime(DT_FMT)]
+    ):
+        rows[key] = (decode_users_data(users_data, index2user),
+                     decode_jobs_data(jobs_data))
+
+    changes = set()
+    for i, dt in enumerate(final_intervals):
+        if new_jobs_data[i] != old_jobs_data[i]:
+            key = dt.strftime(DT_FMT)
+            users_data, jobs_data = rows.setdefault(key, ({},
+                                                          _new_jobs_data()))
+            _add(jobs_data, new_jobs_data[i], 1)
+            _add(jobs_data, old_jobs_data[i], -1)
+            changes.add(key)
+
+    for uname in set(new_users_data) | set(old_users_data):
+        j = user2index[uname]
+        new_values = new_users_data.totals(uname)
+        old_values = old_users_data.totals(uname)
 
         for i, dt in enumerate(final_intervals):
-            _data = {}
-            for interval_data in users_data[i * 15:(i + 1) * 15]:
-                for j, values in enumerate(interval_data):
-                    if values["jobs"] == 0:
-                        continue
+            key = dt.strftime(DT_FMT)
+            minutes = range(i * 15, min((i + 1) * 15, new_users_data.size))
+            new_running = [k for k in minutes if new_values[6][k]]
+            old_running = [k for k in minutes if old_values[6][k]]
+
+            extra = _new_user_extra()
+            if (i, j) in new_extra_data:
+                _add(extra, new_extra_data[(i, j)], 1)
+            if (i, j) in old_extra_data:
+                _add(extra, old_extra_data[(i, j)], -1)
+
+            if (not new_running and not old_running
+                    and extra == _new_user_extra()):
+                continue
+
+            users_data, jobs_data = rows.setdefault(key, ({},
+                                                          _new_jobs_data()))
+            try:
+                obj = users_data[uname]
+            except KeyError:
+                if not new_running:
+                    # Like process_jobs(), ignore users without running jobs
+                    continue
+
+                obj = users_data[uname] = _new_user_data()
+
+            for name, m in [("jobs", 0), ("co2e", 3), ("cost", 4),
+                            ("cputime", 5)]:
+                obj[name] += (sum(new_values[m][k] for k in new_running)
+                              - sum(old_values[m][k] for k in old_running))
+
+            # Peak usage can only be updated from per-minute values.
+            # Before the watermark, it is shifted by the largest change;
+            # after it, only updated jobs contribute.
+            for name, m in [("cores", 1), ("memory", 2)]:
+                before = [new_values[m][k] - old_values[m][k]
+                          for k in minutes if k < watermark]
+                after = [new_values[m][k] for k in new_running
+                         if k >= watermark]
+                peak = obj[name] + max(before) if before else obj[name]
+                obj[name] = max([0, peak] + after)
+
+            _add(obj, extra, 1)
+            changes.add(key)
+
+    _write_usage(con, encode_intervals(((key, *rows[key])
+                                        for key in sorted(changes)),
+                                       user2index, encoding))
+
+
+def _add(obj: dict, other: dict, sign: int):
+    for key, value in other.items():
+        if isinstance(value, dict):
+            _add(obj[key], value, sign)
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                obj[key][i] += sign * v
+        else:
+            obj[key] += sign * value
 
-                    uname = users[j]
 
-                    try:
-                        obj = _data[uname]
-                    except KeyError:
-                        obj = _data[uname] = {k: 0 for k in values}
-                        obj.update(users_extra_data[i][j])
-
-                    obj["jobs"] += values["jobs"]
-                    obj["cores"] = max(obj["cores"], values["cores"])
-                    obj["memory"] = max(obj["memory"], values["memory"])
-                    obj["co2e"] += values["co2e"]
-                    obj["cost"] += values["cost"]
-                    obj["cputime"] += values["cputime"]
-
-            pickle.dump((
-                dt.strftime(DT_FMT),
-                _data,
-                jobs_data[i]
-            ), fh)
+def write_intervals(intervals, transport: str, user2index: dict[str, int],
+                    encoding: str = "json") -> str | list[tuple]:
+    # Rows in their final encoding
+    rows = encode_intervals(intervals, user2index, encoding)
+    if transport == "file":
+        return dump_intervals(rows)
+    elif transport == "pipe":
+        # Returned to the parent process
+        return list(rows)
 
-    return output, num_jobs
+    raise ValueError(transport)
+
+
+def dump_intervals(intervals) -> str:
+    fd, output = mkstemp()
+    with open(fd, "wb") as fh:
+        for interval in intervals:
+            pickle.dump(interval, fh)
+
+    return output
 
 
 def get_runtime_index(runtime: int | float) -> int:
@@ -423,8 +1219,12 @@ def get_runtime_index(runtime: int | float) -> int:
 
 
 def calc_footprint(job: Job) -> tuple[float, float]:
-    cpu_eff = min(job.cpu_efficiency, 100)
-    cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+    if job.cpu_efficiency is not None:
+        cpu_eff = min(job.cpu_efficiency, 100)
+        cores_power = job.slots * (cpu_eff / 100) * const.CPU_POWER
+    else:
+        # Unknown CPU efficiency: assume all cores are used
+        cores_power = job.slots * const.CPU_POWER
     if "gpu" in job.queue:
         # Unknown GPU number and GPU efficiency: assume 1
         cores_power += 1 * 1 * const.GPU_POWER
@@ -0,0 +1,554 @@
+import logging
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+
+from . import const, jobdb
+from .archive import Archive, to_seconds
+from .model import is_done
+from .usagedb import DT_FMT, RUNTIMES, range_dt, write_intervals
+
+
+# Number of users whose per-minute arrays are held in memory at once
+USERS_BLOCK = 256
+
+# Per-minute metrics, summed over one-minute intervals
+SUMS = ["jobs", "co2e", "cost", "cputime"]
+
+
+def load_jobs(database: str, from_dt: datetime, to_dt: datetime,
+              archive_dir: str | None = None,
+              submitted: tuple[datetime, datetime] | None = None
+              ) -> dict[str, np.ndarray]:
+    if not archive_dir:
+        return to_arrays(jobdb.find_rows(database, from_dt, to_dt,
+                                         submitted=submitted))
+
+    archive = Archive(archive_dir)
+    archived = archive.load(from_dt, to_dt, submitted=submitted)
+    jobs = to_arrays(jobdb.find_rows(database, from_dt, to_dt,
+                                     finished_since=archive.until,
+                                     submitted=submitted))
+    return {key: np.concatenate([archived[key], values])
+            for key, values in jobs.items()}
+
+
+def iter_batches(database: str, from_dt: datetime, to_dt: datetime,
+                 size: int, archive_dir: str | None = None):
+    if archive_dir:
+        archive = Archive(archive_dir)
+        # One batch per archived day
+        yield from archive.iter_days(from_dt, to_dt)
+        finished_since = archive.until
+    else:
+        finished_since = None
+
+    rows = jobdb.find_rows(database, from_dt, to_dt,
+                           finished_since=finished_since)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            break
+
+        yield to_arrays(batch)
+
+
+def to_arrays(rows) -> dict[str, np.ndarray]:
+    columns = {
+        "scheduler": [],
+        "status": [],
+        "user": [],
+        "queue": [],
+        "slots": [],
+        "cpu_efficiency": [],
+        "cpu_time": [],
+        "mem_lim": [],
+        "mem_max": [],
+        "mem_efficiency": [],
+        "submit_time": [],
+        "start_time": [],
+        "finish_time": []
+    }
+    indices = [1, 5, 6, 7, 8, 9, 10, 11, 12, 13, 16, 17, 18]
+
+    for row in rows:
+        for key, i in zip(columns, indices):
+            columns[key].append(row[i])
+
+    arrays = {}
+    for key in ["scheduler", "status", "user", "queue"]:
+        arrays[key] = np.array(columns[key], dtype=object)
+
+    arrays["slots"] = np.array(columns["slots"], dtype=np.int64)
+    for key in ["cpu_efficiency", "cpu_time", "mem_lim", "mem_max",
+                "mem_efficiency"]:
+        # None -> NaN
+        arrays[key] = np.array(columns[key], dtype=np.float64)
+
+    for key in ["submit_time", "start_time", "finish_time"]:
+        arrays[key] = to_seconds(columns[key])
+
+    return arrays
+
+
+def calc_footprint(energy_kw: np.ndarray, runtime_h: np.ndarray,
+                   start_time: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    carb_int = np.where(start_time >= to_seconds(datetime(2023, 1, 1)),
+                        const.CARBON_INTENSITY_2023,
+                        const.CARBON_INTENSITY)
+    energy_needed = runtime_h * energy_kw * const.PUE
+    carbon_footprint = energy_needed * carb_int
+    energy_cost = energy_needed * const.ENERGY_COST
+    return carbon_footprint, energy_cost
+
+
+def calc_usage(jobs: dict[str, np.ndarray], from_ts: np.ndarray,
+               to_ts: np.ndarray, last_jobs_update: datetime,
+               num_minutes: int,
+               window_end_ts: np.ndarray | None = None
+               ) -> dict[str, np.ndarray]:
+    cpu_eff = np.minimum(jobs["cpu_efficiency"], 100)
+    # Unknown CPU efficiency (NaN): assume all cores are used
+    cores_power = (jobs["slots"] * (np.nan_to_num(cpu_eff, nan=100) / 100)
+                   * const.CPU_POWER)
+    is_gpu = np.array(["gpu" in q for q in jobs["queue"]], dtype=bool)
+    # Unknown GPU number and GPU efficiency: assume 1
+    cores_power[is_gpu] += 1 * 1 * const.GPU_POWER
+
+    # Same logic as Job.fix_mem()
+    mem_max = jobs["mem_max"]
+    mem_eff = jobs["mem_efficiency"]
+    fixable = ~np.isnan(mem_max) & ~np.isnan(mem_eff) & (mem_eff != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mem_lim = np.where(fixable, 100.0 / mem_eff * mem_max,
+                           jobs["mem_lim"])
+    mem_eff = np.where(fixable | ~np.isnan(jobs["mem_lim"]),
+                       np.minimum(mem_eff, 100), np.nan)
+
+    # (mem_lim or mem_max or 0)
+    mem_mb = np.where(np.isnan(mem_max), 0, mem_max)
+    has_lim = ~np.isnan(mem_lim) & (mem_lim != 0)
+    mem_mb = np.where(has_lim, mem_lim, mem_mb)
+    mem_gb = mem_mb / 1024
+    mem_power = mem_gb * const.MEM_POWER
+
+    start_time = jobs["start_time"]
+    finished = jobs["finish_time"] >= 0
+    finish_time = jobs["finish_time"].copy()
+    finish_time[~finished] = min(to_seconds(last_jobs_update),
+                                 to_ts if window_end_ts is None
+                                 else window_end_ts)
+    # One minute or less
+    finish_time[finished & (start_time == finish_time)] += 60
+
+    # Runtime of the job
+    runtime_min = (finish_time - start_time) / 60
+    energy_kw = (cores_power + mem_power) / 1000
+    co2e, cost = calc_footprint(energy_kw, runtime_min / 60, start_time)
+    cpu_time = np.nan_to_num(jobs["cpu_time"], nan=0)
+
+    # First and last (exclusive) one-minute intervals during which jobs ran
+    delay = np.maximum(from_ts - start_time, 0)
+    first_time = start_time + -(-delay // 60) * 60
+    first = np.minimum(-(-(first_time - from_ts) // 60), num_minutes)
+    last = np.minimum(np.maximum(-(-(finish_time - from_ts) // 60), first),
+                      num_minutes)
+
+    return {
+        "cpu_eff": cpu_eff,
+        "cores_power": cores_power,
+        "mem_lim": mem_lim,
+        "mem_max": mem_max,
+        "mem_eff": mem_eff,
+        "mem_gb": mem_gb,
+        "finished": finished,
+        "finish_time": finish_time,
+        "runtime_min": runtime_min,
+        "energy_kw": energy_kw,
+        "co2e": co2e,
+        "cost": cost,
+        "cpu_time": cpu_time,
+        "first": first,
+        "last": last
+    }
+
+
+def process_jobs(database: str, from_dt: datetime, to_dt: datetime,
+                 user2index: dict[str, int], archive_dir: str | None = None,
+                 transport: str = "file",
+                 window: tuple[datetime, datetime] | None = None,
+                 encoding: str = "json") -> tuple[str | list[tuple], int]:
+    con = jobdb.connect(database)
+    # See usagedb.process_jobs()
+    last_jobs_update = jobdb.get_latest_update_time(con) or to_dt
+    con.close()
+
+    label = f"{from_dt:%Y-%m-%d} - {to_dt:%Y-%m-%d}"
+    if window and window[0] < from_dt:
+        # See usagedb.process_jobs()
+        jobs = load_jobs(database, from_dt - timedelta(minutes=1), to_dt,
+                         archive_dir)
+    else:
+        jobs = load_jobs(database, from_dt, to_dt, archive_dir)
+
+    num_jobs = len(jobs["slots"])
+    logging.debug(f"{label}: {num_jobs:>20,}")
+
+    from_ts = to_seconds(from_dt)
+    to_ts = to_seconds(to_dt)
+    if window and window[1] > to_dt:
+        # See usagedb._find_later_jobs()
+        later = load_jobs(database, to_dt, window[1], archive_dir,
+                          submitted=(from_dt, to_dt))
+        mask = later["start_time"] >= to_ts
+        jobs = {key: np.concatenate([values, later[key][mask]])
+                for key, values in jobs.items()}
+        window_end_ts = to_seconds(window[1])
+    else:
+        window_end_ts = None
+
+    num_minutes = len(list(range_dt(from_dt, to_dt, timedelta(minutes=1))))
+    final_intervals = list(range_dt(from_dt, to_dt, timedelta(minutes=15)))
+    num_intervals = len(final_intervals)
+
+    usage = calc_usage(jobs, from_ts, to_ts, last_jobs_update, num_minutes,
+                       window_end_ts)
+    cpu_eff = usage["cpu_eff"]
+    cores_power = usage["cores_power"]
+    mem_lim = usage["mem_lim"]
+    mem_max = usage["mem_max"]
+    mem_eff = usage["mem_eff"]
+    mem_gb = usage["mem_gb"]
+    start_time = jobs["start_time"]
+    finished = usage["finished"]
+    finish_time = usage["finish_time"]
+    runtime_min = usage["runtime_min"]
+    energy_kw = usage["energy_kw"]
+    first = usage["first"]
+    last = usage["last"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.stack([1 / runtime_min,
+                          usage["co2e"] / runtime_min,
+                          usage["cost"] / runtime_min,
+                          usage["cpu_time"] / runtime_min], axis=1)
+
+    users, user_idx = np.unique(jobs["user"].astype(str),
+                                return_inverse=True)
+    user_idx = user_idx.ravel()
+    unknown = set(users.tolist()) - user2index.keys()
+    if unknown:
+        raise KeyError(", ".join(sorted(unknown)))
+
+    # Events recorded in 15-minute intervals
+    extra = np.zeros((num_intervals, len(users), 14), dtype=np.int64)
+
+    submitted = jobs["submit_time"] >= from_ts
+    i = np.minimum((jobs["submit_time"] - from_ts) // 900, num_intervals - 1)
+    np.add.at(extra, (i[submitted], user_idx[submitted], 0), 1)
+
+    completed = finished & (finish_time < to_ts) & (finish_time >= from_ts)
+    ok = check_done(jobs, completed)
+
+    interval = (finish_time - from_ts) // 900
+    done = completed & ok
+    failed = completed & ~ok
+
+    # Footprint of entire job
+    runtime = (finish_time - start_time).astype(np.float64)
+    job_co2e, job_cost = calc_footprint(energy_kw, runtime / 3600,
+                                        start_time)
+
+    use_mem_eff = (done & ~np.isnan(mem_eff) & ~np.isnan(mem_lim)
+                   & (mem_lim >= const.MIN_MEM_REQ))
+    mem_bins = ((mem_eff >= 20).astype(np.int64) + (mem_eff >= 40)
+                + (mem_eff >= 60) + (mem_eff >= 80))
+    cpu_bins = ((cpu_eff >= 20).astype(np.int64) + (cpu_eff >= 40)
+                + (cpu_eff >= 60) + (cpu_eff >= 80))
+
+    np.add.at(extra, (interval[done], user_idx[done], 1), 1)
+    np.add.at(extra, (interval[use_mem_eff], user_idx[use_mem_eff],
+                      4 + mem_bins[use_mem_eff]), 1)
+    cpu_known = done & ~np.isnan(cpu_eff)
+    np.add.at(extra, (interval[cpu_known], user_idx[cpu_known],
+                      9 + cpu_bins[cpu_known]), 1)
+
+    over_lim = (failed & ~np.isnan(mem_max) & ~np.isnan(mem_lim)
+                & (mem_max > mem_lim))
+    np.add.at(extra, (interval[failed], user_idx[failed], 2), 1)
+    np.add.at(extra, (interval[over_lim], user_idx[over_lim], 3), 1)
+
+    jobs_data = _count_jobs(num_intervals, interval, done, failed,
+                            use_mem_eff, over_lim, runtime, cpu_eff, mem_eff,
+                            mem_gb, cores_power, start_time, job_co2e,
+                            job_cost)
+
+    # Per-user data in 15-minute intervals
+    users_data = [{} for _ in final_intervals]
+    running = last > first
+    for lo in range(0, len(users), USERS_BLOCK):
+        hi = min(lo + USERS_BLOCK, len(users))
+        mask = running & (user_idx >= lo) & (user_idx < hi)
+        _accumulate(users_data, users[lo:hi], extra[:, lo:hi],
+                    user_idx[mask] - lo, first[mask], last[mask],
+                    rates[mask], jobs["slots"][mask], mem_gb[mask],
+                    num_minutes)
+
+    intervals = ((dt.strftime(DT_FMT), users_data[i], jobs_data[i])
+                 for i, dt in enumerate(final_intervals))
+    return (write_intervals(intervals, transport, user2index, encoding),
+            num_jobs)
+
+
+def report_jobs(database: str, from_dt: datetime, to_dt: datetime,
+                batch_size: int = 1000000,
+                archive_dir: str | None = None) -> tuple[dict[str, dict], int]:
+    con = jobdb.connect(database)
+    # See usagedb.process_jobs()
+    last_jobs_update = jobdb.get_latest_update_time(con) or to_dt
+    con.close()
+
+    from_ts = to_seconds(from_dt)
+    to_ts = to_seconds(to_dt)
+    num_minutes = len(list(range_dt(from_dt, to_dt, timedelta(minutes=1))))
+
+    # Users in order of their first job
+    user2index = {}
+    counts = np.zeros((0, 3), dtype=np.int64)
+    memory = np.zeros((0, 100), dtype=np.int64)
+    footprints = np.zeros((0, 3))
+
+    num_jobs = 0
+    for jobs in iter_batches(database, from_dt, to_dt, batch_size,
+                             archive_dir):
+        num_jobs += len(jobs["slots"])
+        logging.debug(f"{num_jobs:>20,}")
+
+        user_idx = np.array([user2index.setdefault(uname, len(user2index))
+                             for uname in jobs["user"]], dtype=np.int64)
+        num_users = len(user2index)
+        if num_users > len(counts):
+            n = num_users - len(counts)
+            counts = np.concatenate([counts, np.zeros((n, 3), np.int64)])
+            memory = np.concatenate([memory, np.zeros((n, 100), np.int64)])
+            footprints = np.concatenate([footprints, np.zeros((n, 3))])
+
+        usage = calc_usage(jobs, from_ts, to_ts, last_jobs_update,
+                           num_minutes)
+        finished = usage["finished"]
+        ok = check_done(jobs, finished)
+        done = finished & ok
+        failed = finished & ~ok
+
+        mem_eff = usage["mem_eff"]
+        mem_lim = usage["mem_lim"]
+        use_mem_eff = (done & ~np.isnan(mem_eff) & ~np.isnan(mem_lim)
+                       & (mem_lim >= const.MIN_MEM_REQ))
+        bins = np.minimum(np.floor(mem_eff[use_mem_eff]), 99)
+
+        np.add.at(counts, (user_idx, 0), 1)
+        np.add.at(counts, (user_idx[done], 1), 1)
+        np.add.at(counts, (user_idx[failed], 2), 1)
+        np.add.at(memory, (user_idx[use_mem_eff], bins.astype(np.int64)), 1)
+
+        # Minutes during which jobs ran within the interval, counted from
+        # their start as intervals.count()
+        start_time = jobs["start_time"]
+        first = np.maximum(-((from_ts - start_time) // -60), 0)
+        last = -((np.minimum(usage["finish_time"], to_ts) - start_time)
+                 // -60)
+        minutes = np.maximum(last - first, 0)
+        runtime_min = usage["runtime_min"]
+        # Running jobs started after the last poll have no runtime
+        has_runtime = runtime_min > 0
+        share = np.zeros(len(minutes))
+        np.divide(minutes, runtime_min, out=share, where=has_runtime)
+        np.add.at(footprints, (user_idx, 0), usage["co2e"] * share)
+        np.add.at(footprints, (user_idx, 1), usage["cost"] * share)
+        np.add.at(footprints, (user_idx, 2), usage["cpu_time"])
+
+    user_data = {}
+    for uname, i in user2index.items():
+        total, done, failed = counts[i].tolist()
+        co2e, cost, cputime = footprints[i].tolist()
+        user_data[uname] = {
+            "jobs": {
+                "total": total,
+                "done": done,
+                "exit": failed
+            },
+            "co2e": co2e,
+            "cost": cost,
+            "memory": memory[i].tolist(),
+            "cputime": cputime,
+            "rank": None,
+            "totalCo2e": 0
+        }
+
+    return user_data, num_jobs
+
+
+def check_done(jobs: dict[str, np.ndarray], mask: np.ndarray) -> np.ndarray:
+    ok = np.zeros(len(mask), dtype=bool)
+    statuses = {}
+    for k in np.flatnonzero(mask):
+        key = jobs["scheduler"][k], jobs["status"][k]
+        try:
+            ok[k] = statuses[key]
+        except KeyError:
+            ok[k] = statuses[key] = is_done(*key)
+
+    return ok
+
+
+def _accumulate(users_data: list[dict], users: np.ndarray, extra: np.ndarray,
+                user_idx: np.ndarray, first: np.ndarray, last: np.ndarray,
+                rates: np.ndarray, slots: np.ndarray, mem_gb: np.ndarray,
+                num_minutes: int):
+    num_users = len(users)
+
+    # Range-add on difference arrays, then prefix sums
+    sums = np.zeros((num_minutes + 1, num_users, len(SUMS)))
+    np.add.at(sums, (first, user_idx), rates)
+    np.add.at(sums, (last, user_idx), -rates)
+    np.cumsum(sums, axis=0, out=sums)
+
+    cores = np.zeros((num_minutes + 1, num_users), dtype=np.int64)
+    np.add.at(cores, (first, user_idx), slots)
+    np.add.at(cores, (last, user_idx), -slots)
+    np.cumsum(cores, axis=0, out=cores)
+
+    memory = np.zeros((num_minutes + 1, num_users))
+    np.add.at(memory, (first, user_idx), mem_gb)
+    np.add.at(memory, (last, user_idx), -mem_gb)
+    np.cumsum(memory, axis=0, out=memory)
+
+    # Number of running jobs, to skip idle minutes
+    count = np.zeros((num_minutes + 1, num_users), dtype=np.int64)
+    np.add.at(count, (first, user_idx), 1)
+    np.add.at(count, (last, user_idx), -1)
+    np.cumsum(count, axis=0, out=count)
+
+    # Pad to a whole number of 15-minute intervals
+    num_intervals = len(users_data)
+    padding = num_intervals * 15 - num_minutes
+    sums = _reshape(sums[:-1], padding)
+    cores = _reshape(cores[:-1], padding)
+    memory = _reshape(memory[:-1], padding)
+    active = _reshape(count[:-1], padding) > 0
+
+    sums = np.where(active[..., None], sums, 0).sum(axis=1)
+    cores = np.where(active, cores, 0).max(axis=1)
+    memory = np.where(active, memory, 0).max(axis=1)
+    active = active.any(axis=1)
+
+    for i, j in zip(*np.nonzero(active)):
+        values = extra[i, j].tolist()
+        users_data[i][str(users[j])] = {
+            "jobs": float(sums[i, j, 0]),
+            "cores": int(cores[i, j]),
+            "memory": float(memory[i, j]) if memory[i, j] > 0 else 0,
+            "co2e": float(sums[i, j, 1]),
+            "cost": float(sums[i, j, 2]),
+            "cputime": float(sums[i, j, 3]),
+            "submitted": values[0],
+            "done": values[1],
+            "failed": {
+                "total": values[2],
+                "memlim": values[3]
+            },
+            "memeff": values[4:9],
+            "cpueff": values[9:14],
+        }
+
+
+def _reshape(values: np.ndarray, padding: int) -> np.ndarray:
+    if padding:
+        shape = (padding,) + values.shape[1:]
+        values = np.concatenate([values, np.zeros(shape, values.dtype)])
+
+    return values.reshape((-1, 15) + values.shape[1:])
+
+
+def _count_jobs(num_intervals: int, interval: np.ndarray, done: np.ndarray,
+                failed: np.ndarray, use_mem_eff: np.ndarray,
+                over_lim: np.ndarray, runtime: np.ndarray,
+                cpu_eff: np.ndarray, mem_eff: np.ndarray, mem_gb: np.ndarray,
+                cores_power: np.ndarray, start_time: np.ndarray,
+                co2e: np.ndarray, cost: np.ndarray) -> list[dict]:
+    def total(mask: np.ndarray, values=None) -> np.ndarray:
+        arr = np.zeros(num_intervals,
+                       dtype=np.int64 if values is None else np.float64)
+        np.add.at(arr, interval[mask], 1 if values is None else values[mask])
+        return arr
+
+    def histogram(mask: np.ndarray, bins: np.ndarray,
+                  size: int) -> np.ndarray:
+        arr = np.zeros((num_intervals, size), dtype=np.int64)
+        np.add.at(arr, (interval[mask], bins[mask]), 1)
+        return arr
+
+    # Footprint of entire job with good memory efficiency
+    # (Mem needed + 10%)
+    opti_mem = (mem_gb * mem_eff / 100) * 1.1
+    mem_power = opti_mem * const.MEM_POWER
+    energy_kw = (cores_power + mem_power) / 1000
+    opti_co2e, opti_cost = calc_footprint(energy_kw, runtime / 3600,
+                                          start_time)
+
+    long = failed & (runtime >= 3600)
+    runtime_idx = np.searchsorted(RUNTIMES, runtime[done], side="left")
+    runtimes = np.zeros((num_intervals, len(RUNTIMES) + 1), dtype=np.int64)
+    np.add.at(runtimes, (interval[done], runtime_idx), 1)
+
+    cpu_bins = np.minimum(np.floor(np.nan_to_num(cpu_eff)), 99)
+    mem_bins = np.minimum(np.floor(np.nan_to_num(mem_eff)), 99)
+
+    done_total = total(done)
+    done_co2e = total(done, co2e)
+    cpueff = histogram(done & ~np.isnan(cpu_eff), cpu_bins.astype(np.int64),
+                       100)
+    memeff = histogram(use_mem_eff, mem_bins.astype(np.int64), 100)
+    memeff_total = total(use_mem_eff)
+    memeff_co2e = total(use_mem_eff, co2e - opti_co2e)
+    memeff_cost = total(use_mem_eff, cost - opti_cost)
+    failed_total = total(failed)
+    failed_co2e = total(failed, co2e)
+    failed_cost = total(failed, cost)
+    memlim = total(over_lim)
+    long_total = total(long)
+    long_co2e = total(long, co2e)
+
+    jobs_data = []
+    for i in range(num_intervals):
+        jobs_data.append({
+            "done": {
+                "total": int(done_total[i]),
+                "co2e": _number(done_co2e[i], done_total[i]),
+                "runtimes": runtimes[i].tolist(),
+                "cpueff": cpueff[i].tolist(),
+                "memeff": {
+                    "dist": memeff[i].tolist(),
+                    "co2e": _number(memeff_co2e[i], memeff_total[i]),
+                    "cost": _number(memeff_cost[i], memeff_total[i])
+                },
+            },
+            "failed": {
+                "total": int(failed_total[i]),
+                "co2e": _number(failed_co2e[i], failed_total[i]),
+                "cost": _number(failed_cost[i], failed_total[i]),
+                "memlim": int(memlim[i]),
+                "more1h": {
+                    "total": int(long_total[i]),
+                    "co2e": _number(long_co2e[i], long_total[i])
+                },
+            }
+        })
+
+    return jobs_data
+
+
+def _number(value: np.float64, count: np.int64) -> int | float:
+    # Keep integer zeros for empty intervals, like process_jobs()
+    return float(value) if count else 0
@@ -0,0 +1,75 @@
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from itertools import islice
+
+from ebihpc import jobdb
+from ebihpc import lsf
+from ebihpc.model import UnixUser
+
+
+def main():
+    parser = ArgumentParser(description="Load finished jobs from LSF "
+                                        "accounting files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing files, default: 1")
+    parser.add_argument("--batch-size", type=int, default=100000,
+                        help="number of jobs written at once, "
+                             "default: 100000")
+    parser.add_argument("--cluster",
+                        help="name of the cluster, as in the clusters file "
+                             "of track-jobs.py")
+    parser.add_argument("database", help="job database")
+    parser.add_argument("files", nargs="+",
+                        help="accounting files (lsb.acct, lsb.acct.1, "
+                             "lsb.acct.2.gz, ...)")
+    args = parser.parse_args()
+
+    # Oldest first: lsb.acct.N is older than lsb.acct.1, older than lsb.acct
+    files = sorted(args.files, key=get_rotation, reverse=True)
+
+    con = jobdb.connect(args.database)
+    users = jobdb.get_users(con)
+
+    start = time.monotonic()
+    num_jobs = num_inserted = 0
+    jobs = lsf.iter_acct_jobs(files, args.workers)
+    while True:
+        batch = list(islice(jobs, args.batch_size))
+        if not batch:
+            break
+
+        # Archived days with these jobs are written again (archive-jobs.py)
+        update_time = datetime.now()
+        new_users = {}
+        for job in batch:
+            job.update_time = update_time
+            job.cluster = args.cluster
+
+            if job.user not in users and job.user not in new_users:
+                user = new_users[job.user] = UnixUser(job.user)
+                user.init()
+
+        num_inserted += jobdb.insert_jobs(con, batch)
+        # Former users may no longer have a Unix account
+        jobdb.update_users(con, [user for user in new_users.values()
+                                 if user.group is not None])
+        users.update(new_users)
+
+        num_jobs += len(batch)
+        elapsed = time.monotonic() - start
+        sys.stderr.write(f"{num_jobs:,} jobs read, {num_inserted:,} inserted "
+                         f"({num_jobs / elapsed:,.0f} jobs/s)\n")
+
+    con.close()
+
+
+def get_rotation(path: str) -> int:
+    m = re.search(r"\.(\d+)(?:\.gz)?$", path)
+    return int(m.group(1)) if m else 0
+
+
+if __name__ == "__main__":
+    main()
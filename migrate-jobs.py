@@ -0,0 +1,45 @@
+import sys
+from argparse import ArgumentParser
+
+from ebihpc import jobdb
+from ebihpc import usagedb
+
+
+def main():
+    parser = ArgumentParser(description="Migrate a job database to the "
+                                        "current schema")
+    parser.add_argument("--batch-size", type=int, default=100000,
+                        help="number of jobs copied per transaction, "
+                             "default: 100000")
+    parser.add_argument("--cluster",
+                        help="name jobs tracked without cluster after this "
+                             "cluster of the clusters file of track-jobs.py")
+    parser.add_argument("--usage", metavar="DATABASE",
+                        help="usage database whose ledger is renamed as well "
+                             "(with --cluster)")
+    parser.add_argument("database", help="job database")
+    args = parser.parse_args()
+
+    if args.usage and not args.cluster:
+        parser.error("--usage requires --cluster")
+    elif args.cluster is not None and (not args.cluster or "@" in args.cluster):
+        parser.error(f"invalid cluster name: {args.cluster!r}")
+
+    for copied, total in jobdb.migrate(args.database, args.batch_size):
+        sys.stderr.write(f"{copied:,}/{total:,} jobs migrated\n")
+
+    if args.cluster:
+        for table, done, total in jobdb.name_cluster(args.database,
+                                                     args.cluster,
+                                                     args.batch_size):
+            sys.stderr.write(f"{table}: {done:,}/{total:,} jobs renamed\n")
+
+    if args.usage:
+        con = usagedb.connect(args.usage)
+        num_jobs = usagedb.name_cluster(con, args.cluster)
+        con.close()
+        sys.stderr.write(f"ledger: {num_jobs:,} jobs renamed\n")
+
+
+if __name__ == "__main__":
+    main()
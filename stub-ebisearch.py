@@ -0,0 +1,86 @@
+import hashlib
+import json
+import re
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def main():
+    parser = ArgumentParser(description="Serve users metadata like EBI Search, "
+                                        "for testing")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="default: 8000")
+    parser.add_argument("users", help="users JSON file (see custom-users.py)")
+    args = parser.parse_args()
+
+    with open(args.users, "rt") as fh:
+        users = json.load(fh)
+
+    handler = type("Handler", (StubHandler,), {"users": users})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Serving on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    users = {}
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        query = params.get("query", [""])[0]
+        start = int(params.get("start", ["0"])[0])
+        size = int(params.get("size", ["15"])[0])
+
+        # Free text (a login) or OR-ed email terms
+        emails = re.findall(r'email:"([^"]+)@ebi\.ac\.uk"', query)
+        logins = emails if emails else [query]
+
+        entries = []
+        for login in logins:
+            try:
+                meta = self.users[login]
+            except KeyError:
+                continue
+
+            teams = meta.get("teams") or [""]
+            entries.append({
+                "fields": {
+                    "email": [f"{login}@ebi.ac.uk"],
+                    "full_name": [meta["name"]] if meta.get("name") else [],
+                    "photo": ([meta["photo_url"]]
+                              if meta.get("photo_url") else []),
+                    "positions": [f"{meta.get('position') or ''}|{team}"
+                                  for team in teams]
+                }
+            })
+
+        payload = json.dumps({
+            "hitCount": len(entries),
+            "entries": entries[start:start + size]
+        }).encode("utf-8")
+        etag = f'"{hashlib.md5(payload).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import importlib.util
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ebihpc.model import Job  # noqa: E402
+
+
+DATA_DIR = os.path.join(ROOT, "tests", "data")
+
+
+def load_script(name: str):
+    # Scripts are not importable by name (e.g. create-report.py)
+    path = os.path.join(ROOT, name)
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(name)[0].replace("-", "_"), path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_job(**kwargs) -> Job:
+    values = dict(
+        scheduler="lsf",
+        id=1,
+        index=0,
+        name="job",
+        status="done",
+        user="alice",
+        queue="standard",
+        slots=1,
+        cpu_efficiency=50,
+        mem_lim=4096,
+        mem_max=1024,
+        mem_efficiency=25,
+        from_host="login",
+        exec_host="node",
+        submit_time=datetime(2024, 3, 1),
+        start_time=datetime(2024, 3, 1),
+        finish_time=datetime(2024, 3, 1, 1),
+        cpu_time=1800,
+        update_time=datetime(2024, 3, 2),
+    )
+    values.update(kwargs)
+    return Job(**values)
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    return str(tmp_path / "jobs.db")
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import subprocess as sp
+import sys
+
+import pytest
+
+from ebihpc import lsf
+
+from conftest import DATA_DIR, ROOT, load_script
+
+
+ACCT_DIR = os.path.join(DATA_DIR, "lsf")
+# Oldest first
+FILES = [os.path.join(ACCT_DIR, name)
+         for name in ["lsb.acct.2.gz", "lsb.acct.1", "lsb.acct"]]
+
+
+def test_split_acct():
+    assert lsf._split_acct('"A" 1 "b c" "" 2\n') == ["A", "1", "b c", "", "2"]
+    assert lsf._split_acct('"say ""hi""" 3') == ['say "hi"', "3"]
+    assert lsf._split_acct('"""" x') == ['"', "x"]
+
+
+def test_read_acct_multiline():
+    path = os.path.join(ACCT_DIR, "lsb.acct")
+    records = list(lsf.read_acct(path))
+    assert len(records) == 43
+    assert [fields[0] for _, fields in records].count("JOB_FINISH") == 40
+
+    offset, fields = records[0]
+    assert offset == 0
+    assert fields[3] == "1071"
+    assert 'multi\nline "cmd"\n' in fields
+
+    # The next record starts after the lines of the command
+    with open(path, "rb") as fh:
+        fh.seek(records[1][0])
+        assert fh.read(12) == b'"JOB_FINISH"'
+
+    job = lsf.parse_acct_record(fields)
+    assert job.id == 1071
+    assert job.name == "job 1071"
+    assert job.exec_host == "2*node2:node3"
+    assert job.cpu_time is None
+    assert job.cpu_efficiency is None
+
+
+def test_rotated_files():
+    load_acct = load_script("load-acct.py")
+    shuffled = [FILES[1], FILES[2], FILES[0]]
+    assert sorted(shuffled, key=load_acct.get_rotation,
+                  reverse=True) == FILES
+
+    jobs = list(lsf.iter_acct_jobs(FILES))
+    assert len(jobs) == 110
+    # Gzipped file (oldest) first
+    assert [job.id for job in jobs[:30]] == list(range(1001, 1031))
+    assert len({job.accession for job in jobs}) == 110
+
+
+@pytest.mark.parametrize("chunk_size", [512, 4096])
+def test_chunks(chunk_size):
+    # Jobs without update time (set when loaded)
+    expected = [job.to_tuple()[:-1] for job in lsf.iter_acct_jobs(FILES)]
+    jobs = [job.to_tuple()[:-1]
+            for job in lsf.iter_acct_jobs(FILES, workers=2,
+                                          chunk_size=chunk_size)]
+    assert jobs == expected
+
+
+def test_load_acct_rerun(database):
+    cmd = [sys.executable, os.path.join(ROOT, "load-acct.py"), database,
+           *FILES]
+    for expected in [110, 0]:
+        proc = sp.run(cmd, capture_output=True, text=True, check=True)
+        assert f"110 jobs read, {expected} inserted" in proc.stderr
+
+    con = sqlite3.connect(database)
+    assert con.execute("SELECT COUNT(*) FROM job").fetchone()[0] == 110
+    con.close()
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+from ebihpc import jobdb
+
+from conftest import make_job
+
+archive = pytest.importorskip("ebihpc.archive")
+
+
+def test_backfill(database, tmp_path):
+    directory = str(tmp_path / "archive")
+    con = jobdb.connect(database)
+    jobdb.update_jobs(con, [
+        make_job(id=1, start_time=datetime(2024, 3, 1, 8),
+                 finish_time=datetime(2024, 3, 1, 9),
+                 update_time=datetime(2024, 3, 1, 9, 5)),
+        make_job(id=2, start_time=datetime(2024, 3, 2, 8),
+                 finish_time=datetime(2024, 3, 2, 9),
+                 update_time=datetime(2024, 3, 4)),
+    ])
+    con.close()
+
+    arc = archive.Archive(directory)
+    assert arc.update(database) == ["2024-03-01", "2024-03-02"]
+    assert arc.update(database) == []
+
+    # Job of an archived day loaded later (e.g. from accounting files)
+    con = jobdb.connect(database)
+    jobdb.insert_jobs(con, [
+        make_job(id=3, start_time=datetime(2024, 3, 1, 10),
+                 finish_time=datetime(2024, 3, 1, 11),
+                 update_time=datetime(2024, 3, 5)),
+    ])
+    con.close()
+
+    from_dt = datetime(2024, 3, 1)
+    to_dt = datetime(2024, 3, 3)
+    arc = archive.Archive(directory)
+    # 2024-03-03 is now closed
+    assert arc.update(database) == ["2024-03-01", "2024-03-03"]
+    assert arc.days["2024-03-01"]["jobs"] == 2
+    assert sorted(job.id for job in jobdb.find_jobs(
+        database, from_dt, to_dt, archive_dir=directory
+    )) == [1, 2, 3]
+    assert archive.Archive(directory).update(database) == []
+
+    vectorized = pytest.importorskip("ebihpc.vectorized")
+    jobs = vectorized.load_jobs(database, from_dt, to_dt, directory)
+    assert len(jobs["slots"]) == 3
+
+
+def test_none_strings(database, tmp_path):
+    directory = str(tmp_path / "archive")
+    con = jobdb.connect(database)
+    # "None" is a valid job name, not a missing value
+    jobs = [make_job(id=i, name=name, exec_host=exec_host,
+                     update_time=datetime(2024, 3, 4))
+            for i, name, exec_host in [(1, "None", None),
+                                       (2, "job", "node"),
+                                       (3, "None", "None")]]
+    jobdb.update_jobs(con, jobs)
+    con.close()
+
+    arc = archive.Archive(directory)
+    assert arc.update(database)[0] == "2024-03-01"
+    archived = sorted(arc.find_jobs(datetime(2024, 3, 1),
+                                    datetime(2024, 3, 2)),
+                      key=lambda job: job.id)
+    assert [(job.name, job.exec_host) for job in archived] == [
+        ("None", None), ("job", "node"), ("None", "None")
+    ]
+    assert archived == jobs
+
+
+def test_empty_database(database, tmp_path):
+    directory = str(tmp_path / "archive")
+    con = jobdb.connect(database)
+    jobdb.update_jobs(con, [make_job(update_time=datetime(2024, 3, 4))])
+    con.close()
+    arc = archive.Archive(directory)
+    assert arc.update(database)
+
+    # Archive kept, job database started again
+    database = str(tmp_path / "new.db")
+    jobdb.connect(database).close()
+    assert archive.Archive(directory).update(database) == []
@@ -0,0 +1,197 @@
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+from ebihpc import ebisearch, usagedb
+from ebihpc.model import User
+
+from conftest import load_script
+
+
+USERS = {
+    f"user{i}": {
+        "name": f"User {i}",
+        "position": "Engineer",
+        "teams": [f"team{i % 3}"] + (["shared"] if i % 2 else []),
+        "photo_url": None
+    }
+    for i in range(20)
+}
+
+
+@pytest.fixture
+def server():
+    stub = load_script("stub-ebisearch.py")
+    requests = []
+
+    class Handler(stub.StubHandler):
+        users = dict(USERS)
+
+        def send_response(self, code, message=None):
+            requests.append(code)
+            super().send_response(code, message)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,),
+                              daemon=True)
+    thread.start()
+    host, port = httpd.server_address
+    yield f"http://{host}:{port}/", requests, Handler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def lookup(logins: list[str], url: str, **kwargs) -> dict:
+    users = [User(login) for login in logins]
+    ebisearch.update_users(users, url, **kwargs)
+    return {user.login: (user.name, user.position, user.teams)
+            for user in users}
+
+
+@pytest.mark.parametrize("batch_size", [1, 50])
+def test_cache_hit(tmp_path, server, batch_size):
+    url, requests, _ = server
+    cache = str(tmp_path / "cache.db")
+    logins = ["user1", "user2", "unknown"]
+    first = lookup(logins, url, cache=cache, batch_size=batch_size)
+    assert first["user1"] == ("User 1", "Engineer", ["team1", "shared"])
+    assert first["unknown"] == (None, None, [])
+    assert requests
+
+    # Before the TTL: no request
+    requests.clear()
+    assert lookup(logins, url, cache=cache, batch_size=batch_size) == first
+    assert requests == []
+
+
+def test_revalidation(tmp_path, server):
+    url, requests, handler = server
+    cache = str(tmp_path / "cache.db")
+    logins = ["user1", "user2"]
+    # Responses expire at once
+    first = lookup(logins, url, cache=cache, ttl=0, batch_size=1)
+
+    # Expired but not modified: the cached payload is kept
+    requests.clear()
+    assert lookup(logins, url, cache=cache, ttl=0, batch_size=1) == first
+    assert requests == [304, 304]
+
+    # Expired and modified
+    handler.users["user1"] = {**USERS["user1"], "name": "Renamed"}
+    requests.clear()
+    users = lookup(logins, url, cache=cache, ttl=0, batch_size=1)
+    assert users["user1"][0] == "Renamed"
+    assert users["user2"] == first["user2"]
+    assert sorted(requests) == [200, 304]
+
+
+def test_batch_revalidation(tmp_path, server):
+    url, requests, handler = server
+    cache = str(tmp_path / "cache.db")
+    logins = [f"user{i}" for i in range(5)] + ["unknown"]
+    first = lookup(logins, url, cache=cache, ttl=0, batch_size=3)
+    assert len(requests) == 2
+
+    # Users of each batch are revalidated together
+    requests.clear()
+    assert lookup(logins[::-1], url, cache=cache, ttl=0,
+                  batch_size=3) == first
+    assert requests == [304, 304]
+
+    handler.users["user0"] = {**USERS["user0"], "name": "Renamed"}
+    requests.clear()
+    users = lookup(logins, url, cache=cache, ttl=0, batch_size=3)
+    assert users["user0"][0] == "Renamed"
+    assert sorted(requests) == [200, 304]
+
+    # A batch with other users is fetched again
+    requests.clear()
+    assert lookup(logins[1:], url, cache=cache, ttl=0,
+                  batch_size=3) == {login: users[login]
+                                    for login in logins[1:]}
+    assert sorted(requests) == [200, 304]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_concurrent(server, batch_size):
+    url, _, _ = server
+    logins = list(USERS) + ["unknown"]
+    sequential = lookup(logins, url, workers=1, batch_size=batch_size)
+    assert sequential == lookup(logins, url, workers=8,
+                                batch_size=batch_size)
+    assert sequential == {login: lookup([login], url, workers=1)[login]
+                          for login in logins}
+
+
+def test_pages_revalidation(tmp_path, server, monkeypatch):
+    url, requests, handler = server
+    monkeypatch.setattr(ebisearch, "PAGE_SIZE", 2)
+    cache = str(tmp_path / "cache.db")
+    logins = [f"user{i}" for i in range(5)]
+    first = lookup(logins, url, cache=cache, ttl=0, batch_size=5)
+    assert requests == [200, 200, 200]
+    assert first == lookup(logins, url, batch_size=1)
+
+    # Revalidated with the validators of the first page
+    requests.clear()
+    assert lookup(logins, url, cache=cache, ttl=0, batch_size=5) == first
+    assert requests == [304]
+
+    handler.users["user0"] = {**USERS["user0"], "name": "Renamed"}
+    requests.clear()
+    users = lookup(logins, url, cache=cache, ttl=0, batch_size=5)
+    assert users["user0"][0] == "Renamed"
+    assert requests == [200, 200, 200]
+
+    requests.clear()
+    assert lookup(logins, url, cache=cache, ttl=0, batch_size=5) == users
+    assert requests == [304]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_custom_users_offline(tmp_path, server, monkeypatch, capsys, cached):
+    custom_users = load_script("custom-users.py")
+    url, _, _ = server
+    cache = str(tmp_path / "cache.db")
+    lookup(["user1"], url, cache=cache)
+    database = str(tmp_path / "usage.db")
+    usagedb.connect(database).close()
+
+    def unreachable(*args):
+        raise URLError("Network is unreachable")
+
+    # EBI Search down: metadata can still be entered
+    monkeypatch.setattr(ebisearch, "_get", unreachable)
+    monkeypatch.setattr("builtins.input", lambda prompt: "")
+    args = ["custom-users.py", database, str(tmp_path / "users.json"),
+            "user1", "--search-url", url]
+    if cached:
+        args += ["--search-cache", cache]
+    monkeypatch.setattr(sys, "argv", args)
+    custom_users.main()
+
+    out, err = capsys.readouterr()
+    assert "Network is unreachable" in err
+    assert ("User 1" in out) == cached
+    assert out.rstrip().endswith("Aborted")
+
+
+@pytest.mark.parametrize("code, attempts", [(204, 1), (404, 1), (503, 3)])
+def test_http_status(server, monkeypatch, code, attempts):
+    url, requests, handler = server
+
+    def do_GET(self):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    # Only server errors are transient: requested again
+    monkeypatch.setattr(handler, "do_GET", do_GET)
+    monkeypatch.setattr(ebisearch.time, "sleep", lambda seconds: None)
+    with pytest.raises(HTTPError) as exc_info:
+        ebisearch.search("user1", url, max_attempts=3)
+    assert exc_info.value.code == code
+    assert requests == [code] * attempts
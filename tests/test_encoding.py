@@ -0,0 +1,101 @@
+import json
+import math
+import struct
+
+import pytest
+
+from ebihpc import usagedb
+
+
+USER2INDEX = {"alice": 0, "bob": 7}
+INDEX2USER = {i: login for login, i in USER2INDEX.items()}
+
+
+def user_data(**kwargs) -> dict:
+    obj = usagedb._new_user_data()
+    obj.update(kwargs)
+    return obj
+
+
+def jobs_data() -> dict:
+    obj = usagedb._new_jobs_data()
+    obj["done"]["total"] = 3
+    obj["done"]["co2e"] = 1.5
+    obj["done"]["runtimes"][2] = 3
+    obj["done"]["cpueff"][99] = 1
+    obj["done"]["memeff"]["dist"][0] = 2
+    obj["failed"]["more1h"]["co2e"] = 0.25
+    return obj
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_users_data(compress):
+    data = {
+        "alice": user_data(jobs=0.5, cores=4, memory=7.5, co2e=1e-9,
+                           cost=123456.789, cputime=3600, submitted=2,
+                           memeff=[1, 0, 0, 0, 2]),
+        "bob": user_data(co2e=math.nan),
+    }
+    encoded = usagedb.encode_users_data(data, USER2INDEX, compress)
+    assert isinstance(encoded, bytes)
+
+    decoded = usagedb.decode_users_data(encoded, INDEX2USER)
+    assert decoded.keys() == data.keys()
+    assert decoded["alice"] == data["alice"]
+    assert math.isnan(decoded["bob"]["co2e"])
+    decoded["bob"]["co2e"] = data["bob"]["co2e"] = 0
+    assert decoded["bob"] == data["bob"]
+
+
+def test_users_data_none():
+    # Usage values are never None: not silently stored as 0
+    data = {"alice": user_data(cputime=None)}
+    with pytest.raises(struct.error):
+        usagedb.encode_users_data(data, USER2INDEX)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_jobs_data(compress):
+    data = jobs_data()
+    encoded = usagedb.encode_jobs_data(data, compress)
+    assert usagedb.decode_jobs_data(encoded) == data
+
+
+def test_json_rows():
+    # Rows written before the binary encoding (and --encoding json)
+    data = {"alice": user_data(jobs=1, co2e=2.5)}
+    for row in (json.dumps(data), json.dumps(data).encode()):
+        assert usagedb.decode_users_data(row, INDEX2USER) == data
+
+    assert usagedb.decode_jobs_data(json.dumps(jobs_data())) == jobs_data()
+
+
+def test_unknown_version():
+    encoded = usagedb.encode_jobs_data(jobs_data())
+    with pytest.raises(ValueError):
+        usagedb.decode_jobs_data(bytes([usagedb.ENCODING_VERSION + 1])
+                                 + encoded[1:])
+
+
+def test_mixed_rows(tmp_path):
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    index2user = {i: login for login, i in user2index.items()}
+    rows = {
+        "202403010000": {"alice": user_data(jobs=1, co2e=2.5)},
+        "202403010015": {"bob": user_data(cores=2, cputime=60)},
+    }
+    for (key, data), encoding in zip(rows.items(), ["json", "binary"]):
+        usagedb.update_usage(con, list(usagedb.encode_intervals(
+            [(key, data, jobs_data())], user2index, encoding
+        )))
+
+    stored = {}
+    for key, users_data, data in con.execute(
+        "SELECT time, users_data, jobs_data FROM usage"
+    ):
+        stored[key] = usagedb.decode_users_data(users_data, index2user)
+        assert usagedb.decode_jobs_data(data) == jobs_data()
+
+    con.close()
+    assert stored == rows
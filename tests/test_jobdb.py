@@ -0,0 +1,201 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import jobdb
+
+from conftest import make_job
+
+
+FROM_DT = datetime(2024, 3, 1)
+TO_DT = datetime(2024, 3, 5)
+
+
+def random_jobs(n: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    jobs = []
+    for i in range(n):
+        submit_time = FROM_DT - timedelta(days=1) + timedelta(
+            minutes=rnd.randrange(6 * 24 * 60)
+        )
+        start_time = submit_time + timedelta(minutes=rnd.randrange(120))
+        # Up to 3 days: jobs spanning several days
+        runtime = timedelta(minutes=rnd.choice([0, 1, 30, 600, 2000, 4320]))
+        if rnd.random() < 0.1:
+            # Cancelled before starting
+            start_time = None
+            finish_time = submit_time + runtime
+        else:
+            finish_time = start_time + runtime
+
+        jobs.append(make_job(id=i, submit_time=submit_time,
+                             start_time=start_time, finish_time=finish_time,
+                             user=rnd.choice(["alice", "bob"])))
+
+    return jobs
+
+
+def check_spans(con):
+    # One span (covering the job's times) per started job
+    rows = con.execute(
+        f"""
+        SELECT job.rowid, {jobdb._seconds("start_time")},
+               {jobdb._seconds("finish_time")}
+        FROM job
+        WHERE start_time IS NOT NULL
+        """
+    ).fetchall()
+    spans = {row_id: (min_time, max_time) for row_id, min_time, max_time
+             in con.execute("SELECT * FROM job_span")}
+    assert spans.keys() == {row_id for row_id, _, _ in rows}
+    for row_id, start, finish in rows:
+        min_time, max_time = spans[row_id]
+        assert min_time <= min(start, finish)
+        assert max_time >= max(start, finish)
+
+
+def find_plain(database: str, from_dt: datetime, to_dt: datetime) -> list:
+    # Same query as jobdb.find_rows(), without the R*Tree
+    con = jobdb.connect(database)
+    from_time = jobdb.to_param(con, from_dt)
+    to_time = jobdb.to_param(con, to_dt)
+    rows = con.execute(
+        """
+        SELECT *
+        FROM job
+        WHERE start_time IS NOT NULL
+          AND (
+            (start_time >= ? AND start_time < ?)
+            OR
+            (finish_time >= ? AND finish_time < ?)
+            OR
+            (start_time < ? AND finish_time >= ?)
+          )
+        """,
+        [from_time, to_time, from_time, to_time, from_time, to_time]
+    ).fetchall()
+    rows += con.execute(
+        """
+        SELECT *
+        FROM incomplete
+        WHERE start_time IS NOT NULL
+          AND start_time < ?
+        """,
+        [to_time]
+    ).fetchall()
+    con.close()
+    return sorted(rows)
+
+
+@pytest.fixture(params=[0, 1], ids=["text", "epoch"])
+def jobs_database(request, tmp_path) -> str:
+    database = str(tmp_path / "jobs.db")
+    if request.param == 0:
+        con = sqlite3.connect(database)
+        con.execute("PRAGMA user_version = 0")
+        jobdb._create_job_table(con, "job", "TEXT")
+        con.close()
+
+    con = jobdb.connect(database)
+    assert jobdb.get_version(con) == request.param
+    jobs = random_jobs(300)
+    jobdb.update_jobs(con, jobs[:280])
+    for job in jobs[280:]:
+        if job.start_time is not None:
+            job.finish_time = None
+    jobdb.update_incompletes(con, jobs[280:])
+    con.close()
+    return database
+
+
+def test_spans(jobs_database):
+    con = jobdb.connect(jobs_database)
+    check_spans(con)
+
+    # INSERT OR REPLACE: new rowid, new times
+    jobs = random_jobs(50, seed=2)
+    for job in jobs:
+        job.update_time += timedelta(days=1)
+    jobdb.update_jobs(con, jobs)
+    check_spans(con)
+
+    later = jobdb.to_param(con, datetime(2024, 3, 6))
+    earlier = jobdb.to_param(con, datetime(2024, 2, 20))
+    con.execute("UPDATE job SET finish_time = ? WHERE jobid % 3 = 0",
+                [later])
+    con.execute("UPDATE job SET start_time = ? WHERE jobid % 3 = 1",
+                [earlier])
+    con.execute("UPDATE job SET start_time = NULL WHERE jobid % 7 = 0")
+    con.execute("UPDATE job SET start_time = finish_time "
+                "WHERE jobid % 11 = 0")
+    con.commit()
+    check_spans(con)
+
+    con.execute("DELETE FROM job WHERE jobid % 5 = 0")
+    con.commit()
+    check_spans(con)
+    con.close()
+
+
+@pytest.mark.parametrize("from_dt, to_dt", [
+    (FROM_DT, TO_DT),
+    (datetime(2024, 3, 2), datetime(2024, 3, 3)),
+    (datetime(2024, 3, 2, 10, 17), datetime(2024, 3, 2, 10, 18)),
+    (datetime(2024, 2, 1), datetime(2024, 2, 2)),
+])
+def test_find_rows(jobs_database, from_dt, to_dt):
+    rows = sorted(jobdb.find_rows(jobs_database, from_dt, to_dt))
+    assert rows == find_plain(jobs_database, from_dt, to_dt)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_find_jobs_parallel(jobs_database, workers):
+    def key(job):
+        return job.accession
+
+    expected = sorted(jobdb.find_jobs(jobs_database, FROM_DT, TO_DT),
+                      key=key)
+    jobs = sorted(jobdb.find_jobs(jobs_database, FROM_DT, TO_DT,
+                                  workers=workers), key=key)
+    assert jobs == expected
+    assert len({job.accession for job in jobs}) == len(jobs)
+
+    # Jobs spanning several one-day chunks of workers
+    assert any(job.start_time < FROM_DT + timedelta(days=1)
+               and (job.finish_time is None
+                    or job.finish_time >= FROM_DT + timedelta(days=2))
+               for job in jobs)
+
+
+@pytest.mark.parametrize("cached", [False, True],
+                         ids=["stored", "fingerprints"])
+def test_write_changed(database, cached):
+    con = jobdb.connect(database)
+    fingerprints = {} if cached else None
+    jobs = [make_job(id=1), make_job(id=2), make_job(id=3)]
+    assert jobdb.update_jobs(con, jobs, fingerprints) == 3
+    row_ids = dict(con.execute("SELECT id, rowid FROM job"))
+
+    # Polled again, unchanged (other than the poll time): not rewritten
+    jobs = [make_job(id=i, update_time=datetime(2024, 3, 3))
+            for i in (1, 2, 3)]
+    assert jobdb.update_jobs(con, jobs, fingerprints) == 0
+    assert dict(con.execute("SELECT id, rowid FROM job")) == row_ids
+
+    # Changed: rewritten, with its new poll time
+    jobs[1].cpu_efficiency = 80
+    jobs[2].status = "exit"
+    assert jobdb.update_jobs(con, jobs, fingerprints) == 2
+    assert sorted(
+        (job.id, job.cpu_efficiency, job.status, job.update_time)
+        for job in jobdb.find_jobs(database, FROM_DT - timedelta(days=1),
+                                   TO_DT)
+    ) == [
+        (1, 50, "done", datetime(2024, 3, 2)),
+        (2, 80, "done", datetime(2024, 3, 3)),
+        (3, 50, "exit", datetime(2024, 3, 3)),
+    ]
+    assert jobdb.update_jobs(con, jobs, fingerprints) == 0
+    con.close()
@@ -0,0 +1,147 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from ebihpc import jobdb, usagedb
+
+from conftest import make_job
+
+
+def create_text_database(database: str, jobs: list, running: list):
+    # Job database of schema version 0: times stored as text
+    con = sqlite3.connect(database)
+    con.execute("PRAGMA user_version = 0")
+    jobdb._create_job_table(con, "job", "TEXT")
+    con.close()
+
+    con = jobdb.connect(database)
+    assert jobdb.get_version(con) == 0
+    jobdb.update_jobs(con, jobs)
+    jobdb.update_incompletes(con, running)
+    con.close()
+
+
+def read_jobs(database: str) -> tuple[list, list]:
+    con = jobdb.connect(database)
+    jobs = [jobdb.Job.from_tuple(row)
+            for row in con.execute("SELECT * FROM job ORDER BY id")]
+    running = sorted(jobdb.get_incomplete(con), key=lambda job: job.accession)
+    con.close()
+    return jobs, running
+
+
+def make_jobs(ids) -> list:
+    return [make_job(id=i, start_time=datetime(2024, 3, 1, i % 24),
+                     finish_time=datetime(2024, 3, 1, i % 24, 30),
+                     update_time=datetime(2024, 3, 2, 0, i))
+            for i in ids]
+
+
+def test_migrate(database):
+    jobs = make_jobs(range(1, 8))
+    running = [make_job(id=8, status="RUN", finish_time=None)]
+    create_text_database(database, jobs, running)
+    expected = read_jobs(database)
+
+    progress = list(jobdb.migrate(database, batch_size=2))
+    assert progress == [(2, 7), (4, 7), (6, 7), (7, 7)]
+
+    con = jobdb.connect(database)
+    assert jobdb.get_version(con) == 1
+    for table in ["job", "incomplete"]:
+        types = con.execute(f"SELECT DISTINCT typeof(submit_time), "
+                            f"typeof(update_time) FROM {table}").fetchall()
+        assert types == [("integer", "integer")]
+
+    indexes = {name for name, in con.execute(
+        "SELECT name FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'job' AND sql IS NOT NULL"
+    )}
+    assert indexes == set(jobdb.JOB_INDEXES)
+    con.close()
+
+    assert read_jobs(database) == expected
+    assert list(jobdb.find_jobs(database, datetime(2024, 3, 1),
+                                datetime(2024, 3, 2))) != []
+
+    # Already migrated
+    assert list(jobdb.migrate(database)) == []
+
+
+def test_migrate_resume(database):
+    create_text_database(database, make_jobs(range(1, 10)), [])
+    expected = read_jobs(database)
+
+    migration = jobdb.migrate(database, batch_size=2)
+    assert next(migration) == (2, 9)
+    assert next(migration) == (4, 9)
+    # Interrupted
+    migration.close()
+
+    con = jobdb.connect(database)
+    # Not migrated yet: still version 0, with indexes on the job table
+    assert jobdb.get_version(con) == 0
+    plan = con.execute("EXPLAIN QUERY PLAN SELECT * FROM job "
+                       "WHERE user = 'alice'").fetchall()
+    assert "job_user" in plan[0][-1]
+    assert con.execute("SELECT COUNT(*) FROM job_new").fetchone() == (4,)
+    con.close()
+
+    # Jobs written during the migration: new, and replacing copied ones
+    con = jobdb.connect(database)
+    changed = make_jobs([1, 10])
+    for job in changed:
+        job.status = "exit"
+        job.update_time += timedelta(days=1)
+    jobdb.update_jobs(con, changed)
+    con.close()
+
+    progress = list(jobdb.migrate(database, batch_size=2))
+    assert progress[-1] == (11, 11)
+
+    jobs, _ = read_jobs(database)
+    expected = [job for job in expected[0] if job.id != 1] + changed
+    assert sorted(jobs, key=lambda job: job.accession) == sorted(
+        expected, key=lambda job: job.accession
+    )
+
+
+def test_name_cluster(database, tmp_path):
+    con = jobdb.connect(database)
+    jobdb.insert_jobs(con, [make_job(id=i) for i in range(1, 6)])
+    jobdb.update_incompletes(con, [make_job(id=6, finish_time=None)])
+    # Job 5 already tracked with --clusters
+    jobdb.update_jobs(con, [make_job(id=5, cluster="codon", status="exit")])
+    con.close()
+
+    usage = str(tmp_path / "usage.db")
+    ucon = usagedb.connect(usage)
+    usagedb._update_ledger(ucon, [make_job(id=6, finish_time=None)],
+                           datetime(2024, 3, 2))
+
+    progress = list(jobdb.name_cluster(database, "codon", batch_size=2))
+    assert progress == [("job", 2, 6), ("job", 4, 6), ("job", 6, 6),
+                        ("incomplete", 1, 1)]
+    assert usagedb.name_cluster(ucon, "codon") == 1
+
+    con = jobdb.connect(database)
+    rows = con.execute("SELECT id, scheduler, status FROM job "
+                       "ORDER BY jobid").fetchall()
+    ts = f"{datetime(2024, 3, 1).timestamp():.0f}"
+    assert rows == [(f"{ts}-lsf-codon-{i}-0", "lsf@codon",
+                     "exit" if i == 5 else "done") for i in range(1, 6)]
+    assert [job.accession for job in jobdb.get_incomplete(con)] == [
+        f"{ts}-lsf-codon-6-0"
+    ]
+    con.close()
+
+    assert ucon.execute("SELECT id FROM ledger").fetchall() == [
+        (f"{ts}-lsf-codon-6-0",)
+    ]
+    ucon.close()
+
+    # Nothing left to rename
+    list(jobdb.name_cluster(database, "other"))
+    con = sqlite3.connect(database)
+    assert con.execute("SELECT COUNT(*) FROM job "
+                       "WHERE scheduler = 'lsf@codon'").fetchone() == (5,)
+    con.close()
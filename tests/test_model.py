@@ -0,0 +1,58 @@
+import grp
+import pwd
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from ebihpc import model
+
+
+@pytest.fixture
+def groups(monkeypatch):
+    # alice: primary group 100, member of 101 in /etc/group, of 102 in LDAP
+    monkeypatch.setattr(model, "_USERS_GROUPS", {})
+    monkeypatch.setattr(model, "_GROUP_NAMES", None)
+
+    def getpwnam(name):
+        if name != "alice":
+            raise KeyError(name)
+        return SimpleNamespace(pw_gid=100)
+
+    def getgrgid(gid):
+        if gid != 102:
+            raise KeyError(gid)
+        return SimpleNamespace(gr_name="ldap")
+
+    calls = []
+
+    def getgrouplist(name, gid):
+        calls.append(name)
+        return [100, 101, 102, 103]
+
+    monkeypatch.setattr(pwd, "getpwnam", getpwnam)
+    monkeypatch.setattr(grp, "getgrall", lambda: [
+        SimpleNamespace(gr_gid=100, gr_name="users", gr_mem=[]),
+        SimpleNamespace(gr_gid=101, gr_name="local", gr_mem=["alice"]),
+    ])
+    monkeypatch.setattr(grp, "getgrgid", getgrgid)
+    monkeypatch.setattr(model.os, "getgrouplist", getgrouplist)
+    return calls
+
+
+def test_get_groups(groups):
+    expected = ("users", "103,ldap,local,users")
+    assert model.UnixUser.get_groups("alice") == expected
+    assert model.UnixUser.get_groups("alice") == expected
+    # Cached per user
+    assert groups == ["alice"]
+    assert model.UnixUser.get_groups("bob") == (None, None)
+
+
+def test_job_update_time():
+    # Time the job was created, not the time the module was imported
+    before = datetime.now()
+    job = model.Job("lsf", 1, 0, "job", "done", "alice", "standard", 1, 50,
+                    None, None, None, "login", "node", before, before, before,
+                    None)
+    assert before <= job.update_time <= datetime.now()
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import intervals, jobdb
+from ebihpc.usagedb import range_dt
+
+from conftest import load_script, make_job
+
+
+def count_minutes(start, stop, from_dt, to_dt):
+    # Minute loop of create-report.py before intervals.count()
+    minutes = 0
+    for dt in range_dt(start, stop, timedelta(minutes=1)):
+        if dt >= to_dt:
+            break
+        elif from_dt <= dt:
+            minutes += 1
+
+    return minutes
+
+
+def test_count_matches_minute_loop():
+    from_dt = datetime(2024, 3, 1)
+    to_dt = datetime(2024, 4, 1)
+    starts = [from_dt + timedelta(seconds=s)
+              for s in (-3601, -61, -60, -59, -1, 0, 1, 59, 60, 61, 90)]
+    starts += [to_dt + timedelta(seconds=s) for s in (-61, -30, 0, 30)]
+    for start in starts:
+        for seconds in (0, 1, 59, 60, 61, 119, 3600, 3630):
+            stop = start + timedelta(seconds=seconds)
+            assert (intervals.count(start, stop, from_dt, to_dt)
+                    == count_minutes(start, stop, from_dt, to_dt))
+
+
+def test_report_engines(database):
+    from_dt = datetime(2024, 3, 1)
+    to_dt = datetime(2024, 4, 1)
+    jobs = [
+        # Times with seconds (accounting files, Slurm)
+        make_job(id=1, start_time=datetime(2024, 2, 29, 23, 59, 30),
+                 finish_time=datetime(2024, 3, 1, 0, 10, 15)),
+        make_job(id=2, start_time=datetime(2024, 3, 31, 23, 58, 45),
+                 finish_time=datetime(2024, 4, 1, 0, 5, 0)),
+        # One minute or less
+        make_job(id=3, start_time=datetime(2024, 3, 5, 12, 0, 20),
+                 finish_time=datetime(2024, 3, 5, 12, 0, 20)),
+        # Unknown CPU efficiency (no CPU time)
+        make_job(id=5, start_time=datetime(2024, 3, 6),
+                 finish_time=datetime(2024, 3, 6, 1),
+                 cpu_efficiency=None, cpu_time=None),
+        # Running, started after the last poll: no runtime
+        make_job(id=4, status="run", start_time=datetime(2024, 3, 10),
+                 finish_time=None, update_time=datetime(2024, 3, 2)),
+    ]
+    con = jobdb.connect(database)
+    jobdb.update_jobs(con, jobs[:-1])
+    jobdb.update_incompletes(con, jobs[-1:])
+    con.close()
+
+    report = load_script("create-report.py")
+    user_data, num_jobs = report.report_jobs(database, from_dt, to_dt)
+    assert num_jobs == 5
+
+    data = user_data["alice"]
+    assert data["co2e"] == data["co2e"]  # not NaN
+    assert data["co2e"] > 0
+
+    vectorized = pytest.importorskip("ebihpc.vectorized")
+    vec_data, vec_num_jobs = vectorized.report_jobs(database, from_dt, to_dt)
+    assert vec_num_jobs == num_jobs
+    assert vec_data["alice"]["jobs"] == data["jobs"]
+    assert vec_data["alice"]["co2e"] == pytest.approx(data["co2e"])
+    assert vec_data["alice"]["cost"] == pytest.approx(data["cost"])
@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+
+from ebihpc import usagedb
+from ebihpc.model import User
+
+from conftest import load_script
+
+
+def user_data(**kwargs) -> dict:
+    obj = usagedb._new_user_data()
+    obj.update(kwargs)
+    return obj
+
+
+def write(con, rows: dict):
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    usagedb.update_usage(con, list(usagedb.encode_intervals(
+        [(key, data, usagedb._new_jobs_data()) for key, data in rows.items()],
+        user2index
+    )))
+    con.commit()
+
+
+def read_rollups(con, period: str) -> dict:
+    index2user = usagedb.get_user_logins(con)
+    return {
+        (time, index2user[user_id]): (num_intervals, co2e)
+        for time, user_id, num_intervals, co2e in con.execute(
+            "SELECT time, user_id, num_intervals, co2e FROM user_rollup "
+            "WHERE period = ?", [period]
+        )
+    }
+
+
+def test_rollups(tmp_path):
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    write(con, {
+        "202403010000": {"alice": user_data(jobs=0.5, co2e=1)},
+        "202403010015": {"alice": user_data(co2e=2),
+                         "bob": user_data(jobs=1, co2e=4)},
+    })
+    usagedb.create_rollups(con)
+    assert read_rollups(con, "day") == {
+        ("202403010000", "alice"): (2, 3),
+        ("202403010000", "bob"): (1, 4),
+    }
+
+    # Usage without jobs (e.g. short intervals of running jobs) is kept
+    write(con, {
+        "202403010015": {"alice": user_data(co2e=2.5)},
+        "202403010030": {"bob": user_data(co2e=1)},
+    })
+    assert read_rollups(con, "day") == {
+        ("202403010000", "alice"): (2, 3.5),
+        ("202403010000", "bob"): (1, 1),
+    }
+    assert read_rollups(con, "hour") == read_rollups(con, "day")
+
+    write(con, {"202403010030": {}})
+    assert read_rollups(con, "day") == {
+        ("202403010000", "alice"): (2, 3.5),
+    }
+    con.close()
+
+
+def test_view_teams(tmp_path):
+    view_usage = load_script("view-usage.py")
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    write(con, {
+        "202403010000": {"alice": user_data(co2e=1),
+                         "bob": user_data(co2e=4)},
+        "202403020000": {"alice": user_data(co2e=2)},
+    })
+    usagedb.create_rollups(con)
+    # Users written after their usage: teams are read from current users
+    usagedb.update_users(con, [User("alice", teams=["a", "b"]),
+                               User("bob", teams=["b"])])
+    weights = usagedb.get_team_weights(con)
+
+    usage = {}
+    for periods in (None, view_usage.ROLLUP_PERIODS["month"]):
+        users_usage = {}
+        for dt, users_co2e in view_usage.iter_usage(
+            con, datetime(2024, 3, 1), datetime(2024, 4, 1), None, periods
+        ):
+            view_usage.add_usage(users_usage, dt.strftime("%Y-%m"),
+                                 users_co2e, weights)
+
+        usage[periods is None] = view_usage.to_teams(users_usage, weights)
+
+    assert usage[True] == usage[False]
+    assert usage[False]["2024-03"] == {"a": pytest.approx(1.5),
+                                       "b": pytest.approx(5.5)}
+    con.close()
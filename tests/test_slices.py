@@ -0,0 +1,114 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import jobdb, usagedb
+
+from conftest import load_script, make_job
+
+
+DAY = datetime(2024, 3, 1)
+
+
+@pytest.fixture(scope="module")
+def track_usage():
+    return load_script("track-usage.py")
+
+
+@pytest.fixture
+def jobs_db(tmp_path) -> str:
+    rnd = random.Random(3)
+    jobs = []
+    for i in range(200):
+        # Times not aligned on 15-minute intervals
+        submit_time = DAY - timedelta(hours=2) + timedelta(
+            minutes=rnd.randrange(28 * 60)
+        )
+        start_time = submit_time + timedelta(minutes=rnd.choice([0, 7, 50]))
+        runtime = timedelta(minutes=rnd.choice([0, 1, 13, 44, 100, 600]))
+        jobs.append(make_job(id=i, submit_time=submit_time,
+                             start_time=start_time,
+                             finish_time=start_time + runtime,
+                             status=rnd.choice(["done", "exit"]),
+                             user=rnd.choice(["alice", "bob"]),
+                             cpu_efficiency=rnd.choice([None, 30, 90])))
+
+    # Around the edge of a slice of 15/45/90 minutes: one minute or less,
+    # and submitted before the edge but started after it
+    edge = DAY + timedelta(hours=3)
+    jobs += [
+        make_job(id=1000, submit_time=edge - timedelta(minutes=3),
+                 start_time=edge - timedelta(minutes=1),
+                 finish_time=edge - timedelta(minutes=1)),
+        make_job(id=1001, submit_time=edge - timedelta(minutes=3),
+                 start_time=edge + timedelta(minutes=20),
+                 finish_time=edge + timedelta(minutes=40)),
+    ]
+
+    database = str(tmp_path / "jobs.db")
+    con = jobdb.connect(database)
+    jobdb.update_jobs(con, jobs)
+    jobdb.update_incompletes(con, [
+        make_job(id=2000, status="run", start_time=DAY + timedelta(hours=5,
+                                                                   minutes=3),
+                 finish_time=None)
+    ])
+    jobdb.update_poll_time(con, DAY + timedelta(hours=20, minutes=8))
+    con.close()
+    return database
+
+
+def process(engine, jobs_db: str, slices: list[tuple],
+            user2index: dict[str, int]) -> dict:
+    usage = {}
+    for from_dt, to_dt, window in slices:
+        output, _ = engine.process_jobs(jobs_db, from_dt, to_dt, user2index,
+                                        transport="pipe", window=window)
+        for key, users_data, jobs_data in output:
+            assert key not in usage
+            usage[key] = json.loads(users_data), json.loads(jobs_data)
+
+    return usage
+
+
+def assert_same(value, expected):
+    if isinstance(expected, dict):
+        assert value.keys() == expected.keys()
+        for key in expected:
+            assert_same(value[key], expected[key])
+    elif isinstance(expected, (list, tuple)):
+        assert len(value) == len(expected)
+        for v, e in zip(value, expected):
+            assert_same(v, e)
+    else:
+        assert value == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("minutes", [15, 45, 90])
+@pytest.mark.parametrize("engine_name", ["usagedb", "vectorized"])
+def test_slices(tmp_path, track_usage, jobs_db, minutes, engine_name):
+    if engine_name == "vectorized":
+        engine = pytest.importorskip("ebihpc.vectorized")
+    else:
+        engine = usagedb
+
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    con.close()
+
+    day_end = DAY + timedelta(days=1)
+    slices = track_usage.get_slices(jobs_db, DAY, day_end,
+                                    timedelta(minutes=minutes))
+    # Slices of the day, aligned on 15-minute intervals
+    assert sorted((s[0], s[1]) for s in slices) == [
+        (dt, min(dt + timedelta(minutes=minutes), day_end))
+        for dt in usagedb.range_dt(DAY, day_end, timedelta(minutes=minutes))
+    ]
+    assert all(s[2] == (DAY, day_end) for s in slices)
+
+    expected = process(engine, jobs_db, [(DAY, day_end, (DAY, day_end))],
+                       user2index)
+    assert len(expected) == 96
+    assert_same(process(engine, jobs_db, slices, user2index), expected)
@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import slurm
+
+from conftest import DATA_DIR
+
+
+SLURM_DIR = os.path.join(DATA_DIR, "slurm")
+NOW = datetime(2026, 10, 14, 18)
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture
+def sacct(tmp_path, monkeypatch) -> str:
+    # Fake sacct first on PATH, returns the file of its calls
+    log = str(tmp_path / "sacct.log")
+    monkeypatch.setenv("PATH", SLURM_DIR + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("SACCT_LOG", log)
+    monkeypatch.setattr(slurm, "datetime", FixedDatetime)
+    return log
+
+
+def read_calls(log: str) -> list[tuple[datetime, datetime]]:
+    with open(log) as fh:
+        return [tuple(datetime.fromisoformat(s) for s in line.split())
+                for line in fh]
+
+
+def test_read_rows():
+    with open(os.path.join(SLURM_DIR, "sacct.txt"), "rb") as fh:
+        jobs = [[row[0] for row in rows] for rows in slurm.read_rows(fh)]
+
+    # Pending array range (200_[4-9]) skipped
+    assert jobs == [["100", "100.batch", "100.extern"],
+                    ["200_3", "200_3.batch"],
+                    ["300", "300.0"],
+                    ["400"],
+                    ["500"],
+                    ["600+0"],
+                    ["600+1"]]
+
+
+def test_windows(sacct):
+    since = datetime(2026, 10, 13, 12)
+    jobs = slurm.get_jobs(since, window=timedelta(hours=6))
+
+    # Contiguous windows up to now
+    calls = read_calls(sacct)
+    assert calls[0][0] == since
+    assert calls[-1][1] == NOW
+    assert all(a[1] == b[0] for a, b in zip(calls, calls[1:]))
+    assert all(stop - start <= timedelta(hours=6) for start, stop in calls)
+    assert len(calls) == 5
+
+    # Jobs listed in several windows (e.g. running) returned once
+    assert sorted((job.id, job.index) for job in jobs) == [
+        (100, 0), (200, 3), (300, 0), (400, 0), (500, 0), (600, 0), (600, 1)
+    ]
+
+
+def test_windows_later_poll(sacct):
+    # Jobs that ended before the previous poll are not listed again
+    jobs = slurm.get_jobs(datetime(2026, 10, 14, 15))
+    assert read_calls(sacct) == [(datetime(2026, 10, 14, 15), NOW)]
+    assert sorted(job.id for job in jobs) == [300, 400]
+
+
+def test_parse(sacct):
+    jobs = {(job.id, job.index): job
+            for job in slurm.get_jobs(datetime(2026, 10, 13, 12))}
+
+    job = jobs[100, 0]
+    assert job.status == "COMPLETED"
+    assert job.slots == 4
+    assert job.mem_lim == 16384
+    # Max of steps
+    assert job.mem_max == 2000
+    assert job.cpu_time == 7200
+    assert job.cpu_efficiency == 50
+
+    # Array task, memory per CPU
+    job = jobs[200, 3]
+    assert job.status == "FAILED"
+    assert job.mem_lim == 8000
+    assert job.mem_max == 6144
+    assert job.cpu_time == 93784
+
+    # Memory per node, running
+    job = jobs[300, 0]
+    assert job.mem_lim == 131072
+    assert job.exec_host == "node[03-04]"
+    assert job.finish_time is None
+    assert job.cpu_efficiency is None
+
+    job = jobs[400, 0]
+    assert job.status == "PENDING"
+    assert job.start_time is None
+    assert job.exec_host is None
+
+    job = jobs[500, 0]
+    assert job.status == "CANCELLED"
+    assert job.start_time is None
+    assert job.finish_time == datetime(2026, 10, 14, 10, 30)
+    assert job.cpu_efficiency is None
+
+    # Heterogeneous job components
+    assert jobs[600, 0].exec_host == "node05"
+    assert jobs[600, 1].exec_host == "node06"
+    assert jobs[600, 1].cpu_time == 600
+    assert jobs[600, 0].accession != jobs[600, 1].accession
+
+
+@pytest.mark.parametrize("string, cpus, nodes, expected", [
+    ("16G", 4, 1, 16384),
+    ("4000Mc", 2, 1, 8000),
+    ("64Gn", 8, 2, 131072),
+    ("2048000K", 1, 1, 2000),
+    ("1048576", 1, 1, 1),
+    ("", 1, 1, None),
+])
+def test_parse_memory(string, cpus, nodes, expected):
+    assert slurm.parse_memory(string, cpus, nodes) == expected
@@ -0,0 +1,172 @@
+import io
+import json
+import os
+import sqlite3
+import subprocess as sp
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import jobdb, lsf, schedulers, slurm
+from ebihpc.model import UnixUser
+
+from conftest import DATA_DIR, load_script, make_job
+
+
+@pytest.fixture(scope="module")
+def track_jobs():
+    return load_script("track-jobs.py")
+
+
+USERS = {"alice": UnixUser("alice", "users", "users")}
+
+
+def running(**kwargs):
+    return make_job(status="RUN", finish_time=None, **kwargs)
+
+
+def test_read_records_truncated():
+    records = [{"JOBID": str(i)} for i in range(3)]
+    data = json.dumps({"COMMAND": "bjobs", "RECORDS": records}).encode()
+    assert list(lsf.read_records(io.BytesIO(data))) == records
+
+    with pytest.raises(json.JSONDecodeError):
+        list(lsf.read_records(io.BytesIO(data[:-20])))
+
+
+@pytest.mark.parametrize("error", [
+    sp.CalledProcessError(255, ["bjobs"]),
+    json.JSONDecodeError("Expecting value", "", 0),
+])
+def test_poll_failure(database, track_jobs, monkeypatch, error):
+    con = jobdb.connect(database)
+    poll_time = datetime(2024, 3, 1, 10)
+    clusters = [schedulers.Cluster(None, "lsf")]
+    jobs = [running(id=1), running(id=2)]
+    fingerprints = {}, {}
+    track_jobs.poll(con, USERS, lambda failed: iter(jobs), fingerprints)
+    con.execute("UPDATE metadata SET value = ? WHERE key = 'poll_time'",
+                [jobdb.to_param(con, poll_time)])
+    con.commit()
+
+    def iter_lsf(cluster, since):
+        yield make_job(id=1)
+        raise error
+
+    # Failed after job 1 finished: job 2 is not removed, and jobs finished
+    # since the last complete poll are read again
+    monkeypatch.setitem(schedulers.SCHEDULERS, "lsf", iter_lsf)
+    track_jobs.poll(con, USERS,
+                    lambda failed: schedulers.iter_jobs(clusters, None,
+                                                        failed),
+                    fingerprints, batch_size=1)
+    assert [job.id for job in jobdb.get_incomplete(con)] == [1, 2]
+    assert con.execute("SELECT COUNT(*) FROM job").fetchone() == (1,)
+    assert jobdb.get_poll_time(con) == poll_time
+
+    track_jobs.poll(con, USERS,
+                    lambda failed: iter([make_job(id=1), running(id=2)]),
+                    fingerprints)
+    assert [job.id for job in jobdb.get_incomplete(con)] == [2]
+    assert jobdb.get_poll_time(con) > poll_time
+    con.close()
+
+
+def test_poll_cluster_failure(database, track_jobs, tmp_path, monkeypatch):
+    # Fake sacct: cluster "b" fails before any output
+    log = str(tmp_path / "sacct.log")
+    monkeypatch.setenv("PATH", os.path.join(DATA_DIR, "slurm")
+                       + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("SACCT_LOG", log)
+    monkeypatch.setattr(slurm, "RETRY_DELAY", 0)
+    clusters = [schedulers.Cluster("a", "slurm"),
+                schedulers.Cluster("b", "slurm", env={"SACCT_FAIL": "1"})]
+
+    con = jobdb.connect(database)
+    poll_time = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    old = [running(scheduler="slurm", cluster=name, id=1)
+           for name in ["a", "b"]]
+    jobdb.update_incompletes(con, old)
+    jobdb.update_poll_time(con, poll_time)
+
+    failed = set()
+    jobs = list(schedulers.iter_jobs(clusters, poll_time, failed))
+    # Not finished, in any window
+    assert sorted((job.cluster, job.id) for job in jobs) == [("a", 300),
+                                                             ("a", 400)]
+    assert failed == {"slurm@b"}
+    with open(log) as fh:
+        assert len(fh.readlines()) == 1 + slurm.MAX_ATTEMPTS
+
+    # Job 1 of "a" ended before the poll: removed, not job 1 of "b"
+    track_jobs.poll(con, USERS,
+                    lambda failed: schedulers.iter_jobs(clusters, poll_time,
+                                                        failed),
+                    ({}, {}))
+    assert sorted((job.cluster, job.id)
+                  for job in jobdb.get_incomplete(con)) == [("a", 300),
+                                                            ("a", 400),
+                                                            ("b", 1)]
+    assert jobdb.get_poll_time(con) == poll_time
+    con.close()
+
+
+def test_daemon(database, track_jobs, monkeypatch, capsys):
+    con = jobdb.connect(database)
+    jobdb.update_users(con, list(USERS.values()))
+    con.close()
+
+    polls = iter([
+        [running(id=1), running(id=2)],
+        [make_job(id=1), running(id=2)],
+        # Database locked while writing: reported, retried at next poll
+        [make_job(id=1), make_job(id=2)],
+        [make_job(id=1), make_job(id=2)],
+    ])
+
+    def iter_lsf(cluster, since):
+        yield from next(polls)
+
+    remove_incompletes = jobdb.remove_incompletes
+    calls = []
+
+    def locked_once(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise sqlite3.OperationalError("database is locked")
+        return remove_incompletes(*args)
+
+    delays = []
+
+    def sleep(seconds):
+        delays.append(seconds)
+        if len(delays) == 4:
+            raise KeyboardInterrupt
+
+    monkeypatch.setitem(schedulers.SCHEDULERS, "lsf", iter_lsf)
+    monkeypatch.setattr(jobdb, "remove_incompletes", locked_once)
+    monkeypatch.setattr(track_jobs.time, "sleep", sleep)
+    monkeypatch.setattr(sys, "argv", ["track-jobs.py", "--daemon",
+                                      "--interval", "60", "--jitter", "0",
+                                      database])
+    track_jobs.main()
+
+    # Polls do not overlap, and start every interval
+    assert len(delays) == 4
+    assert all(0 < delay <= 60 for delay in delays)
+
+    err = capsys.readouterr().err.splitlines()
+    assert len(err) == 4
+    assert err[2].endswith("database is locked")
+    # Jobs written once, fingerprints kept between polls
+    assert "finished written: 0, running written: 2," in err[0]
+    assert "finished written: 1, running written: 0," in err[1]
+    # Job 2 written before the failure, removed once the poll completes
+    assert "finished written: 0, running written: 0, " \
+           "running removed: 1," in err[3]
+
+    con = jobdb.connect(database)
+    assert list(jobdb.get_incomplete(con)) == []
+    assert con.execute("SELECT COUNT(*) FROM job").fetchone() == (2,)
+    con.close()
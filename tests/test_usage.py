@@ -0,0 +1,235 @@
+import sys
+from datetime import datetime
+
+import pytest
+
+from ebihpc import jobdb, usagedb
+
+from conftest import load_script, make_job
+
+
+FROM_DT = datetime(2024, 3, 1)
+TO_DT = datetime(2024, 3, 2)
+
+
+def poll(database: str, finished: list, running: list, dt: datetime):
+    con = jobdb.connect(database)
+    jobdb.update_jobs(con, finished)
+    jobdb.update_incompletes(con, running)
+    jobdb.remove_incompletes(con, {job.accession for job in running})
+    jobdb.update_poll_time(con, dt)
+    con.close()
+
+
+def process_all(jobs_db: str, usage_db: str) -> dict:
+    con = usagedb.connect(usage_db)
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    output, _ = usagedb.process_jobs(jobs_db, FROM_DT, TO_DT, user2index,
+                                     transport="pipe")
+    usagedb.update_usage(con, output)
+    usagedb.reset_ledger(con, jobs_db)
+    jcon = jobdb.connect(jobs_db)
+    usagedb.bump_update_times(con, jobdb.get_latest_update_time(jcon))
+    jcon.close()
+    return read_usage(con, user2index)
+
+
+def read_usage(con, user2index: dict[str, int]) -> dict:
+    index2user = {i: login for login, i in user2index.items()}
+    usage = {}
+    for key, users_data, jobs_data in con.execute(
+        "SELECT time, users_data, jobs_data FROM usage"
+    ):
+        users_data = usagedb.decode_users_data(users_data, index2user)
+        if users_data:
+            usage[key] = users_data
+
+    return usage
+
+
+def assert_same_usage(usage: dict, expected: dict, ignore: tuple = ()):
+    assert usage.keys() == expected.keys()
+    for key, users_data in expected.items():
+        assert usage[key].keys() == users_data.keys()
+        for login, obj in users_data.items():
+            for name, value in obj.items():
+                if name not in ignore:
+                    assert usage[key][login][name] == pytest.approx(value)
+
+
+def test_process_updates(tmp_path):
+    jobs_db = str(tmp_path / "jobs.db")
+    running = make_job(id=1, status="run", user="alice",
+                       start_time=datetime(2024, 3, 1, 8),
+                       finish_time=None, cpu_time=None,
+                       update_time=datetime(2024, 3, 1, 8, 5))
+    poll(jobs_db, [
+        make_job(id=2, user="bob", start_time=datetime(2024, 3, 1, 9),
+                 finish_time=datetime(2024, 3, 1, 9, 30),
+                 update_time=datetime(2024, 3, 1, 9, 35)),
+    ], [running], datetime(2024, 3, 1, 10))
+
+    usage_db = str(tmp_path / "usage.db")
+    process_all(jobs_db, usage_db)
+
+    # Second poll: the running job is unchanged, so not written again
+    poll(jobs_db, [
+        make_job(id=3, user="bob", start_time=datetime(2024, 3, 1, 10, 30),
+                 finish_time=datetime(2024, 3, 1, 11, 30),
+                 update_time=datetime(2024, 3, 1, 11, 40)),
+    ], [
+        running,
+        make_job(id=4, status="run", user="alice",
+                 start_time=datetime(2024, 3, 1, 11),
+                 finish_time=None, cpu_time=None,
+                 update_time=datetime(2024, 3, 1, 11, 5)),
+    ], datetime(2024, 3, 1, 12))
+
+    con = usagedb.connect(usage_db)
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    last_jobs_update, num_jobs = usagedb.process_updates(con, jobs_db,
+                                                         user2index)
+    assert last_jobs_update == datetime(2024, 3, 1, 12)
+    # Only jobs written since the first run
+    assert num_jobs == 2
+    usagedb.bump_update_times(con, last_jobs_update)
+    incremental = read_usage(con, user2index)
+
+    # The fraction of job 1 (and of its CPU time) is still based on its
+    # runtime at the first run
+    expected = process_all(jobs_db, str(tmp_path / "usage2.db"))
+    assert_same_usage(incremental, expected, ignore=("jobs", "cputime"))
+    assert incremental["202403010800"]["alice"]["jobs"] == pytest.approx(
+        15 / 120
+    )
+    assert expected["202403010800"]["alice"]["jobs"] == pytest.approx(15 / 240)
+
+    # Third poll: both running jobs finished
+    poll(jobs_db, [
+        make_job(id=1, user="alice", start_time=datetime(2024, 3, 1, 8),
+                 finish_time=datetime(2024, 3, 1, 12, 30),
+                 update_time=datetime(2024, 3, 1, 12, 40)),
+        make_job(id=4, user="alice", start_time=datetime(2024, 3, 1, 11),
+                 finish_time=datetime(2024, 3, 1, 12, 50),
+                 update_time=datetime(2024, 3, 1, 12, 55)),
+    ], [], datetime(2024, 3, 1, 13))
+
+    usagedb.process_updates(con, jobs_db, user2index)
+    incremental = read_usage(con, user2index)
+    con.close()
+
+    expected = process_all(jobs_db, str(tmp_path / "usage3.db"))
+    assert_same_usage(incremental, expected)
+
+
+def test_engines(tmp_path):
+    vectorized = pytest.importorskip("ebihpc.vectorized")
+    jobs_db = str(tmp_path / "jobs.db")
+    poll(jobs_db, [
+        make_job(id=1, user="bob", start_time=datetime(2024, 3, 1, 9),
+                 finish_time=datetime(2024, 3, 1, 9, 30)),
+        make_job(id=2, user="alice", status="exit",
+                 start_time=datetime(2024, 2, 29, 23, 50),
+                 finish_time=datetime(2024, 3, 1, 0, 20)),
+        # Unknown CPU efficiency (no CPU time)
+        make_job(id=4, user="bob", start_time=datetime(2024, 3, 1, 9),
+                 finish_time=datetime(2024, 3, 1, 9, 50),
+                 cpu_efficiency=None, cpu_time=None),
+    ], [
+        make_job(id=3, status="run", user="alice",
+                 start_time=datetime(2024, 3, 1, 8),
+                 finish_time=None, cpu_time=600),
+    ], datetime(2024, 3, 1, 10))
+
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    con.close()
+
+    rows = {}
+    for engine in (usagedb, vectorized):
+        output, num_jobs = engine.process_jobs(jobs_db, FROM_DT, TO_DT,
+                                               user2index, transport="pipe")
+        assert num_jobs == 4
+        con = usagedb.connect(str(tmp_path / f"{engine.__name__}.db"))
+        usagedb.update_usage(con, output)
+        rows[engine] = read_usage(con, user2index)
+        con.close()
+
+    assert_same_usage(rows[vectorized], rows[usagedb])
+
+
+def test_running_jobs(tmp_path):
+    # Running jobs count as a fraction of a job (and of their CPU time) in
+    # every interval, based on their runtime until the last poll
+    engines = [usagedb]
+    try:
+        from ebihpc import vectorized
+    except ImportError:
+        pass
+    else:
+        engines.append(vectorized)
+
+    jobs_db = str(tmp_path / "jobs.db")
+    poll(jobs_db, [], [
+        make_job(id=1, status="run", user="alice",
+                 start_time=datetime(2024, 3, 1, 8),
+                 finish_time=None, cpu_time=3600),
+        # Started at the last poll: no runtime yet
+        make_job(id=2, status="run", user="bob",
+                 start_time=datetime(2024, 3, 1, 10),
+                 finish_time=None, cpu_time=None),
+    ], datetime(2024, 3, 1, 10))
+
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    user2index = usagedb.get_user_ids(con, ["alice", "bob"])
+    con.close()
+
+    for engine in engines:
+        output, num_jobs = engine.process_jobs(jobs_db, FROM_DT, TO_DT,
+                                               user2index, transport="pipe")
+        con = usagedb.connect(str(tmp_path / f"{engine.__name__}.db"))
+        usagedb.update_usage(con, output)
+        usage = read_usage(con, user2index)
+        con.close()
+
+        assert sorted(usage) == [f"20240301{h:02d}{m:02d}"
+                                 for h in (8, 9) for m in (0, 15, 30, 45)]
+        for users_data in usage.values():
+            assert list(users_data) == ["alice"]
+            assert users_data["alice"]["jobs"] == pytest.approx(15 / 120)
+            assert users_data["alice"]["cputime"] == pytest.approx(
+                3600 * 15 / 120
+            )
+
+
+def test_empty_jobs_database(tmp_path, monkeypatch):
+    # No job polled yet: no latest update time
+    jobs_db = str(tmp_path / "jobs.db")
+    jobdb.connect(jobs_db).close()
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    user2index = usagedb.get_user_ids(con, ["alice"])
+    engines = [usagedb]
+    try:
+        from ebihpc import vectorized
+    except ImportError:
+        pass
+    else:
+        engines.append(vectorized)
+
+    for engine in engines:
+        output, num_jobs = engine.process_jobs(jobs_db, FROM_DT, TO_DT,
+                                               user2index, transport="pipe")
+        assert num_jobs == 0
+        usagedb.update_usage(con, output)
+        assert read_usage(con, user2index) == {}
+
+    usagedb.reset_ledger(con, jobs_db)
+    usagedb.bump_update_times(con, FROM_DT)
+    assert usagedb.process_updates(con, jobs_db, user2index) == (FROM_DT, 0)
+    con.close()
+
+    track_usage = load_script("track-usage.py")
+    usage_db = str(tmp_path / "usage2.db")
+    monkeypatch.setattr(sys, "argv", ["track-usage.py", "--from",
+                                      "incremental", jobs_db, usage_db])
+    track_usage.main()
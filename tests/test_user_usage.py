@@ -0,0 +1,91 @@
+import pytest
+
+from ebihpc import usagedb
+
+
+
+def user_data(**kwargs) -> dict:
+    obj = usagedb._new_user_data()
+    obj.update(kwargs)
+    return obj
+
+
+def write(con, rows: dict, encoding: str = "json"):
+    logins = sorted({login for data in rows.values() for login in data})
+    user2index = usagedb.get_user_ids(con, logins)
+    usagedb.update_usage(con, list(usagedb.encode_intervals(
+        [(key, data, usagedb._new_jobs_data()) for key, data in rows.items()],
+        user2index, encoding
+    )))
+
+
+def read_user_usage(con) -> dict:
+    index2user = usagedb.get_user_logins(con)
+    return {
+        (time, index2user[user_id]): (jobs, co2e, cputime)
+        for time, user_id, jobs, co2e, cputime in con.execute(
+            "SELECT time, user_id, jobs, co2e, cputime FROM user_usage"
+        )
+    }
+
+
+@pytest.mark.parametrize("encoding", ["json", "binary"])
+def test_user_usage(tmp_path, encoding):
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    write(con, {
+        "202403010000": {"alice": user_data(jobs=0.5, co2e=1, cputime=60)},
+        "202403010015": {"alice": user_data(co2e=2),
+                         "bob": user_data(jobs=1, co2e=4)},
+    }, encoding)
+
+    # Created from existing usage rows
+    usagedb.create_user_usage(con)
+    assert read_user_usage(con) == {
+        ("202403010000", "alice"): (0.5, 1, 60),
+        ("202403010015", "alice"): (0, 2, 0),
+        ("202403010015", "bob"): (1, 4, 0),
+    }
+
+    # Kept up to date: replaced intervals, new users
+    write(con, {
+        "202403010015": {"carol": user_data(co2e=3)},
+        "202403010030": {"bob": user_data(co2e=1)},
+    }, encoding)
+    assert read_user_usage(con) == {
+        ("202403010000", "alice"): (0.5, 1, 60),
+        ("202403010015", "carol"): (0, 3, 0),
+        ("202403010030", "bob"): (0, 1, 0),
+    }
+    con.close()
+
+
+def test_user_usage_atomic(tmp_path, monkeypatch):
+    database = str(tmp_path / "usage.db")
+    con = usagedb.connect(database)
+    usagedb.create_user_usage(con)
+    write(con, {"202403010000": {"alice": user_data(co2e=1)}})
+
+    update_user_usage = usagedb._update_user_usage
+
+    def fail(*args):
+        update_user_usage(*args)
+        raise RuntimeError
+
+    # Usage of a new user, interrupted before the end of the write
+    monkeypatch.setattr(usagedb, "_update_user_usage", fail)
+    with pytest.raises(RuntimeError):
+        usagedb.update_usage(con, list(usagedb.encode_intervals(
+            [("202403010015", {"bob": user_data(co2e=2)},
+              usagedb._new_jobs_data())],
+            {}
+        )))
+    con.close()
+
+    # Nothing written: usage, user usage and user indices agree
+    con = usagedb.connect(database)
+    assert usagedb.get_user_logins(con) == {0: "alice"}
+    assert con.execute("SELECT time FROM usage").fetchall() == [
+        ("202403010000",)
+    ]
+    assert read_user_usage(con) == {("202403010000", "alice"): (0, 1, 0)}
+    con.close()
@@ -0,0 +1,91 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from ebihpc import usagedb
+from ebihpc.model import User
+
+from conftest import load_script
+
+
+START = datetime(2024, 2, 26)
+STOP = datetime(2024, 3, 12)
+DT_FMTS = ["%Y-%m-%d", "%Y-%W", "%Y-%m"]
+
+
+@pytest.fixture(scope="module")
+def view_usage():
+    return load_script("view-usage.py")
+
+
+def user_data(**kwargs) -> dict:
+    obj = usagedb._new_user_data()
+    obj.update(kwargs)
+    return obj
+
+
+def write(con, encodings: list[str]):
+    rnd = random.Random(5)
+    logins = ["alice", "bob", "carol", "dave"]
+    user2index = usagedb.get_user_ids(con, logins)
+    rows = []
+    for dt in usagedb.range_dt(START, STOP, timedelta(hours=3)):
+        users_data = {login: user_data(co2e=rnd.random())
+                      for login in logins if rnd.random() < 0.7}
+        rows += usagedb.encode_intervals(
+            [(dt.strftime(usagedb.DT_FMT), users_data,
+              usagedb._new_jobs_data())],
+            user2index, rnd.choice(encodings)
+        )
+
+    usagedb.update_usage(con, rows)
+    # carol in two teams, dave in none
+    usagedb.update_users(con, [User("alice", teams=["a"]),
+                               User("bob", teams=["b"]),
+                               User("carol", teams=["a", "b"]),
+                               User("dave")])
+
+
+def sum_python(view_usage, con, start: datetime, stop: datetime,
+               dt_fmt: str, weights: dict) -> dict:
+    users_usage = {}
+    for dt, users_co2e in view_usage.iter_usage(con, start, stop):
+        view_usage.add_usage(users_usage, dt.strftime(dt_fmt), users_co2e,
+                             weights)
+
+    return view_usage.to_teams(users_usage, weights)
+
+
+@pytest.mark.parametrize("user_table", [False, True],
+                         ids=["usage", "user_usage"])
+@pytest.mark.parametrize("encodings", [["json"], ["binary"],
+                                       ["json", "binary"]],
+                         ids=["json", "binary", "mixed"])
+@pytest.mark.parametrize("by_team", [False, True], ids=["all", "teams"])
+def test_sum_usage(tmp_path, view_usage, encodings, user_table, by_team):
+    con = usagedb.connect(str(tmp_path / "usage.db"))
+    write(con, encodings)
+    if user_table:
+        usagedb.create_user_usage(con)
+
+    if by_team:
+        weights = usagedb.get_team_weights(con)
+    else:
+        weights = {user.login: {"EMBL-EBI": 1}
+                   for user in usagedb.get_users(con)}
+
+    # Interval not aligned on days
+    start = START + timedelta(hours=5)
+    for dt_fmt in DT_FMTS:
+        expected = sum_python(view_usage, con, start, STOP, dt_fmt, weights)
+        usage = view_usage.sum_usage(con, start, STOP, dt_fmt, weights)
+        assert usage.keys() == expected.keys()
+        for dt_str, teams_usage in expected.items():
+            assert usage[dt_str] == pytest.approx(teams_usage)
+
+    assert len(expected) == 2
+    if by_team:
+        assert all(set(teams_usage) == {"a", "b"}
+                   for teams_usage in expected.values())
+    con.close()
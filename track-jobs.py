@@ -1,49 +1,162 @@
+import random
+import sqlite3
 import sys
+import time
 from argparse import ArgumentParser
 from datetime import datetime
+from itertools import islice
 
 from ebihpc import jobdb
-from ebihpc import lsf
+from ebihpc import schedulers
 from ebihpc.model import UnixUser
 
 
 def main():
     parser = ArgumentParser(description="Monitor jobs")
     parser.add_argument("-s", "--scheduler", default="lsf",
-                        choices=["lsf", "slurm"],
+                        choices=list(schedulers.SCHEDULERS),
                         help="job scheduler")
+    parser.add_argument("--clusters", metavar="FILE",
+                        help="JSON file of clusters to poll concurrently "
+                             "(replaces --scheduler and --window)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running, polling jobs every --interval "
+                             "seconds")
+    parser.add_argument("--interval", type=float, default=300,
+                        metavar="SECONDS",
+                        help="time between the start of two polls, "
+                             "default: 300")
+    parser.add_argument("--jitter", type=float, default=30,
+                        metavar="SECONDS",
+                        help="random delay added to --interval, default: 30")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="number of jobs written at once, "
+                             "default: 10000")
+    parser.add_argument("--window", type=float, default=6,
+                        metavar="HOURS",
+                        help="Slurm only: interval of time read by one "
+                             "sacct call, default: 6")
     parser.add_argument("database", help="job database")
     args = parser.parse_args()
 
-    if args.scheduler == "lsf":
-        jobs = lsf.get_jobs()
-    elif args.scheduler == "slurm":
-        raise NotImplementedError(args.scheduler)
+    if args.clusters:
+        clusters = schedulers.load_clusters(args.clusters)
     else:
-        raise NotImplementedError(args.scheduler)
+        clusters = [schedulers.Cluster(None, args.scheduler,
+                                       window=args.window)]
 
     con = jobdb.connect(args.database)
+
+    def get_jobs(failed: set[str]):
+        # Jobs that ended since the last complete poll, and jobs not finished
+        since = (jobdb.get_poll_time(con)
+                 or jobdb.get_latest_update_time(con))
+        return schedulers.iter_jobs(clusters, since, failed)
+
     users = jobdb.get_users(con)
+    # State of jobs last written, to only write jobs that changed
+    fingerprints = {}, {}
+
+    if not args.daemon:
+        poll(con, users, get_jobs, fingerprints, args.batch_size)
+        con.close()
+        return
+
+    try:
+        while True:
+            start = time.monotonic()
+            try:
+                poll(con, users, get_jobs, fingerprints, args.batch_size)
+            except sqlite3.OperationalError as exc:
+                # e.g. database locked: retry at next poll
+                con.rollback()
+                sys.stderr.write(f"{datetime.now():%Y-%m-%d %H:%M:%S}: "
+                                 f"{exc}\n")
+
+            # Polls do not overlap: a late poll is followed by the next one
+            delay = args.interval + random.uniform(0, args.jitter)
+            time.sleep(max(0.0, delay - (time.monotonic() - start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        con.close()
+
+
+def poll(con: sqlite3.Connection, users: dict[str, UnixUser], get_jobs,
+         fingerprints: tuple[dict, dict], batch_size: int = 10000):
+    start = time.monotonic()
+    update_time = datetime.now()
+    complete_fps, incomplete_fps = fingerprints
+
+    # Jobs are written as they are read, in batches
+    num_jobs = num_complete = num_incomplete = num_new_users = 0
+    written_complete = written_incomplete = 0
+    seen_complete = set()
+    seen_incomplete = set()
+    write_time = 0
+    # Clusters (stored schedulers) whose jobs were not all read
+    failed = set()
+    jobs = iter(get_jobs(failed))
+    while True:
+        batch = list(islice(jobs, batch_size))
+        if not batch:
+            break
+
+        complete = []
+        incomplete = []
+        new_users = {}
+        for job in batch:
+            job.update_time = update_time
+
+            if job.user not in users and job.user not in new_users:
+                user = new_users[job.user] = UnixUser(job.user)
+                user.init()
+
+            if job.finish_time is not None:
+                complete.append(job)
+                seen_complete.add(job.accession)
+            else:
+                incomplete.append(job)
+                seen_incomplete.add(job.accession)
+
+        t = time.monotonic()
+        written_complete += jobdb.update_jobs(con, complete, complete_fps)
+        written_incomplete += jobdb.update_incompletes(con, incomplete,
+                                                       incomplete_fps)
+        jobdb.update_users(con, list(new_users.values()))
+        users.update(new_users)
+        write_time += time.monotonic() - t
 
-    complete = []
-    incomplete = []
-    for job in jobs:
-        if job.user not in users:
-            users[job.user] = UnixUser(job.user)
-            users[job.user].init()
+        num_jobs += len(batch)
+        num_complete += len(complete)
+        num_incomplete += len(incomplete)
+        num_new_users += len(new_users)
 
-        if job.finish_time is not None:
-            complete.append(job)
-        else:
-            incomplete.append(job)
+    # Jobs of failed clusters not listed may still be running
+    t = time.monotonic()
+    removed = jobdb.remove_incompletes(con, seen_incomplete, incomplete_fps,
+                                       failed)
+    if not failed:
+        # Otherwise jobs that ended since the last poll are read again
+        jobdb.update_poll_time(con, update_time)
+    write_time += time.monotonic() - t
 
-    jobdb.update_jobs(con, complete)
-    jobdb.update_incompletes(con, incomplete)
-    jobdb.update_users(con, list(users.values()))
+    if not failed:
+        # Jobs no longer listed are not written again
+        for accession in complete_fps.keys() - seen_complete:
+            del complete_fps[accession]
 
+    failures = f", failed: {', '.join(sorted(failed))}" if failed else ""
     sys.stderr.write(f"{datetime.now():%Y-%m-%d %H:%M:%S}: "
-                     f"{len(incomplete):,} jobs pending or running, "
-                     f"{len(jobs):,} jobs updated\n")
+                     f"{num_incomplete:,} jobs pending or running, "
+                     f"{num_jobs:,} jobs updated "
+                     f"(finished written: {written_complete:,}, "
+                     f"running written: {written_incomplete:,}, "
+                     f"running removed: {removed:,}, "
+                     f"fetch: {time.monotonic() - start - write_time:.1f}s, "
+                     f"write: {write_time:.1f}s, "
+                     f"new users: {num_new_users:,}"
+                     f"{failures})\n")
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ from argparse import ArgumentParser
 from concurrent.futures import as_completed, ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+from ebihpc import ebisearch
 from ebihpc import jobdb
 from ebihpc import usagedb
 from ebihpc.model import User
@@ -13,18 +14,59 @@ from ebihpc.model import User
 def main():
     parser = ArgumentParser(description="Calculate carbon footprint of jobs")
     parser.add_argument("--from", dest="from_time", default="auto",
-                        metavar="auto|today|yesterday|YYYY-MM-DD")
+                        metavar="auto|incremental|today|yesterday|YYYY-MM-DD")
     parser.add_argument("--to", dest="to_time", metavar="YYYY-MM-DD")
     parser.add_argument("--verbose", action="store_true", help="show progress")
     parser.add_argument("--update-users", choices=["yes", "no"], default="yes",
                         help="if 'yes', update users metadata")
     parser.add_argument("--users", help="JSON file of custom users metadata")
+    parser.add_argument("--search-url", default=ebisearch.URL, metavar="URL",
+                        help="EBI Search endpoint of users metadata")
+    parser.add_argument("--search-cache", metavar="FILE",
+                        help="cache of EBI Search responses")
+    parser.add_argument("--search-ttl", type=float, default=168,
+                        metavar="HOURS",
+                        help="hours before cached responses are fetched "
+                             "again, default: 168")
+    parser.add_argument("--search-workers", type=int, default=8,
+                        help="number of concurrent EBI Search requests, "
+                             "default: 8")
+    parser.add_argument("--search-batch", type=int, default=50,
+                        help="number of users per EBI Search request, "
+                             "default: 50; expired responses of a request "
+                             "are only revalidated if all its users are "
+                             "looked up again, while with 1 each user is "
+                             "revalidated, at the cost of one request each")
     parser.add_argument("--workers", type=int, default=1,
                         help="number of workers")
+    parser.add_argument("--engine", choices=["python", "numpy"],
+                        default="python",
+                        help="jobs processing engine, default: python")
+    parser.add_argument("--archive", metavar="DIR",
+                        help="read finished jobs from a columnar archive")
+    parser.add_argument("--slice", type=int, default=1440, metavar="MINUTES",
+                        help="process days in slices of MINUTES (multiple "
+                             "of 15), default: 1440")
+    parser.add_argument("--encoding", choices=["json", "binary"],
+                        default="json",
+                        help="encoding of usage data, default: json")
+    parser.add_argument("--user-table", action="store_true",
+                        help="also store usage in a per-user table, "
+                             "used by view-usage.py")
+    parser.add_argument("--rollups", action="store_true",
+                        help="also store usage summed by hour, day, week, "
+                             "and month, used by view-usage.py")
+    parser.add_argument("--transport", choices=["file", "pipe"],
+                        default="pipe",
+                        help="how workers return usage: 'file' (temporary "
+                             "file) or 'pipe' (encoded rows), default: pipe")
     parser.add_argument("input", help="job database")
     parser.add_argument("output", help="usage database")
     args = parser.parse_args()
 
+    if args.slice % 15 or not 15 <= args.slice <= 1440:
+        parser.error("--slice must be a multiple of 15, between 15 and 1440")
+
     logging.basicConfig(format="%(asctime)s    %(levelname)s:    %(message)s",
                         datefmt="%Y-%m-%d %H:%M:%S",
                         level=logging.DEBUG if args.verbose else logging.INFO)
@@ -34,14 +76,25 @@ def main():
     unix_users = jobdb.get_users(con)
     last_jobs_update = jobdb.get_latest_update_time(con)
     con.close()
+    if last_jobs_update is None:
+        logging.info("No jobs to process")
+        return
 
     # Load (and update) users
     con = usagedb.connect(args.output)
+    if args.user_table:
+        usagedb.create_user_usage(con)
+    if args.rollups:
+        usagedb.create_rollups(con)
+
     users = {}
     for user in usagedb.get_users(con, unix_users):
         users[user.login] = user
-        if args.update_users == "yes":
-            user.update()
+
+    if args.update_users == "yes":
+        outdated = list(users.values())
+    else:
+        outdated = []
 
     # Add Unix users
     for unix_user in unix_users.values():
@@ -49,58 +102,60 @@ def main():
             user = User(login=unix_user.login,
                         group=unix_user.group,
                         groups=unix_user.groups)
-            user.update()
+            outdated.append(user)
             users[user.login] = user
 
-    # Override existing users with custom ones
     if args.users:
         with open(args.users, "rt") as fh:
             custom_users = json.load(fh)
 
-        for login, meta in custom_users.items():
-            try:
-                user = users[login]
-            except KeyError:
+        for login in custom_users:
+            if login not in users:
                 user = users[login] = User(login)
-                user.update()
-
-            if meta["name"]:
-                if user.name and user.name != meta["name"]:
-                    logging.warning(f"{login}: {meta['name']} ≠ "
-                                    f"{user.name} (name)")
-                user.name = meta["name"]
-
-            if meta["position"]:
-                if user.position and user.position != meta["position"]:
-                    logging.warning(f"{login}: {meta['position']} ≠ "
-                                    f"{user.position} (position)")
-                user.position = meta["position"]
-
-            if meta["teams"]:
-                if user.teams and user.teams != meta["teams"]:
-                    logging.warning(f"{login}: {', '.join(meta['teams'])} ≠ "
-                                    f"{', '.join(user.teams)} (teams)")
-                user.teams = meta["teams"]
-
-            if meta["sponsor"]:
-                if user.sponsor and user.sponsor != meta["sponsor"]:
-                    logging.warning(f"{login}: {meta['sponsor']} ≠ "
-                                    f"{user.sponsor} (sponsor)")
-                user.sponsor = meta["sponsor"]
+                outdated.append(user)
     else:
         custom_users = {}
 
+    ebisearch.update_users(outdated, args.search_url, args.search_cache,
+                           int(args.search_ttl * 3600), args.search_workers,
+                           args.search_batch)
+
+    # Override existing users with custom ones
+    for login, meta in custom_users.items():
+        user = users[login]
+        if meta["name"]:
+            if user.name and user.name != meta["name"]:
+                logging.warning(f"{login}: {meta['name']} ≠ "
+                                f"{user.name} (name)")
+            user.name = meta["name"]
+
+        if meta["position"]:
+            if user.position and user.position != meta["position"]:
+                logging.warning(f"{login}: {meta['position']} ≠ "
+                                f"{user.position} (position)")
+            user.position = meta["position"]
+
+        if meta["teams"]:
+            if user.teams and user.teams != meta["teams"]:
+                logging.warning(f"{login}: {', '.join(meta['teams'])} ≠ "
+                                f"{', '.join(user.teams)} (teams)")
+            user.teams = meta["teams"]
+
+        if meta["sponsor"]:
+            if user.sponsor and user.sponsor != meta["sponsor"]:
+                logging.warning(f"{login}: {meta['sponsor']} ≠ "
+                                f"{user.sponsor} (sponsor)")
+            user.sponsor = meta["sponsor"]
+
     for user in users.values():
         if not user.teams:
             s = " (custom) " if user.login in custom_users else " "
             logging.warning(f"{user.login}{s}is not in any team "
                             f"(groups: {user.groups or 'N/A'})")
 
-    user2index = {}
-    for i, user in enumerate(users.values()):
-        user2index[user.login] = i
+    user2index = usagedb.get_user_ids(con, list(users))
 
-    if args.from_time == "auto":
+    if args.from_time in ("auto", "incremental"):
         dt = usagedb.get_latest_update_time(con, "usage") - timedelta(days=1)
         from_time = datetime(dt.year, dt.month, dt.day)
     elif args.from_time == "today":
@@ -118,20 +173,43 @@ def main():
         dt = datetime.today() + timedelta(days=1)
         to_time = datetime(dt.year, dt.month, dt.day)
 
-    logging.info("Processing jobs")
-    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
-        fs = {}
-        for dt in usagedb.range_dt(from_time, to_time, timedelta(days=1)):
-            dt2 = dt + timedelta(days=1)
-            f = executor.submit(usagedb.process_jobs,
-                                args.input, dt, dt2, user2index)
-            fs[f] = dt.strftime("%Y-%m-%d")
-
-        for f in as_completed(fs):
-            output, num_jobs = f.result()
-            usagedb.update_usage(con, output)
-            os.unlink(output)
-            logging.info(f"{fs[f]}: {num_jobs:,} jobs processed")
+    if args.engine == "numpy":
+        from ebihpc import vectorized
+        process_jobs = vectorized.process_jobs
+    else:
+        process_jobs = usagedb.process_jobs
+
+    if args.from_time == "incremental" and usagedb.has_ledger(con):
+        logging.info("Processing updated jobs")
+        last_jobs_update, num_jobs = usagedb.process_updates(con, args.input,
+                                                             user2index,
+                                                             args.encoding)
+        logging.info(f"{num_jobs:,} jobs processed")
+    else:
+        logging.info("Processing jobs")
+        slices = get_slices(args.input, from_time, to_time,
+                            timedelta(minutes=args.slice))
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            fs = {}
+            for dt, dt2, day in slices:
+                f = executor.submit(process_jobs, args.input, dt, dt2,
+                                    user2index, args.archive, args.transport,
+                                    day, args.encoding)
+                if args.slice < 1440:
+                    fs[f] = dt.strftime("%Y-%m-%d %H:%M")
+                else:
+                    fs[f] = dt.strftime("%Y-%m-%d")
+
+            for f in as_completed(fs):
+                output, num_jobs = f.result()
+                usagedb.update_usage(con, output)
+                if args.transport == "file":
+                    os.unlink(output)
+                logging.info(f"{fs[f]}: {num_jobs:,} jobs processed")
+
+        if args.from_time == "incremental" or usagedb.has_ledger(con):
+            # Jobs whose updates the next incremental run will apply
+            usagedb.reset_ledger(con, args.input)
 
     usagedb.bump_update_times(con, last_jobs_update)
     usagedb.update_users(con, list(users.values()))
@@ -139,5 +217,23 @@ def main():
     logging.info("Done")
 
 
+def get_slices(database: str, from_time: datetime, to_time: datetime,
+               step: timedelta) -> list[tuple]:
+    # Slices of days, aligned on days so that each 15-minute interval
+    # is computed by one slice
+    slices = []
+    for day in usagedb.range_dt(from_time, to_time, timedelta(days=1)):
+        day_end = day + timedelta(days=1)
+        for dt in usagedb.range_dt(day, day_end, step):
+            slices.append((dt, min(dt + step, day_end), (day, day_end)))
+
+    # Largest slices first, so the pool is not waiting for a last large one
+    con = jobdb.connect(database)
+    num_jobs = {s: jobdb.count_jobs(con, s[0], s[1]) for s in slices}
+    con.close()
+    slices.sort(key=lambda s: -num_jobs[s])
+    return slices
+
+
 if __name__ == '__main__':
     main()
@@ -18,6 +18,11 @@ def main():
     parser.add_argument("-f", "--format",
                         choices=["jsonl", "tsv"], default="tsv",
                         help="output format, default: tsv")
+    parser.add_argument("--archive", metavar="DIR",
+                        help="read finished jobs from a columnar archive")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes reading jobs, one day "
+                             "at a time")
     parser.add_argument("database", help="database file")
     args = parser.parse_args()
 
@@ -52,7 +57,9 @@ def main():
             "Finish time"
         ]))
 
-    for job in jobdb.find_jobs(args.database, from_dt, to_dt, args.user):
+    for job in jobdb.find_jobs(args.database, from_dt, to_dt, args.user,
+                               workers=args.workers,
+                               archive_dir=args.archive):
         if to_jsonl:
             print(json.dumps(job.to_dict()))
         else:
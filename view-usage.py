@@ -1,4 +1,3 @@
-import json
 import sqlite3
 from argparse import ArgumentParser
 from datetime import datetime, timedelta
@@ -6,7 +5,26 @@ from datetime import datetime, timedelta
 from ebihpc import usagedb
 
 
-def iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime):
+# Rollups summing whole intervals, coarsest first
+ROLLUP_PERIODS = {
+    "day": ["day", "hour"],
+    "week": ["week", "day", "hour"],
+    "month": ["month", "day", "hour"]
+}
+
+
+def iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime,
+               logins: list[str] | None = None,
+               periods: list[str] | None = None):
+    # CO2e of users, in 15-minute intervals, or in periods if rollups are used
+    if periods:
+        yield from iter_rollups(con, start, stop, logins, periods)
+        return
+    elif usagedb.has_user_usage(con):
+        yield from iter_user_rows(con, "user_usage", start, stop, logins)
+        return
+
+    index2user = usagedb.get_user_logins(con)
     for dt_str, raw_data in con.execute(
         """
             SELECT time, users_data 
@@ -17,7 +35,190 @@ def iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime):
         [start.strftime(usagedb.DT_FMT), stop.strftime(usagedb.DT_FMT)]
     ):
         dt = datetime.strptime(dt_str, usagedb.DT_FMT)
-        yield dt, json.loads(raw_data)
+        users_data = usagedb.decode_users_data(raw_data, index2user)
+        yield dt, {user: data["co2e"] for user, data in users_data.items()}
+
+
+def iter_rollups(con: sqlite3.Connection, start: datetime, stop: datetime,
+                 logins: list[str] | None, periods: list[str]):
+    period, *finer = periods
+    new_year = datetime(start.year + 1, 1, 1)
+    if period == "week" and new_year < stop:
+        # Weeks are labelled by year: do not merge the last and first weeks
+        yield from iter_rollups(con, start, new_year, logins, periods)
+        yield from iter_rollups(con, new_year, stop, logins, periods)
+        return
+
+    first = usagedb.ceil_period(start, period)
+    last = usagedb.floor_period(stop, period)
+    if first >= last:
+        yield from iter_usage(con, start, stop, logins, finer)
+        return
+
+    if start < first:
+        yield from iter_usage(con, start, first, logins, finer)
+
+    yield from iter_user_rows(con, "user_rollup", first, last, logins, period)
+
+    if last < stop:
+        yield from iter_usage(con, last, stop, logins, finer)
+
+
+def iter_user_rows(con: sqlite3.Connection, table: str, start: datetime,
+                   stop: datetime, logins: list[str] | None = None,
+                   period: str | None = None):
+    index2user = usagedb.get_user_logins(con)
+    params = [start.strftime(usagedb.DT_FMT), stop.strftime(usagedb.DT_FMT)]
+    if period is not None:
+        period_filter = "AND period = ?"
+        params.append(period)
+    else:
+        period_filter = ""
+
+    if logins is not None:
+        user2index = {login: i for i, login in index2user.items()}
+        ids = [user2index[login] for login in logins if login in user2index]
+        user_filter = f"AND user_id IN ({','.join('?' * len(ids))})"
+        params += ids
+    else:
+        user_filter = ""
+
+    dt_str = None
+    users_co2e = {}
+    for time, user_id, co2e in con.execute(
+        f"""
+            SELECT time, user_id, co2e
+            FROM {table}
+            WHERE time >= ? AND time < ?
+              {period_filter}
+              {user_filter}
+            ORDER BY time, user_id
+        """,
+        params
+    ):
+        if time != dt_str:
+            if users_co2e:
+                yield datetime.strptime(dt_str, usagedb.DT_FMT), users_co2e
+
+            dt_str = time
+            users_co2e = {}
+
+        users_co2e[index2user[user_id]] = co2e
+
+    if users_co2e:
+        yield datetime.strptime(dt_str, usagedb.DT_FMT), users_co2e
+
+
+def add_usage(users_usage: dict[str, dict], dt_str: str,
+              users_co2e: dict[str, float], weights: dict[str, dict]):
+    try:
+        period_usage = users_usage[dt_str]
+    except KeyError:
+        period_usage = users_usage[dt_str] = {}
+
+    for user, co2e in users_co2e.items():
+        if user in weights:
+            try:
+                period_usage[user][0] += co2e
+            except KeyError:
+                period_usage[user] = [co2e]
+
+
+def to_teams(users_usage: dict[str, dict],
+             weights: dict[str, dict]) -> dict[str, dict]:
+    usage = {}
+    for dt_str, period_usage in users_usage.items():
+        teams_usage = usagedb.project_teams(period_usage, weights)
+        usage[dt_str] = {team: co2e for team, (co2e,) in teams_usage.items()}
+
+    return usage
+
+
+def sum_usage(con: sqlite3.Connection, start: datetime, stop: datetime,
+              dt_fmt: str, weights: dict[str, dict]) -> dict[str, dict]:
+    # CO2e of teams by period, summed by SQLite
+    con.execute("CREATE TEMP TABLE user_team (login TEXT, team TEXT, "
+                "weight REAL)")
+    con.executemany("INSERT INTO user_team VALUES (?, ?, ?)",
+                    [(login, team, weight)
+                     for login, teams in weights.items()
+                     for team, weight in teams.items()])
+    con.execute("CREATE INDEX temp.user_team_login ON user_team (login)")
+
+    # Usage summed by day and user first, then by period and team
+    by_period = """
+        SELECT strftime(?, substr(d.day, 1, 4) || '-' ||
+                           substr(d.day, 5, 2) || '-' ||
+                           substr(d.day, 7, 2)),
+               t.team, SUM(d.co2e * t.weight)
+        FROM ({days}) d
+        INNER JOIN user_team t ON t.login = d.login
+        GROUP BY 1, 2
+    """
+    params = [dt_fmt, start.strftime(usagedb.DT_FMT),
+              stop.strftime(usagedb.DT_FMT)]
+    if usagedb.has_user_usage(con):
+        days = """
+            SELECT substr(u.time, 1, 8) AS day, i.login, SUM(u.co2e) AS co2e
+            FROM user_usage u
+            INNER JOIN user_index i ON i.id = u.user_id
+            WHERE u.time >= ? AND u.time < ?
+            GROUP BY 1, 2
+        """
+        rows = con.execute(by_period.format(days=days), params).fetchall()
+        binary_rows = []
+    else:
+        days = """
+            SELECT substr(u.time, 1, 8) AS day, j.key AS login,
+                   SUM(json_extract(j.value, '$.co2e')) AS co2e
+            FROM usage u, json_each(u.users_data) j
+            WHERE u.time >= ? AND u.time < ?
+              AND typeof(u.users_data) = 'text'
+            GROUP BY 1, 2
+        """
+        rows = con.execute(by_period.format(days=days), params).fetchall()
+
+        # Binary rows cannot be read by SQLite
+        binary_rows = con.execute(
+            """
+                SELECT time, users_data
+                FROM usage
+                WHERE time >= ? AND time < ?
+                  AND typeof(users_data) != 'text'
+            """,
+            params[1:]
+        )
+
+    usage = {}
+    for dt_str, team, co2e in rows:
+        try:
+            usage[dt_str][team] = co2e
+        except KeyError:
+            usage[dt_str] = {team: co2e}
+
+    index2user = usagedb.get_user_logins(con)
+    users_usage = {}
+    for dt_str, raw_data in binary_rows:
+        dt_str = datetime.strptime(dt_str, usagedb.DT_FMT).strftime(dt_fmt)
+        users_data = usagedb.decode_users_data(raw_data, index2user)
+        add_usage(users_usage, dt_str,
+                  {user: data["co2e"] for user, data in users_data.items()},
+                  weights)
+
+    for dt_str, teams_usage in to_teams(users_usage, weights).items():
+        try:
+            period_usage = usage[dt_str]
+        except KeyError:
+            usage[dt_str] = teams_usage
+        else:
+            for team, co2e in teams_usage.items():
+                try:
+                    period_usage[team] += co2e
+                except KeyError:
+                    period_usage[team] = co2e
+
+    con.execute("DROP TABLE temp.user_team")
+    return usage
 
 
 def main():
@@ -38,17 +239,24 @@ def main():
                         help="List of users (default: all users)")
     parser.add_argument("--unit", choices=["g", "kg", "t"], default="kg",
                         help="Unit of CO2-equivalent (default: kg)")
+    parser.add_argument("--engine", choices=["python", "sql"],
+                        default="python",
+                        help="Sum usage in Python or in SQLite "
+                             "(default: python)")
     parser.add_argument("--database", required=True, help="Usage database")
     args = parser.parse_intermixed_args()
 
     con = sqlite3.connect(args.database)
 
-    users = {}
-    for user in usagedb.get_users(con):
-        users[user.login] = user.teams if args.by_team else ["EMBL-EBI"]
+    # Usage of users split between their teams
+    if args.by_team:
+        weights = usagedb.get_team_weights(con)
+    else:
+        weights = {user.login: {"EMBL-EBI": 1}
+                   for user in usagedb.get_users(con)}
 
     if args.users:
-        users = {k: v for k, v in users.items() if k in args.users}
+        weights = {k: v for k, v in weights.items() if k in args.users}
 
     dt_fmt = {
         "day": "%Y-%m-%d",
@@ -73,28 +281,30 @@ def main():
         dt_str = dt.strftime(dt_fmt)
         usage[dt_str] = {}
 
-    total = {}
-    for dt, users_data in iter_usage(con, start, stop):
-        dt_str = dt.strftime(dt_fmt)
+    if args.engine == "sql":
+        usage.update(sum_usage(con, start, stop, dt_fmt, weights))
+    else:
+        if usagedb.has_rollups(con):
+            periods = ROLLUP_PERIODS[args.interval]
+        else:
+            periods = None
 
-        for user in users_data:
-            if user in users:
-                co2e = users_data[user]["co2e"]
+        users_usage = {}
+        logins = list(weights) if args.users else None
+        for dt, users_co2e in iter_usage(con, start, stop, logins, periods):
+            add_usage(users_usage, dt.strftime(dt_fmt), users_co2e, weights)
 
-                try:
-                    teams_usage = usage[dt_str]
-                except KeyError:
-                    teams_usage = usage[dt_str] = {}
+        usage.update(to_teams(users_usage, weights))
 
-                for team in users[user]:
-                    try:
-                        teams_usage[team] += co2e
-                    except KeyError:
-                        teams_usage[team] = total[team] = co2e
-                    else:
-                        total[team] += co2e
+    total = {}
+    for teams_usage in usage.values():
+        for team, co2e in teams_usage.items():
+            try:
+                total[team] += co2e
+            except KeyError:
+                total[team] = co2e
 
-    teams = sorted(total, key=lambda k: -total[k])
+    teams = sorted(total, key=lambda k: (-total[k], k))
 
     if args.num_series > 0:
         if len(teams) > args.num_series: